@@ -0,0 +1,89 @@
+"""
+Compare cases/second of the thread and asyncio evaluation engines.
+
+Both engines run `PromptEvaluator` against a local fake Messages endpoint
+with a fixed per-request latency, so the numbers reflect how well each engine
+keeps requests in flight rather than real model speed.
+
+    python benchmarks/bench_async_eval.py --cases 500 --latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from bench_utils import load_lesson_module, point_clients_at
+from fake_messages_api import serve_in_subprocess
+
+
+def make_dataset(path, num_cases):
+    dataset = [
+        {
+            "prompt_inputs": {"topic": f"topic {i}"},
+            "solution_criteria": ["Mentions the topic"],
+            "task_description": "Write one sentence about a topic",
+            "scenario": f"Scenario {i}",
+        }
+        for i in range(num_cases)
+    ]
+    with open(path, "w") as f:
+        json.dump(dataset, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cases", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--threads", type=int, default=6)
+    parser.add_argument("--in-flight", type=int, default=200)
+    args = parser.parse_args()
+
+    with serve_in_subprocess(args.latency) as url, tempfile.TemporaryDirectory() as tmp:
+        point_clients_at(url)
+        lesson = load_lesson_module("prompts/007_prompt_engineering_techniques.py")
+        # Measure real requests, not replays from the response cache
+        lesson.response_cache.enabled = False
+
+        dataset_file = os.path.join(tmp, "dataset.json")
+        make_dataset(dataset_file, args.cases)
+        outputs = {
+            "json_output_file": os.path.join(tmp, "output.json"),
+            "html_output_file": os.path.join(tmp, "output.html"),
+            "jsonl_output_file": os.path.join(tmp, "output.jsonl"),
+            "metrics_output_file": os.path.join(tmp, "metrics.json"),
+        }
+
+        def run_prompt(prompt_inputs):
+            messages = []
+            lesson.add_user_message(messages, f"Write about {prompt_inputs['topic']}")
+            return lesson.chat(messages)
+
+        async def arun_prompt(prompt_inputs):
+            messages = []
+            lesson.add_user_message(messages, f"Write about {prompt_inputs['topic']}")
+            return await lesson.achat(messages)
+
+        evaluator = lesson.PromptEvaluator(
+            max_concurrent_tasks=args.threads,
+            max_in_flight_requests=args.in_flight,
+        )
+
+        start = time.perf_counter()
+        evaluator.run_evaluation(run_prompt, dataset_file, **outputs)
+        thread_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        asyncio.run(evaluator.run_evaluation_async(arun_prompt, dataset_file, **outputs))
+        async_elapsed = time.perf_counter() - start
+
+    print()
+    print(f"{args.cases} cases, {args.latency * 1000:.0f} ms fake latency per request")
+    print(f"thread engine ({args.threads} workers):    {args.cases / thread_elapsed:8.1f} cases/s")
+    print(f"async engine ({args.in_flight} in flight): {args.cases / async_elapsed:8.1f} cases/s")
+    print(f"speedup: {thread_elapsed / async_elapsed:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Exercise the Message Batches backend against the local batch stub.
+
+Runs `006_eval_workflow.run_eval_batch` and
+`PromptEvaluator.run_evaluation_batch` end to end, checks that every case
+comes back joined to its prompt output and grade, and reports throughput and
+cost per case.
+
+    python benchmarks/bench_batch_backend.py --cases 1000 --batch-latency 2
+"""
+import argparse
+import os
+import tempfile
+
+from bench_utils import load_lesson_module, point_clients_at
+from bench_async_eval import make_dataset
+from fake_messages_api import FakeMessagesAPI
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cases", type=int, default=1000)
+    parser.add_argument("--batch-latency", type=float, default=2.0)
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    with FakeMessagesAPI(batch_latency=args.batch_latency) as server, tempfile.TemporaryDirectory() as tmp:
+        point_clients_at(server.url)
+        # run_eval_batch writes eval_results.json to the working directory
+        os.chdir(tmp)
+
+        workflow = load_lesson_module("prompts/006_eval_workflow.py")
+        tasks = [
+            {"task": f"Write a regex that matches bucket name {i}", "format": "regex"}
+            for i in range(args.cases)
+        ]
+        print("--- 006_eval_workflow.run_eval_batch")
+        results = workflow.run_eval_batch(tasks, poll_interval=args.poll_interval)
+        assert len(results) == args.cases
+        assert all(result["test_case"] is task for result, task in zip(results, tasks))
+
+        lesson = load_lesson_module("prompts/007_prompt_engineering_techniques.py")
+        dataset_file = os.path.join(tmp, "dataset.json")
+        make_dataset(dataset_file, args.cases)
+
+        def build_prompt_request(prompt_inputs):
+            messages = []
+            lesson.add_user_message(messages, f"Write about {prompt_inputs['topic']}")
+            return {"messages": messages}
+
+        print("--- PromptEvaluator.run_evaluation_batch")
+        results = lesson.PromptEvaluator().run_evaluation_batch(
+            build_prompt_request,
+            dataset_file,
+            json_output_file=os.path.join(tmp, "output.json"),
+            html_output_file=os.path.join(tmp, "output.html"),
+            poll_interval=args.poll_interval,
+        )
+        assert len(results) == args.cases
+        assert len({result["test_case"]["scenario"] for result in results}) == args.cases
+        os.chdir(cwd)
+
+    print(f"\nBoth backends returned all {args.cases} cases; {len(server.batches)} batches submitted")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Calls saved and throughput of batched vs per-case grading, and with
+`--live` how well the two agree.
+
+Every output in output.json is graded again, once per case with
+grade_output and once through PromptEvaluator's batched grader, with
+`--workers` grading threads each. The cases come from dataset.json, so the
+run fails if the two files have drifted apart. `--repeat` grades each case
+several times, to give the batcher more cases to pack.
+
+By default this runs against the fake Messages API, which gives every case
+the same grade. That checks the plumbing and measures calls and throughput,
+but says nothing about grade quality, so no agreement is reported. Pass
+`--live` to grade with the real API; it needs ANTHROPIC_API_KEY and costs
+tokens, and prints how often the two grades agree, exactly and within one
+point, and how each compares with the score stored in output.json.
+
+    python benchmarks/bench_batched_grading.py --repeat 20 --budget 6000
+    python benchmarks/bench_batched_grading.py --live --budget 6000
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import time
+from statistics import mean
+
+from bench_utils import REPO_ROOT, load_lesson_module, point_clients_at
+from fake_messages_api import serve_in_subprocess
+
+
+def load_cases():
+    with open(os.path.join(REPO_ROOT, "dataset.json")) as f:
+        dataset = json.load(f)
+    with open(os.path.join(REPO_ROOT, "output.json")) as f:
+        results = json.load(f)
+    cases = []
+    for result in results:
+        if result["test_case"] not in dataset:
+            raise SystemExit(f"output.json case not in dataset.json: {result['test_case']['scenario']}")
+        cases.append((result["test_case"], result["output"], result["score"]))
+    return cases
+
+
+def grade_all(grade, items, workers):
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        grades = list(pool.map(lambda item: grade(*item), items))
+    return time.perf_counter() - start, [grade["score"] for grade in grades]
+
+
+def agreement(a, b):
+    exact = sum(1 for x, y in zip(a, b) if x == y) / len(a)
+    within_one = sum(1 for x, y in zip(a, b) if abs(x - y) <= 1) / len(a)
+    return f"{exact:.0%} exact, {within_one:.0%} within 1, mean |diff| {mean(abs(x - y) for x, y in zip(a, b)):.2f}"
+
+
+def run(lesson, args):
+    # Grade for real every time, not from the response cache
+    lesson.response_cache.enabled = False
+    cases = load_cases() * args.repeat
+    items = [(test_case, output) for test_case, output, _ in cases]
+    stored = [score for _, _, score in cases]
+
+    evaluator = lesson.PromptEvaluator(
+        max_concurrent_tasks=args.workers,
+        grading_batch_tokens=args.budget,
+        grading_batch_size=args.batch_size,
+    )
+    single_time, single_scores = grade_all(
+        lambda test_case, output: evaluator.grade_output(test_case, output, None),
+        items,
+        args.workers,
+    )
+    batched_time, batched_scores = grade_all(
+        evaluator.batch_grader(None), items, evaluator.grading_workers
+    )
+    stats = evaluator.grading_batch_stats
+
+    print(f"{len(items)} grades ({len(items) // args.repeat} cases x {args.repeat}), "
+          f"budget {args.budget} tokens, up to {args.batch_size} per call")
+    print(f"per-case: {len(items)} calls, {single_time:.2f}s ({len(items) / single_time:.1f} cases/s)")
+    print(f"batched:  {stats.summary()}")
+    print(f"          {batched_time:.2f}s ({len(items) / batched_time:.1f} cases/s, "
+          f"{single_time / batched_time:.1f}x)")
+    if args.live:
+        print(f"batched vs per-case:      {agreement(batched_scores, single_scores)}")
+        print(f"per-case vs output.json:  {agreement(single_scores, stored)}")
+        print(f"batched vs output.json:   {agreement(batched_scores, stored)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--live", action="store_true")
+    parser.add_argument("--repeat", type=int, default=None)
+    parser.add_argument("--budget", type=int, default=6000)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.live:
+        args.repeat = args.repeat or 1
+        run(load_lesson_module("prompts/007_prompt_engineering_techniques.py"), args)
+        return
+
+    args.repeat = args.repeat or 20
+    with serve_in_subprocess(args.latency) as url:
+        point_clients_at(url)
+        run(load_lesson_module("prompts/007_prompt_engineering_techniques.py"), args)
+        print("(fake API: every grade is 8, so grade agreement is not measured; use --live)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Connection reuse and pool-wait time of the shared client in prompts/clients.py.
+
+Two phases of `--requests` calls each, made by `--workers` threads, with a
+`--pause` in between, as generate_dataset and run_evaluation would make them.
+The fake Messages API runs in a child process. Three pool configurations are
+compared, all measured by PoolMetricsTransport:
+
+* SDK defaults: up to 1000 connections, idle ones dropped after 5 seconds
+* sized to workers: what ClientFactory.reserve(workers) builds
+* undersized: 2 connections for all the workers, to show pool waits
+
+    python benchmarks/bench_client_pool.py --workers 8 --requests 400 --pause 6
+"""
+import argparse
+import concurrent.futures
+import time
+
+import httpx
+from anthropic import DEFAULT_CONNECTION_LIMITS
+
+from bench_utils import load_lesson_module
+from fake_messages_api import serve_in_subprocess
+
+
+def phase(client, workers, requests):
+    def call(i):
+        client.messages.create(
+            model="claude-haiku-4-5",
+            max_tokens=100,
+            messages=[{"role": "user", "content": f"Say hello #{i}"}],
+        )
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(call, range(requests)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--pause", type=float, default=6.0)
+    args = parser.parse_args()
+
+    clients = load_lesson_module("prompts/clients.py")
+    configs = [
+        ("SDK defaults", DEFAULT_CONNECTION_LIMITS),
+        ("sized to workers", clients.connection_limits(args.workers)),
+        ("undersized (2)", httpx.Limits(max_connections=2, max_keepalive_connections=2)),
+    ]
+
+    print(
+        f"{args.workers} workers, 2 x {args.requests} requests, "
+        f"{args.pause:.0f}s pause, HTTP/2 available: {clients.HTTP2_AVAILABLE}"
+    )
+    with serve_in_subprocess(args.latency) as url:
+        for label, limits in configs:
+            metrics = clients.PoolMetrics()
+            client = clients.make_client(
+                args.workers, metrics, limits=limits,
+                base_url=url, api_key="fake-key-for-benchmarks", max_retries=0,
+            )
+            first = phase(client, args.workers, args.requests)
+            time.sleep(args.pause)
+            second = phase(client, args.workers, args.requests)
+            client.close()
+            rate = 2 * args.requests / (first + second)
+            print(f"{label}: {rate:.0f} req/s; {metrics.summary()}")
+
+
+if __name__ == "__main__":
+    main()
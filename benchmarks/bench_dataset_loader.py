@@ -0,0 +1,151 @@
+"""
+Lazy JSONL datasets vs json.load.
+
+Writes `--cases` test cases as a JSON array and as JSONL. Part one times
+the loader alone: json.load of the array (with its peak memory), the first
+and all test cases from JsonlDataset, building and reusing its line index,
+a random sample of 1000 and shard 3/8.
+
+Part two times run_evaluation against the fake Messages API from the call
+to the first run_prompt call, for a sample of `--sample` cases of the JSON
+array and of the JSONL file, and for one small shard of the JSONL file.
+
+    python benchmarks/bench_dataset_loader.py --cases 200000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bench_utils import REPO_ROOT, load_lesson_module, point_clients_at
+from fake_messages_api import serve_in_subprocess
+
+sys.path.insert(0, os.path.join(REPO_ROOT, "prompts"))
+from dataset_loader import JsonlDataset, load_dataset, write_jsonl  # noqa: E402
+
+
+def make_dataset(count):
+    for index in range(count):
+        yield {
+            "task_description": "Write a compact, one-paragraph meal plan for a single athlete",
+            "prompt_inputs": {
+                "height": str(150 + index % 50),
+                "weight": str(50 + index % 60),
+                "goal": f"goal {index}: build endurance for a long race while keeping weight stable",
+                "restrictions": "no dairy, no shellfish",
+            },
+            "solution_criteria": [
+                "Includes total daily calories",
+                "Meets the athlete's restrictions",
+                "Fits in one paragraph",
+            ],
+            "scenario": f"Case {index}: an endurance athlete with dairy and shellfish allergies",
+        }
+
+
+def timed(function):
+    start = time.perf_counter()
+    value = function()
+    return value, time.perf_counter() - start
+
+
+def peak_memory(function):
+    """Peak memory traced while running `function`, in MB; traced separately
+    from the timings, since tracing slows allocation down"""
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1e6
+
+
+def bench_loader(json_file, jsonl_file):
+    _, elapsed = timed(lambda: load_dataset(json_file))
+    peak = peak_memory(lambda: load_dataset(json_file))
+    print(f"  json.load                    {elapsed * 1000:9.1f} ms, peak {peak:.0f} MB")
+
+    _, elapsed = timed(lambda: next(iter(load_dataset(jsonl_file))))
+    print(f"  JSONL, first test case       {elapsed * 1000:9.3f} ms")
+    count, elapsed = timed(lambda: sum(1 for _ in load_dataset(jsonl_file)))
+    peak = peak_memory(lambda: sum(1 for _ in load_dataset(jsonl_file)))
+    print(f"  JSONL, all {count} test cases {elapsed * 1000:8.1f} ms, peak {peak:.2f} MB")
+
+    if os.path.exists(f"{jsonl_file}.idx"):
+        os.remove(f"{jsonl_file}.idx")
+    _, elapsed = timed(lambda: len(JsonlDataset(jsonl_file)))
+    print(f"  JSONL, build line index      {elapsed * 1000:9.1f} ms")
+    _, elapsed = timed(lambda: len(JsonlDataset(jsonl_file)))
+    print(f"  JSONL, reuse line index      {elapsed * 1000:9.3f} ms")
+    _, elapsed = timed(lambda: list(load_dataset(jsonl_file, sample=1000)))
+    print(f"  JSONL, sample of 1000        {elapsed * 1000:9.1f} ms")
+    _, elapsed = timed(lambda: next(iter(load_dataset(jsonl_file, shard="3/8"))))
+    print(f"  JSONL, shard 3/8, first      {elapsed * 1000:9.3f} ms")
+
+
+def bench_run(json_file, jsonl_file, sample, latency, tmp):
+    with serve_in_subprocess(latency) as url:
+        point_clients_at(url)
+        lesson = load_lesson_module("prompts/007_prompt_engineering_techniques.py")
+        lesson.response_cache.enabled = False
+        evaluator = lesson.PromptEvaluator(max_concurrent_tasks=8)
+        # Small enough a shard to hold about `sample` test cases
+        shards = max(1, len(JsonlDataset(jsonl_file)) // sample)
+        runs = [
+            (f"JSON array, sample {sample}", json_file, {"sample": sample}),
+            (f"JSONL, sample {sample}", jsonl_file, {"sample": sample}),
+            (f"JSONL, shard 1/{shards}", jsonl_file, {"shard": f"1/{shards}"}),
+        ]
+        for label, dataset_file, options in runs:
+            first_call = []
+            cases = []
+
+            def run_prompt(prompt_inputs):
+                if not first_call:
+                    first_call.append(time.perf_counter())
+                cases.append(prompt_inputs)
+                return lesson.chat([{"role": "user", "content": f"Plan for {prompt_inputs['goal']}"}])
+
+            output = os.path.join(tmp, "output")
+            start = time.perf_counter()
+            evaluator.run_evaluation(
+                run_prompt,
+                dataset_file,
+                json_output_file=f"{output}.json",
+                html_output_file=f"{output}.html",
+                jsonl_output_file=f"{output}.jsonl",
+                metrics_output_file=f"{output}-metrics.json",
+                return_results=False,
+                **options,
+            )
+            elapsed = time.perf_counter() - start
+            print(
+                f"  {label:<24} first run_prompt call after "
+                f"{(first_call[0] - start) * 1000:8.1f} ms; {len(cases)} cases in {elapsed:.1f}s"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cases", type=int, default=200_000)
+    parser.add_argument("--sample", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_file = os.path.join(tmp, "dataset.json")
+        jsonl_file = os.path.join(tmp, "dataset.jsonl")
+        with open(json_file, "w") as f:
+            json.dump(list(make_dataset(args.cases)), f)
+        write_jsonl(make_dataset(args.cases), jsonl_file)
+        print(f"{args.cases} test cases, {os.path.getsize(jsonl_file) / 1e6:.0f} MB as JSONL")
+
+        bench_loader(json_file, jsonl_file)
+        print(f"\nrun_evaluation, {args.latency * 1000:.0f} ms latency")
+        bench_run(json_file, jsonl_file, args.sample, args.latency, tmp)
+
+
+if __name__ == "__main__":
+    main()
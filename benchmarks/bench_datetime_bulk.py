@@ -0,0 +1,126 @@
+"""
+Scalar add_duration_to_datetime vs the bulk version in datetime_bulk.py.
+
+First checks that the bulk version, with NumPy and without, gives the
+scalar tool's result (or raises its error) on a grid of edge cases: month
+ends, Feb 29, century years, fractional durations and unknown units. Then
+times `--size` random inputs drawn from `--distinct-dates` dates, the way a
+large batch_tool call would send them.
+
+    python benchmarks/bench_datetime_bulk.py --size 100000
+"""
+import argparse
+import calendar
+import random
+import time
+from datetime import date, timedelta
+
+from bench_utils import load_lesson_module, point_clients_at
+
+UNITS = ["seconds", "minutes", "hours", "days", "weeks", "months", "years"]
+
+
+def outcome(function, *args):
+    try:
+        return function(*args)
+    except Exception as e:
+        return type(e), str(e)
+
+
+def edge_cases():
+    dates = []
+    for year in (1, 1999, 2000, 2023, 2024, 2100, 9999):
+        for month in range(1, 13):
+            first = date(year, month, 1)
+            last = first.replace(day=calendar.monthrange(year, month)[1])
+            dates += [first.isoformat(), last.isoformat()]
+    dates += ["2024-02-29", "2025-02-30", "2025-1-5", "not a date"]
+    cases = []
+    for datetime_str in dates:
+        for unit in UNITS + ["fortnights"]:
+            for duration in (0, 1, -1, 11, 12, -13, 48, 1.5, -0.25, 2.0, 10**6):
+                cases.append((datetime_str, duration, unit, "%Y-%m-%d"))
+    cases += [
+        ("2024-02-29T23:59:59", 1, "seconds", "%Y-%m-%dT%H:%M:%S"),
+        ("2024-02-29 12:00:00", 4, "years", "%Y-%m-%d %H:%M:%S"),
+        ("29/02/2024", 1, "months", "%d/%m/%Y"),
+    ]
+    return cases
+
+
+def check(datetime_bulk, scalar, cases):
+    expected = [outcome(scalar, *case) for case in cases]
+    ok = [(case, result) for case, result in zip(cases, expected) if isinstance(result, str)]
+    columns = list(zip(*[case for case, _ in ok]))
+    bulk = datetime_bulk.add_durations(*columns, scalar=scalar)
+    assert bulk == [result for _, result in ok]
+    for case, result in zip(cases, expected):
+        if not isinstance(result, str):
+            single = outcome(
+                lambda: datetime_bulk.add_durations(*[[value] for value in case], scalar=scalar)
+            )
+            assert single == result, case
+    return len(ok), len(cases) - len(ok)
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--distinct-dates", type=int, default=2_000)
+    args = parser.parse_args()
+
+    # tool_use.py builds a client at import; nothing is requested
+    point_clients_at("http://127.0.0.1:9")
+    tool_use = load_lesson_module("tool_use/tool_use.py")
+    datetime_bulk = load_lesson_module("tool_use/datetime_bulk.py")
+    scalar = tool_use.add_duration_to_datetime
+    numpy = datetime_bulk.np
+
+    cases = edge_cases()
+    matched, raised = check(datetime_bulk, scalar, cases)
+    datetime_bulk.np = None
+    check(datetime_bulk, scalar, cases)
+    datetime_bulk.np = numpy
+    print(f"edge cases: {matched} results and {raised} errors match the scalar tool, "
+          "with and without NumPy")
+
+    rng = random.Random(0)
+    start = date(2000, 1, 1)
+    # No Feb 29s: plus years, the scalar tool raises for most of them
+    dates = []
+    while len(dates) < args.distinct_dates:
+        day = start + timedelta(days=rng.randrange(365 * 40))
+        if (day.month, day.day) != (2, 29):
+            dates.append(day.isoformat())
+    datetime_strs = [rng.choice(dates) for _ in range(args.size)]
+    durations = [rng.randint(-36, 36) for _ in range(args.size)]
+    units = [rng.choice(UNITS) for _ in range(args.size)]
+
+    scalar_time, expected = timed(
+        lambda: [scalar(*inputs) for inputs in zip(datetime_strs, durations, units)]
+    )
+    numpy_time, result = timed(
+        lambda: datetime_bulk.add_durations(datetime_strs, durations, units, scalar=scalar)
+    )
+    assert result == expected
+    datetime_bulk.np = None
+    python_time, result = timed(
+        lambda: datetime_bulk.add_durations(datetime_strs, durations, units, scalar=scalar)
+    )
+    datetime_bulk.np = numpy
+    assert result == expected
+
+    print(f"{args.size:,} inputs, {args.distinct_dates:,} distinct dates")
+    print(f"scalar:             {scalar_time:.3f}s")
+    print(f"bulk (NumPy):       {numpy_time:.3f}s ({scalar_time / numpy_time:.1f}x)")
+    print(f"bulk (pure Python): {python_time:.3f}s ({scalar_time / python_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
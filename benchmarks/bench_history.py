@@ -0,0 +1,85 @@
+"""
+Input tokens of a long tool-use session with and without HistoryManager.
+
+A session of `--rounds` user requests goes through run_conversation against
+the fake Messages API; every request makes the model call each tool once, and
+get_current_datetime is swapped for a stand-in that returns `--result-chars`
+characters, like a search or file-reading tool would. The input tokens the
+fake reports are summed over the session, first sending the full history and
+then through a HistoryManager with `--budget` tokens.
+
+    python benchmarks/bench_history.py --rounds 40 --budget 8000
+"""
+import argparse
+
+from bench_utils import load_lesson_module, point_clients_at
+from fake_messages_api import FakeMessagesAPI
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=40)
+    parser.add_argument("--result-chars", type=int, default=2_000)
+    parser.add_argument("--budget", type=int, default=8_000)
+    args = parser.parse_args()
+
+    with FakeMessagesAPI(latency=0.0) as server:
+        point_clients_at(server.url)
+        tool_use = load_lesson_module("tool_use/tool_use.py")
+        schema = tool_use.registry.get("get_current_datetime").schema
+        tool_use.registry.register(
+            schema, lambda date_format="%Y-%m-%d %H:%M:%S": "x" * args.result_chars
+        )
+        # The fake sets reminders with placeholder text; keep them off disk
+        tool_use.registry.register(
+            tool_use.registry.get("set_reminder").schema, lambda content, timestamp: None
+        )
+
+        calls = []
+        chat = tool_use.chat
+
+        def counting_chat(messages, *call_args, **kwargs):
+            response = chat(messages, *call_args, **kwargs)
+            calls.append((response.usage.input_tokens, list(messages)))
+            return response
+
+        tool_use.chat = counting_chat
+
+        def session(history):
+            calls.clear()
+            messages = []
+            for i in range(args.rounds):
+                tool_use.add_user_message(messages, f"Request {i + 1}: what time is it?")
+                tool_use.run_conversation(messages, history)
+            # Calls that start with everything the previous call sent, so
+            # the prompt-cacheable prefix was kept
+            stable = sum(
+                1
+                for (_, before), (_, after) in zip(calls, calls[1:])
+                if after[: len(before)] == before
+            )
+            return sum(tokens for tokens, _ in calls), stable, len(calls), len(messages)
+
+        full_tokens, full_stable, api_calls, message_count = session(None)
+        history = tool_use.HistoryManager(token_budget=args.budget)
+        compact_tokens, compact_stable, _, _ = session(history)
+
+    compactions = sum(1 for turn in history.turns if turn.compacted_messages)
+    print(
+        f"{args.rounds} requests, {api_calls} API calls, {message_count} messages, "
+        f"{args.result_chars:,}-character tool results"
+    )
+    print(f"full history:    {full_tokens:,} input tokens")
+    print(
+        f"HistoryManager:  {compact_tokens:,} input tokens "
+        f"({1 - compact_tokens / full_tokens:.0%} fewer, budget {args.budget:,})"
+    )
+    print(
+        f"prefix kept on {compact_stable} of {api_calls - 1} calls "
+        f"({full_stable} with the full history); compacted on {compactions} turns"
+    )
+    print(f"estimated tokens saved on the last turn: {history.turns[-1].saved_tokens:,}")
+
+
+if __name__ == "__main__":
+    main()
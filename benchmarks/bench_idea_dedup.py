@@ -0,0 +1,164 @@
+"""
+Near-duplicate ideas with and without IdeaIndex.
+
+Part one indexes `--ideas` ideas from the fake API's idea generator. Each
+idea is an athlete, a focus and a constraint, and about a fifth rephrase an
+earlier idea, often with synonyms. It reports how many ideas IdeaIndex
+drops, grouped by how many of those three parts they share with the closest
+earlier idea, how many duplicates the LSH lookup misses compared to
+comparing every pair exactly, and the time per lookup.
+
+Part two runs generate_dataset against the fake Messages API for `--cases`
+test cases: without an index, with a fresh one, and once more with that
+index, as the next run for the same task would. It counts test cases that
+repeat a scenario within the dataset or from the first indexed run, and the
+generate_test_case calls spent on them.
+
+    python benchmarks/bench_idea_dedup.py --ideas 500 --cases 100
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from bench_utils import REPO_ROOT, load_lesson_module, point_clients_at
+from fake_messages_api import (
+    IDEA_ATHLETES,
+    IDEA_CONSTRAINTS,
+    IDEA_FOCUSES,
+    fake_ideas,
+    serve_in_subprocess,
+)
+
+sys.path.insert(0, os.path.join(REPO_ROOT, "prompts"))
+from idea_index import IdeaIndex, jaccard, shingles  # noqa: E402
+
+TASK = "Write a compact, one-paragraph meal plan for a single athlete"
+INPUTS_SPEC = {
+    "height": "Athlete's height in cm",
+    "weight": "Athlete's weight in kg",
+    "goal": "Goal of the athlete",
+}
+
+
+def scenario(idea):
+    """The (athlete, focus, constraint) a fake idea was made from"""
+    text = idea.lower()
+    return tuple(
+        next(i for i, forms in enumerate(part) if any(form.lower() in text for form in forms))
+        for part in (IDEA_ATHLETES, IDEA_FOCUSES, IDEA_CONSTRAINTS)
+    )
+
+
+def bench_index(args):
+    ideas = fake_ideas("bench", args.ideas)
+    # How many of its three parts each idea shares with the closest earlier one
+    shared = []
+    seen = []
+    for idea in ideas:
+        parts = scenario(idea)
+        shared.append(max((sum(x == y for x, y in zip(parts, other)) for other in seen), default=0))
+        seen.append(parts)
+
+    index = IdeaIndex(threshold=args.threshold)
+    start = time.perf_counter()
+    flagged = [index.add_if_new(idea) is not None for idea in ideas]
+    lsh_time = time.perf_counter() - start
+
+    # Exact: every idea against every earlier one
+    start = time.perf_counter()
+    words = [shingles(idea) for idea in ideas]
+    exact = []
+    kept = []
+    for current in words:
+        duplicate = any(jaccard(current, other) >= args.threshold for other in kept)
+        exact.append(duplicate)
+        if not duplicate:
+            kept.append(current)
+    exact_time = time.perf_counter() - start
+
+    print(
+        f"{len(ideas)} ideas, threshold {args.threshold}, "
+        f"{index.bands} bands x {index.rows} rows; IdeaIndex drops {sum(flagged)}"
+    )
+    for parts, label in ((3, "rephrase an earlier idea"), (2, "share 2 of 3 parts"), (1, "share 1 part"), (0, "share none")):
+        group = [f for f, s in zip(flagged, shared) if s == parts]
+        if group:
+            print(f"  {len(group):5} {label:<25} {sum(group) / len(group):4.0%} dropped")
+    print(
+        f"  exact pairwise drops {sum(exact)}; LSH missed {sum(e and not f for e, f in zip(exact, flagged))}"
+    )
+    print(
+        f"  {lsh_time / len(ideas) * 1e3:.2f} ms per idea with LSH, "
+        f"{exact_time / len(ideas) * 1e3:.2f} ms comparing every pair"
+    )
+
+
+def run_dataset(lesson, cases, workers, index, output_file):
+    evaluator = lesson.PromptEvaluator(max_concurrent_tasks=workers, idea_index=index)
+    calls = {"ideas": 0, "test cases": 0}
+    stream_unique_ideas = evaluator.stream_unique_ideas
+    generate_test_case = evaluator.generate_test_case
+
+    def counted_ideas(*args):
+        calls["ideas"] += 1
+        return stream_unique_ideas(*args)
+
+    def counted_test_case(*args):
+        calls["test cases"] += 1
+        return generate_test_case(*args)
+
+    evaluator.stream_unique_ideas = counted_ideas
+    evaluator.generate_test_case = counted_test_case
+    start = time.perf_counter()
+    dataset = evaluator.generate_dataset(TASK, INPUTS_SPEC, cases, output_file=output_file)
+    return dataset, calls, time.perf_counter() - start
+
+
+def bench_dataset(args):
+    with serve_in_subprocess(args.latency) as url, tempfile.TemporaryDirectory() as tmp:
+        point_clients_at(url)
+        lesson = load_lesson_module("prompts/007_prompt_engineering_techniques.py")
+        lesson.response_cache.enabled = False
+        index_path = os.path.join(tmp, "idea_index.json")
+        runs = [
+            ("no index", None, "plain.json"),
+            ("fresh index", IdeaIndex(index_path, threshold=args.threshold), "dataset.json"),
+            # A new IdeaIndex loads what the previous run saved, and the
+            # previous dataset is still in dataset.json
+            ("next run", IdeaIndex(index_path, threshold=args.threshold), "dataset.json"),
+        ]
+        earlier = set()
+        print(f"\ngenerate_dataset, {args.cases} cases, {args.latency * 1000:.0f} ms latency")
+        for label, index, output_file in runs:
+            dataset, calls, elapsed = run_dataset(
+                lesson, args.cases, args.workers, index, os.path.join(tmp, output_file)
+            )
+            scenarios = [scenario(test_case["scenario"]) for test_case in dataset]
+            repeated = len(scenarios) - len(set(scenarios))
+            overlap = sum(s in earlier for s in set(scenarios))
+            if label == "fresh index":
+                earlier = set(scenarios)
+            print(
+                f"  {label:<11} {len(dataset)} test cases from {calls['ideas']} idea requests, "
+                f"{calls['test cases']} generate_test_case calls; {repeated} repeated scenarios, "
+                f"{overlap} from the previous run; {elapsed:.2f}s"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--ideas", type=int, default=500)
+    parser.add_argument("--cases", type=int, default=100)
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    bench_index(args)
+    bench_dataset(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Streamed vs whole-response ideas in generate_dataset, and how much of a
+damaged JSON response json_stream recovers.
+
+Part one runs generate_dataset against the fake Messages API, with responses
+coming out `--chunk-latency` seconds per 40-character chunk. It first waits
+for the whole idea list before generating test cases, as generate_dataset
+used to. It then streams the ideas, starting a test case as soon as each
+idea is complete. It reports time to the first idea, time to the first test
+case and total time for both.
+
+Part two cuts responses shaped like the lesson's (an idea list, a test case,
+a grade) off at every position. It counts how many of them json.loads and
+loads_lenient can parse, how many repaired ones still have the fields the
+evaluator reads, and how many complete ideas JsonArrayParser still gets out
+of the cut-off lists. Responses with trailing commas, `//` comments or text
+after the JSON are checked as well.
+
+    python benchmarks/bench_json_stream.py --cases 20 --chunk-latency 0.02
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import tempfile
+import time
+
+from bench_utils import REPO_ROOT, load_lesson_module, point_clients_at
+from fake_messages_api import serve_in_subprocess
+
+sys.path.insert(0, os.path.join(REPO_ROOT, "prompts"))
+from json_stream import iter_json_array, loads_lenient  # noqa: E402
+
+TASK = "Write a compact, one-paragraph meal plan for a single athlete"
+INPUTS_SPEC = {
+    "height": "Athlete's height in cm",
+    "weight": "Athlete's weight in kg",
+    "goal": "Goal of the athlete",
+}
+
+
+def timed_dataset(lesson, streamed, cases, workers):
+    """(first idea, first test case, total) seconds for one generate_dataset"""
+    evaluator = lesson.PromptEvaluator(max_concurrent_tasks=workers)
+    start = time.perf_counter()
+    marks = {}
+    generate_test_case = evaluator.generate_test_case
+
+    def timed_test_case(*args):
+        marks.setdefault("idea", time.perf_counter() - start)
+        result = generate_test_case(*args)
+        marks.setdefault("case", time.perf_counter() - start)
+        return result
+
+    evaluator.generate_test_case = timed_test_case
+    if streamed:
+        with tempfile.TemporaryDirectory() as tmp:
+            dataset = evaluator.generate_dataset(
+                TASK, INPUTS_SPEC, cases, output_file=os.path.join(tmp, "dataset.json")
+            )
+    else:
+        ideas = evaluator.generate_unique_ideas(TASK, INPUTS_SPEC, cases)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            dataset = list(
+                pool.map(lambda idea: timed_test_case(TASK, idea, INPUTS_SPEC), ideas)
+            )
+    assert len(dataset) == cases, len(dataset)
+    return marks["idea"], marks["case"], time.perf_counter() - start
+
+
+def bench_streaming(args):
+    with serve_in_subprocess(args.latency, chunk_latency=args.chunk_latency) as url:
+        point_clients_at(url)
+        lesson = load_lesson_module("prompts/007_prompt_engineering_techniques.py")
+        lesson.response_cache.enabled = False
+        print(
+            f"generate_dataset, {args.cases} cases, {args.workers} workers, "
+            f"{args.latency * 1000:.0f} ms latency + {args.chunk_latency * 1000:.0f} ms per chunk"
+        )
+        for label, streamed in (("whole list", False), ("streamed", True)):
+            idea, case, total = timed_dataset(lesson, streamed, args.cases, args.workers)
+            print(
+                f"  {label:<11} first idea {idea:.2f}s, first test case {case:.2f}s, "
+                f"done {total:.2f}s"
+            )
+
+
+def parses(loads, text):
+    try:
+        loads(text)
+        return True
+    except ValueError:
+        return False
+
+
+def bench_recovery():
+    ideas = [f"Testing a {goal} plan for a {height} cm athlete" for goal, height in zip(
+        ["weight loss", "muscle gain", "endurance", "maintenance"] * 5, range(150, 210, 3)
+    )]
+    test_case = {
+        "prompt_inputs": {"height": "180", "weight": "75", "goal": "build \"lean\" muscle"},
+        "solution_criteria": ["Includes a daily calorie target", "Lists protein sources"],
+    }
+    grade = {
+        "strengths": ["Concrete portions"],
+        "weaknesses": ["No timing for meals"],
+        "reasoning": "Covers calories and protein; meal timing is missing.",
+        "score": 7,
+    }
+    print("cut off at every position:")
+    ideas_text = "\n" + json.dumps(ideas, indent=2) + "\n"
+    cuts = [ideas_text[:end] for end in range(1, len(ideas_text))]
+    salvaged = [list(iter_json_array([cut])) for cut in cuts]
+    assert all(idea in ideas for kept in salvaged for idea in kept)  # never a partial idea
+    print(
+        f"  idea list  {len(cuts)} prefixes: json.loads parses "
+        f"{sum(parses(json.loads, cut) for cut in cuts)}; the streaming parser keeps "
+        f"{sum(map(len, salvaged)) / (len(ideas) * len(cuts)):.0%} of the ideas, "
+        f"every one that was complete"
+    )
+    # A repaired test case or grade is only usable if the fields the
+    # evaluator reads made it in before the cut
+    for label, value, usable in (
+        ("test case", test_case, lambda v: {"prompt_inputs", "solution_criteria"} <= v.keys()),
+        ("grade", grade, lambda v: "score" in v),
+    ):
+        text = "\n" + json.dumps(value, indent=2) + "\n"
+        cuts = [text[:end] for end in range(1, len(text))]
+        strict = sum(parses(json.loads, cut) for cut in cuts)
+        repaired = [loads_lenient(cut) for cut in cuts if parses(loads_lenient, cut)]
+        print(
+            f"  {label:<10} {len(cuts)} prefixes: json.loads parses {strict}, "
+            f"loads_lenient {len(repaired)}, {sum(map(usable, repaired))} with every field used"
+        )
+
+    sloppy = {
+        "trailing comma": '\n{"score": 7, "reasoning": "ok",}\n',
+        "// comment": '\n{"prompt_inputs": {"goal": "x"}, // the inputs\n"solution_criteria": ["y"]}\n',
+        "trailing text": '\n["a", "b"]\nThese ideas cover...',
+        "bad element": '\n["a", b, "c"]\n',
+    }
+    print("other common mistakes:")
+    for label, text in sloppy.items():
+        elements = list(iter_json_array([text])) if text.lstrip().startswith("[") else None
+        result = loads_lenient(text) if parses(loads_lenient, text) else "error"
+        print(
+            f"  {label:<14} json.loads {'ok' if parses(json.loads, text) else 'fails'}, "
+            f"loads_lenient -> {json.dumps(result)}"
+            + (f", streamed -> {json.dumps(elements)}" if elements is not None else "")
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cases", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--chunk-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    bench_streaming(args)
+    bench_recovery()
+
+
+if __name__ == "__main__":
+    main()
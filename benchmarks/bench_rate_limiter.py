@@ -0,0 +1,62 @@
+"""
+Run an evaluation against a rate-limited fake Messages endpoint.
+
+Without the adaptive rate limiter, the first 429 raises out of
+`future.result()` and aborts `run_evaluation`. With it, the run should finish
+every case at close to the endpoint's request limit.
+
+    python benchmarks/bench_rate_limiter.py --cases 100 --rpm 600 --threads 32
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from bench_utils import load_lesson_module, point_clients_at
+from bench_async_eval import make_dataset
+from fake_messages_api import serve_in_subprocess
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cases", type=int, default=100)
+    parser.add_argument("--rpm", type=int, default=600)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--threads", type=int, default=32)
+    args = parser.parse_args()
+
+    with serve_in_subprocess(args.latency, args.rpm) as url, tempfile.TemporaryDirectory() as tmp:
+        point_clients_at(url)
+        lesson = load_lesson_module("prompts/007_prompt_engineering_techniques.py")
+        # Measure real requests, not replays from the response cache
+        lesson.response_cache.enabled = False
+
+        dataset_file = os.path.join(tmp, "dataset.json")
+        make_dataset(dataset_file, args.cases)
+
+        def run_prompt(prompt_inputs):
+            messages = []
+            lesson.add_user_message(messages, f"Write about {prompt_inputs['topic']}")
+            return lesson.chat(messages)
+
+        evaluator = lesson.PromptEvaluator(max_concurrent_tasks=args.threads)
+        start = time.perf_counter()
+        results = evaluator.run_evaluation(
+            run_prompt,
+            dataset_file,
+            json_output_file=os.path.join(tmp, "output.json"),
+            html_output_file=os.path.join(tmp, "output.html"),
+            jsonl_output_file=os.path.join(tmp, "output.jsonl"),
+            metrics_output_file=os.path.join(tmp, "metrics.json"),
+        )
+        elapsed = time.perf_counter() - start
+
+    requests = 2 * len(results)
+    print()
+    print(f"{len(results)}/{args.cases} cases completed in {elapsed:.1f}s")
+    print(f"{requests / elapsed * 60:.0f} successful requests/min against a {args.rpm} RPM limit")
+    print(f"rate limiter: {lesson.rate_limiter.summary()}")
+
+
+if __name__ == "__main__":
+    main()
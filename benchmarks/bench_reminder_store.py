@@ -0,0 +1,107 @@
+"""
+Insert throughput and due-query latency of the reminder store.
+
+`--reminders` reminders, due at random times over the next year, are inserted
+into a fresh database in batches of `--batch-size` (one transaction each, as
+a batch_tool call would), and once more one reminder per transaction for a
+sample. Then, with all of them pending, it times the store's due query, the
+scheduler's first page load, adding a reminder, and firing the ones due.
+
+    python benchmarks/bench_reminder_store.py --reminders 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from bench_utils import load_lesson_module
+
+
+def percentiles(values):
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return cuts[49], cuts[94], cuts[98]
+
+
+def timed_ms(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--reminders", type=int, default=1_000_000)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--single-inserts", type=int, default=1_000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    reminder_store = load_lesson_module("tool_use/reminder_store.py")
+    ReminderStore, ReminderScheduler = reminder_store.ReminderStore, reminder_store.ReminderScheduler
+
+    rng = random.Random(0)
+    now = time.time()
+    year = 365 * 24 * 3600
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ReminderStore(os.path.join(tmp, "reminders.sqlite3"))
+
+        start = time.perf_counter()
+        for offset in range(0, args.reminders, args.batch_size):
+            count = min(args.batch_size, args.reminders - offset)
+            store.add_many(
+                [
+                    (f"reminder {offset + i}", now + rng.uniform(0, year))
+                    for i in range(count)
+                ]
+            )
+        elapsed = time.perf_counter() - start
+        print(
+            f"add_many: {args.reminders:,} reminders in {elapsed:.2f}s "
+            f"({args.reminders / elapsed:,.0f}/s, batches of {args.batch_size:,})"
+        )
+
+        start = time.perf_counter()
+        for i in range(args.single_inserts):
+            store.add(f"single {i}", now + rng.uniform(0, year))
+        elapsed = time.perf_counter() - start
+        print(
+            f"add: {args.single_inserts:,} reminders in {elapsed:.2f}s "
+            f"({args.single_inserts / elapsed:,.0f}/s, one transaction each)"
+        )
+        print(f"pending: {store.pending_count():,}")
+
+        # Roughly 100 reminders are due in the first ~50 minutes
+        window = year * 100 / args.reminders
+        p50, p95, p99 = percentiles(
+            timed_ms(lambda: store.due(now + window, limit=1000), args.queries)
+        )
+        print(f"due query (~100 due): p50 {p50:.3f} ms, p95 {p95:.3f} ms, p99 {p99:.3f} ms")
+
+        scheduler = ReminderScheduler(store, notify=lambda due, content: None)
+        load_ms = timed_ms(scheduler.next_due, 1)[0]
+        print(f"scheduler first page ({scheduler.page_size:,} reminders): {load_ms:.1f} ms")
+
+        p50, p95, p99 = percentiles(
+            timed_ms(
+                lambda: scheduler.add("added", now + rng.uniform(0, window)),
+                args.queries,
+            )
+        )
+        print(f"scheduler add: p50 {p50:.3f} ms, p95 {p95:.3f} ms, p99 {p99:.3f} ms")
+
+        start = time.perf_counter()
+        fired = scheduler.fire_due(now + window)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"fire_due: {fired:,} reminders in {elapsed:.1f} ms")
+
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Compare time and peak memory of the streaming HTML report writer against
+building the whole report as one string.
+
+The in-memory baseline is how the report used to be produced: load every
+result, then `html += row` for each one and write the string out. The
+streaming writer reads the JSONL results log and writes rows to disk as it
+goes. Peak memory is measured with tracemalloc.
+
+    python benchmarks/bench_report.py --rows 1000 10000 100000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from bench_utils import load_lesson_module
+
+
+def make_results(path, num_rows):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(num_rows):
+            result = {
+                "output": f"Summary {i}: solar and wind costs fell sharply. " * 10,
+                "test_case": {
+                    "prompt_inputs": {"content": f"Passage {i} about renewable energy"},
+                    "solution_criteria": ["Mentions solar power", "Is one paragraph"],
+                    "task_description": "Summarize a passage",
+                    "scenario": f"Scenario {i}",
+                },
+                "score": i % 11,
+                "reasoning": "The solution meets the listed criteria.",
+            }
+            f.write(json.dumps(result) + "\n")
+
+
+def in_memory_report(report, results_jsonl_file, html_output_file):
+    results = list(report.iter_results(results_jsonl_file))
+    scores = [result["score"] for result in results]
+    html = report.report_header(*report.report_summary_stats(scores))
+    for result in results:
+        html += report.report_row(result)
+    html += report.REPORT_FOOTER
+    with open(html_output_file, "w", encoding="utf-8") as f:
+        f.write(html)
+
+
+def measure(function, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10_000, 100_000])
+    parser.add_argument("--rows-per-page", type=int, default=None)
+    args = parser.parse_args()
+
+    report = load_lesson_module("prompts/report.py")
+
+    print(f"{'rows':>8} {'in-memory':>20} {'streaming':>20}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for num_rows in args.rows:
+            results_file = os.path.join(tmp, f"results-{num_rows}.jsonl")
+            make_results(results_file, num_rows)
+
+            baseline = measure(
+                in_memory_report, report, results_file, os.path.join(tmp, "a.html")
+            )
+            streaming = measure(
+                report.write_prompt_evaluation_report,
+                results_file,
+                os.path.join(tmp, "b.html"),
+                None,
+                args.rows_per_page,
+            )
+            print(
+                f"{num_rows:>8} "
+                f"{baseline[0]:8.2f}s {baseline[1]:8.1f} MB "
+                f"{streaming[0]:8.2f}s {streaming[1]:8.1f} MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+ResultsStore queries vs loading each run's output.json.
+
+Writes `--runs` runs of `--cases` results each, with output text the size
+of a real meal plan, across four prompt versions. Each run is saved as its
+own output.json, the way comparing runs works without the store, and
+appended to a ResultsStore. Then three questions are answered both ways:
+the scenarios that dropped 2+ points between the last two runs, the
+average score, latency and tokens per prompt version, and the 10 worst
+cases. The store is queried with NumPy and again without it, and all three
+answers must agree.
+
+    python benchmarks/bench_results_store.py --runs 20 --cases 2000
+"""
+import argparse
+import heapq
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+from bench_utils import REPO_ROOT
+
+sys.path.insert(0, os.path.join(REPO_ROOT, "prompts"))
+import results_store  # noqa: E402
+from results_store import ResultsStore  # noqa: E402
+
+PROMPTS = [f"{version:064x}" for version in (0xA1, 0xB2, 0xC3, 0xD4)]
+
+
+def make_run(run, runs, cases, rng):
+    # Later prompt versions score a little higher on average
+    version = run * len(PROMPTS) // runs
+    words = "protein carbs oatmeal chicken rice salmon greens recovery snack".split()
+    results = []
+    for case in range(cases):
+        results.append(
+            {
+                "output": " ".join(rng.choice(words) for _ in range(rng.randint(150, 300))),
+                "test_case": {
+                    "scenario": f"Scenario {case}",
+                    "prompt_inputs": {"goal": f"goal {case}"},
+                },
+                "score": min(10, max(1, round(rng.gauss(5 + version, 2)))),
+                "reasoning": "The plan meets most of the criteria. " * 3,
+                "latency": rng.uniform(0.5, 4.0),
+                "input_tokens": rng.randint(300, 400),
+                "output_tokens": rng.randint(200, 500),
+            }
+        )
+    return PROMPTS[version], results
+
+
+def from_json(files, prompts):
+    """The three answers from the output.json files"""
+    with open(files[-2]) as f:
+        before = {r["test_case"]["scenario"]: r["score"] for r in json.load(f)}
+    with open(files[-1]) as f:
+        after = {r["test_case"]["scenario"]: r["score"] for r in json.load(f)}
+    # Biggest drop first, ties in dataset order, as the store sorts them
+    regressions = sorted(
+        (after[s] - before[s], order, s)
+        for order, s in enumerate(after)
+        if s in before and after[s] - before[s] <= -2
+    )
+
+    totals = {}
+    rows = []
+    for run, (path, prompt) in enumerate(zip(files, prompts)):
+        with open(path) as f:
+            results = json.load(f)
+        total = totals.setdefault(prompt, [0.0, 0.0, 0])
+        for index, result in enumerate(results):
+            total[0] += result["score"]
+            total[1] += result["latency"]
+            total[2] += 1
+            rows.append((result["score"], run, index))
+    averages = {prompt: (s / n, latency / n) for prompt, (s, latency, n) in totals.items()}
+    worst = [(run, index) for _, run, index in heapq.nsmallest(10, rows)]
+    return [s for _, _, s in regressions], averages, worst
+
+
+def from_store(path):
+    store = ResultsStore(path)
+    run_ids = [run["run_id"] for run in store.runs()]
+    regressions = [item["scenario"] for item in store.regressions(min_drop=2)]
+    averages = {
+        p["prompt_fingerprint"]: (p["average_score"], p["average_latency"])
+        for p in store.by_prompt()
+    }
+    worst = [(run_ids.index(row["run_id"]), row["index"]) for row in store.worst(10)]
+    return regressions, averages, worst
+
+
+def timed(function, *function_args):
+    start = time.perf_counter()
+    answer = function(*function_args)
+    return answer, time.perf_counter() - start
+
+
+def same(a, b):
+    regressions_a, averages_a, worst_a = a
+    regressions_b, averages_b, worst_b = b
+    return (
+        regressions_a == regressions_b
+        and worst_a == worst_b
+        and averages_a.keys() == averages_b.keys()
+        and all(
+            math.isclose(x, y) for key in averages_a for x, y in zip(averages_a[key], averages_b[key])
+        )
+    )
+
+
+def size_of(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--cases", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        store_path = os.path.join(tmp, "results_store")
+        store = ResultsStore(store_path)
+        files, prompts = [], []
+        append_time = 0.0
+        for run in range(args.runs):
+            prompt, results = make_run(run, args.runs, args.cases, rng)
+            path = os.path.join(tmp, f"output-{run}.json")
+            with open(path, "w") as f:
+                json.dump(results, f)
+            files.append(path)
+            prompts.append(prompt)
+            start = time.perf_counter()
+            store.append_run(results, prompt)
+            append_time += time.perf_counter() - start
+
+        json_size = sum(size_of(path) for path in files)
+        print(
+            f"{args.runs} runs x {args.cases} cases: output.json files {json_size / 1e6:.1f} MB, "
+            f"store {size_of(store_path) / 1e6:.1f} MB, "
+            f"{append_time / args.runs * 1000:.1f} ms per append_run"
+        )
+
+        expected, json_time = timed(from_json, files, prompts)
+        answer, numpy_time = timed(from_store, store_path)
+        numpy = results_store.np
+        results_store.np = None
+        fallback, fallback_time = timed(from_store, store_path)
+        results_store.np = numpy
+        assert same(answer, expected), "store (NumPy) and output.json answers differ"
+        assert same(fallback, expected), "store (no NumPy) and output.json answers differ"
+
+        print(
+            f"  {len(expected[0])} regressions, {len(expected[1])} prompt versions, "
+            f"10 worst cases; same answers from every source"
+        )
+        print(f"  output.json files      {json_time * 1000:9.1f} ms")
+        print(f"  store, NumPy           {numpy_time * 1000:9.1f} ms  ({json_time / numpy_time:.0f}x)")
+        print(f"  store, without NumPy   {fallback_time * 1000:9.1f} ms  ({json_time / fallback_time:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
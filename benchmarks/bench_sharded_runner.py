@@ -0,0 +1,126 @@
+"""
+Scaling of ShardedRunner with the number of worker processes.
+
+Runs `--cases` test cases against the fake Messages API, split into two
+shards per worker, with 1, 2, 4, ... `--max-workers` workers. Each worker is
+a long-lived process that claims shards one after another and runs them
+with a PromptEvaluator of `--threads` threads, the way one machine's
+connection limit would cap a single process. Reports cases/s and the
+speedup over one worker, then checks the merged output holds every case
+exactly once.
+
+With `--crash`, the first attempt of every third shard kills its process
+half-way through; the shard is retried and keeps the results it had
+written.
+
+    python benchmarks/bench_sharded_runner.py --cases 400 --max-workers 8 --crash
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+
+from bench_utils import REPO_ROOT, load_lesson_module, point_clients_at
+from fake_messages_api import serve_in_subprocess
+
+sys.path.insert(0, os.path.join(REPO_ROOT, "prompts"))
+from sharded_runner import ShardedRunner  # noqa: E402
+
+WORKER = f"{os.path.abspath(__file__)}:run_shard"
+
+
+def run_shard(dataset_file, output_dir):
+    """The worker: evaluate one shard with the 007 lesson's evaluator"""
+    lesson = load_lesson_module("prompts/007_prompt_engineering_techniques.py")
+    lesson.response_cache.enabled = False
+    evaluator = lesson.PromptEvaluator(max_concurrent_tasks=int(os.environ["BENCH_THREADS"]))
+
+    shard = os.path.basename(output_dir)
+    crash = (
+        os.environ.get("BENCH_CRASH")
+        and int(shard.split("-")[1]) % 3 == 0
+        and not os.path.exists(os.path.join(output_dir, "crashed"))
+    )
+    with open(dataset_file) as f:
+        crash_after = len(json.load(f)) // 2 if crash else None
+    prompts_run = 0
+    lock = threading.Lock()
+
+    def run_prompt(prompt_inputs):
+        nonlocal prompts_run
+        with lock:
+            prompts_run += 1
+            if crash_after is not None and prompts_run > crash_after:
+                open(os.path.join(output_dir, "crashed"), "w").close()
+                os._exit(1)
+        return lesson.chat([{"role": "user", "content": f"Plan for {prompt_inputs['goal']}"}])
+
+    evaluator.run_evaluation_shard(run_prompt, dataset_file, output_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cases", type=int, default=400)
+    parser.add_argument("--max-workers", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--crash", action="store_true")
+    args = parser.parse_args()
+
+    os.environ["BENCH_THREADS"] = str(args.threads)
+    if args.crash:
+        os.environ["BENCH_CRASH"] = "1"
+    dataset = [
+        {
+            "task_description": "Write a one-day meal plan for an athlete",
+            "prompt_inputs": {"goal": f"goal {index}"},
+            "solution_criteria": ["Meets the goal"],
+            "scenario": f"Case {index}",
+        }
+        for index in range(args.cases)
+    ]
+
+    with serve_in_subprocess(args.latency) as url, tempfile.TemporaryDirectory() as tmp:
+        point_clients_at(url)
+        dataset_file = os.path.join(tmp, "dataset.json")
+        with open(dataset_file, "w") as f:
+            json.dump(dataset, f)
+
+        print(
+            f"{args.cases} cases, {args.threads} threads per shard process, "
+            f"{args.latency * 1000:.0f} ms latency"
+        )
+        baseline = None
+        workers = 1
+        while workers <= args.max_workers:
+            runner = ShardedRunner(os.path.join(tmp, f"shards-{workers}"), poll_interval=0.1)
+            runner.split(dataset_file, 2 * workers)
+            runner.run(WORKER, workers)
+            rate = args.cases / runner.elapsed
+            baseline = baseline or rate
+            status = runner.status()
+            print(
+                f"  {workers:3} workers: {rate:6.1f} cases/s, {rate / baseline:4.1f}x "
+                f"({status['done']} shards, {status['retries']} retries)"
+            )
+
+            output = os.path.join(tmp, f"output-{workers}")
+            runner.merge(
+                f"{output}.jsonl", f"{output}.json", f"{output}.html", f"{output}-metrics.json"
+            )
+            with open(f"{output}.json") as f:
+                results = json.load(f)
+            scenarios = [result["test_case"]["scenario"] for result in results]
+            assert sorted(scenarios) == sorted(case["scenario"] for case in dataset), (
+                f"{len(scenarios)} results, {len(set(scenarios))} distinct"
+            )
+            with open(f"{output}-metrics.json") as f:
+                calls = sum(site["calls"] for site in json.load(f)["sites"].values())
+            print(f"           merged {len(results)} results, {calls} API calls in metrics.json")
+            workers *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Turn latency of run_conversation vs run_conversation_streaming.
+
+The fake Messages API answers the reminder conversation from tool_use.py's
+__main__ by calling every offered tool, taking `--block-latency` seconds to
+"generate" each content block. The tools are swapped for stand-ins that sleep
+first. The blocking loop only starts the tools once the whole response has
+arrived; the streaming loop starts each read-only tool (get_current_datetime,
+add_duration_to_datetime) as soon as its block is complete, which pays off
+when early tools are slow or tools can't all run at once. set_reminder has
+side effects, so both loops start it only after the response has ended.
+
+    python benchmarks/bench_streaming_tools.py --block-latency 0.3 --tool-latency 0.5
+"""
+import argparse
+import time
+
+from bench_utils import load_lesson_module, point_clients_at
+from fake_messages_api import FakeMessagesAPI
+
+
+def slow(tool, latency):
+    def slow_tool(*args, **kwargs):
+        time.sleep(latency)
+        return tool(*args, **kwargs)
+
+    return slow_tool
+
+
+def transcript_shape(messages):
+    """Roles, block types, tool names/inputs and error flags, without ids"""
+    shape = []
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            shape.append((message["role"], content))
+            continue
+        blocks = []
+        for block in content:
+            block = block if isinstance(block, dict) else block.model_dump()
+            if block["type"] == "tool_use":
+                blocks.append(("tool_use", block["name"], block["input"]))
+            elif block["type"] == "tool_result":
+                blocks.append(("tool_result", block["is_error"]))
+            else:
+                blocks.append((block["type"], block.get("text")))
+        shape.append((message["role"], blocks))
+    return shape
+
+
+def use_tool_latencies(tool_use, originals, latencies):
+    for name, tool in originals.items():
+        tool_use.registry.register(
+            tool.schema, slow(tool.function, latencies[name]), tool.read_only
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--block-latency", type=float, default=0.3)
+    parser.add_argument("--tool-latency", type=float, default=0.5)
+    parser.add_argument("--turns", type=int, default=3)
+    args = parser.parse_args()
+
+    with FakeMessagesAPI(latency=0.05, block_latency=args.block_latency) as server:
+        point_clients_at(server.url)
+        tool_use = load_lesson_module("tool_use/tool_use.py")
+        originals = {
+            name: tool_use.registry.get(name)
+            for name in ("get_current_datetime", "add_duration_to_datetime", "set_reminder")
+        }
+        # The fake sets reminders with placeholder text; keep the output quiet
+        originals["set_reminder"].function = lambda content, timestamp: None
+
+        def conversation(run):
+            messages = []
+            tool_use.add_user_message(
+                messages,
+                "Set two reminders for Jan 1, 2025 at 8AM: a doctors appointment, and taxes are due",
+            )
+            start = time.perf_counter()
+            run(messages)
+            return time.perf_counter() - start, messages
+
+        def compare(label):
+            blocking, streaming = [], []
+            for _ in range(args.turns):
+                elapsed, blocking_messages = conversation(tool_use.run_conversation)
+                blocking.append(elapsed)
+                elapsed, streaming_messages = conversation(
+                    tool_use.run_conversation_streaming
+                )
+                streaming.append(elapsed)
+                assert transcript_shape(blocking_messages) == transcript_shape(
+                    streaming_messages
+                )
+            print(
+                f"{label:<38} blocking {min(blocking):.2f}s, "
+                f"streaming {min(streaming):.2f}s"
+            )
+
+        print(
+            f"3 tool calls per turn, {args.block_latency * 1000:.0f} ms per block, "
+            f"{args.tool_latency * 1000:.0f} ms per slow tool"
+        )
+
+        # The first tool is slow; with early dispatch it runs while the model
+        # is still writing the other two
+        use_tool_latencies(
+            tool_use,
+            originals,
+            {
+                "get_current_datetime": args.tool_latency,
+                "add_duration_to_datetime": 0.01,
+                "set_reminder": 0.01,
+            },
+        )
+        compare("slow first tool, parallel tools:")
+
+        # Every tool is slow but only one may run at a time (e.g. a tool
+        # backed by a single connection)
+        use_tool_latencies(
+            tool_use, originals, {name: args.tool_latency for name in originals}
+        )
+        tool_use.tool_executor.max_workers = 1
+        compare("all tools slow, one at a time:")
+
+        # Every tool is slow and they run in parallel: the last tool can only
+        # start once its block is complete either way, so there is nothing to
+        # win here
+        tool_use.tool_executor.max_workers = 8
+        compare("all tools slow, parallel tools:")
+
+
+if __name__ == "__main__":
+    main()
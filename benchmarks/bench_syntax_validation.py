@@ -0,0 +1,127 @@
+"""
+Syntax validation inline vs in SyntaxValidator's process pool.
+
+Validates `--outputs` generated outputs (JSON, Python and regexes, valid or
+not, some fenced or with delimiters, some regexes that backtrack
+catastrophically), first on the main thread, then through
+SyntaxValidator.validate_many. Meanwhile a heartbeat thread wakes up every
+millisecond, standing in for the threads waiting on the API; how late it
+wakes up shows how long validation holds the GIL. The score distribution
+of both runs is printed too; it should be identical.
+
+    python benchmarks/bench_syntax_validation.py --outputs 20000 --workers 4
+"""
+import argparse
+import collections
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from bench_utils import REPO_ROOT
+
+sys.path.insert(0, os.path.join(REPO_ROOT, "prompts"))
+from instrumentation import percentiles  # noqa: E402
+from syntax_validation import SyntaxValidator, validate  # noqa: E402
+
+
+def make_outputs(count, seed=0):
+    rng = random.Random(seed)
+
+    def python():
+        body = "\n".join(f"    total += values[{i}] * {rng.randint(1, 9)}" for i in range(rng.randint(5, 80)))
+        source = f"def weighted(values):\n    total = 0\n{body}\n    return total\n"
+        return rng.choice([source, source, source, f"```python\n{source}```", source + "    )\n"])
+
+    def json_output():
+        policy = {
+            "Version": "2012-10-17",
+            "Statement": [
+                {"Effect": "Allow", "Action": "s3:GetObject", "Resource": f"arn:aws:s3:::bucket-{i}/*"}
+                for i in range(rng.randint(1, 40))
+            ],
+        }
+        text = json.dumps(policy, indent=2)
+        return rng.choice([text, text, text, f"Here is the policy:\n{text}", text[: len(text) // 2]])
+
+    def regex():
+        return rng.choice([
+            r"^i-[0-9a-f]{8,17}$",
+            r"^arn:aws:s3:::[a-z0-9.-]{3,63}$",
+            r"/^sg-[0-9a-f]+$/",
+            r"^([a-z0-9]+-?)+$",
+            r"^(\w+\s?)*$",
+            r"[a-z",
+        ])
+
+    makers = [("python", python), ("json", json_output), ("regex", regex)]
+    return [(fmt, make()) for fmt, make in (rng.choice(makers) for _ in range(count))]
+
+
+class Heartbeat:
+    """Wakes up every `interval` seconds and records how late it was"""
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.delays = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            time.sleep(self.interval)
+            self.delays.append(time.perf_counter() - start - self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self):
+        p50, _, p99 = percentiles(self.delays)
+        return f"heartbeat late p50 {p50 * 1000:.2f} ms, p99 {p99 * 1000:.2f} ms, max {max(self.delays) * 1000:.1f} ms"
+
+
+def run(label, validate_all, outputs):
+    with Heartbeat() as heartbeat:
+        start = time.perf_counter()
+        results = validate_all(outputs)
+        elapsed = time.perf_counter() - start
+    print(f"{label:<8} {len(outputs) / elapsed:8.0f} outputs/s ({elapsed:.2f}s); {heartbeat.summary()}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--outputs", type=int, default=20_000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    outputs = make_outputs(args.outputs)
+    print(f"{len(outputs)} outputs, {sum(len(text) for _, text in outputs) / 1e6:.1f} MB")
+
+    inline = run("inline", lambda items: [validate(fmt, text) for fmt, text in items], outputs)
+
+    validator = SyntaxValidator(max_workers=args.workers, batch_size=args.batch_size)
+    validator.validate_many(outputs[: validator.max_workers * 4])  # start the workers
+    pooled = run(f"pool ({validator.max_workers})", validator.validate_many, outputs)
+    validator.close()
+
+    assert pooled == inline, "pool and inline results differ"
+    scores = collections.Counter(score for score, _ in pooled)
+    details = collections.Counter(re.sub(r" \(line \d+\)", "", detail) for _, detail in pooled)
+    print("scores: " + ", ".join(f"{score}: {count}" for score, count in sorted(scores.items(), reverse=True)))
+    for detail, count in details.most_common():
+        print(f"  {count:6}  {detail}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Compare the compiled template engine against the original render().
+
+Renders the grader template (dedent included) `--renders` times with each
+implementation, checks that both produce the same prompt, and reports the
+per-render cost.
+
+    python benchmarks/bench_templates.py --renders 10000
+"""
+import argparse
+import re
+import time
+from textwrap import dedent
+
+from bench_utils import load_lesson_module, point_clients_at
+
+
+def legacy_render(template_string, variables):
+    """PromptEvaluator.render before the compiled engine"""
+    placeholders = re.findall(r"{([^{}]+)}", template_string)
+
+    result = template_string
+    for placeholder in placeholders:
+        if placeholder in variables:
+            result = result.replace(
+                "{" + placeholder + "}", str(variables[placeholder])
+            )
+
+    return result.replace("{{", "{").replace("}}", "}")
+
+
+def grader_variables(i):
+    return {
+        "task_description": "Write a one-paragraph summary of a passage of text",
+        "prompt_inputs": f'"content":"Passage number {i} about renewable energy",\n',
+        "output": f"Summary {i}: solar and wind costs fell sharply over the last decade. " * 8,
+        "solution_criteria": "Mentions solar power\nMentions wind power\nIs one paragraph",
+        "extra_criteria_section": "",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--renders", type=int, default=10_000)
+    args = parser.parse_args()
+
+    # The lesson module builds an API client at import; nothing is requested
+    point_clients_at("http://127.0.0.1:9")
+    lesson = load_lesson_module("prompts/007_prompt_engineering_techniques.py")
+    compile_template = lesson.compile_template
+    template = lesson.GRADER_TEMPLATE
+    variables = [grader_variables(i) for i in range(args.renders)]
+
+    for values in variables[:100]:
+        expected = legacy_render(dedent(template), values)
+        assert compile_template(template, dedent=True).render(values) == expected
+
+    start = time.perf_counter()
+    for values in variables:
+        legacy_render(dedent(template), values)
+    legacy_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for values in variables:
+        compile_template(template, dedent=True).render(values)
+    compiled_elapsed = time.perf_counter() - start
+
+    print(f"{args.renders} grader renders (dedent included)")
+    print(f"legacy render:   {legacy_elapsed * 1e6 / args.renders:8.2f} us/render")
+    print(f"compiled render: {compiled_elapsed * 1e6 / args.renders:8.2f} us/render")
+    print(f"speedup: {legacy_elapsed / compiled_elapsed:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Wall-clock time of serial vs parallel tool execution.
+
+The tools in tool_use/tool_use.py are swapped for stand-ins that sleep for
+`--tool-latency` seconds before doing their real work, like a tool that calls
+a remote service. One turn with `--calls` tool_use blocks, and one batch_tool
+call with as many invocations, are run the old way (one after another) and
+through run_tools / run_batch.
+
+    python benchmarks/bench_tool_executor.py --calls 8 --tool-latency 0.2
+"""
+import argparse
+import json
+import time
+from types import SimpleNamespace
+
+from bench_utils import load_lesson_module, point_clients_at
+
+
+def slow(tool, latency):
+    def slow_tool(*args, **kwargs):
+        time.sleep(latency)
+        return tool(*args, **kwargs)
+
+    return slow_tool
+
+
+def tool_calls(num_calls):
+    calls = []
+    for i in range(num_calls):
+        if i % 2:
+            calls.append(("get_current_datetime", {"date_format": "%Y-%m-%d"}))
+        else:
+            calls.append(
+                (
+                    "add_duration_to_datetime",
+                    {"datetime_str": "2025-01-01", "duration": i, "unit": "days"},
+                )
+            )
+    return calls
+
+
+def serial_run_tools(tool_use, message):
+    """run_tools before the tool executor"""
+    blocks = []
+    for request in message.content:
+        try:
+            output = tool_use.run_tool(request.name, request.input)
+            blocks.append({"tool_use_id": request.id, "content": json.dumps(output)})
+        except Exception as e:
+            blocks.append({"tool_use_id": request.id, "content": f"error: {e}"})
+    return blocks
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=8)
+    parser.add_argument("--tool-latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    # tool_use.py builds a client at import; nothing is requested
+    point_clients_at("http://127.0.0.1:9")
+    tool_use = load_lesson_module("tool_use/tool_use.py")
+    for name in ("get_current_datetime", "add_duration_to_datetime"):
+        tool = tool_use.registry.get(name)
+        tool_use.registry.register(tool.schema, slow(tool.function, args.tool_latency))
+
+    calls = tool_calls(args.calls)
+    message = SimpleNamespace(
+        content=[
+            SimpleNamespace(type="tool_use", id=f"toolu_{i}", name=name, input=tool_input)
+            for i, (name, tool_input) in enumerate(calls)
+        ]
+    )
+    invocations = [
+        {"name": name, "arguments": json.dumps(tool_input)} for name, tool_input in calls
+    ]
+
+    serial_turn, serial_blocks = timed(serial_run_tools, tool_use, message)
+    parallel_turn, parallel_blocks = timed(tool_use.run_tools, message)
+    assert [block["tool_use_id"] for block in parallel_blocks] == [
+        block["tool_use_id"] for block in serial_blocks
+    ]
+    assert [block["content"] for block in parallel_blocks] == [
+        block["content"] for block in serial_blocks
+    ]
+
+    serial_batch, serial_output = timed(
+        lambda: [
+            {"tool_name": name, "output": tool_use.run_tool(name, tool_input)}
+            for name, tool_input in calls
+        ]
+    )
+    parallel_batch, parallel_output = timed(
+        tool_use.run_tool, "batch_tool", {"invocations": invocations}
+    )
+    assert parallel_output == serial_output
+
+    print(f"{args.calls} tool calls, {args.tool_latency * 1000:.0f} ms each")
+    print(f"run_tools: serial {serial_turn:.2f}s, parallel {parallel_turn:.2f}s "
+          f"({serial_turn / parallel_turn:.1f}x)")
+    print(f"batch_tool: serial {serial_batch:.2f}s, parallel {parallel_batch:.2f}s "
+          f"({serial_batch / parallel_batch:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""Helpers shared by the benchmark scripts."""
+import importlib.util
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def point_clients_at(url):
+    """Route every Anthropic client created after this call to `url`"""
+    os.environ["ANTHROPIC_BASE_URL"] = url
+    os.environ["ANTHROPIC_API_KEY"] = "fake-key-for-benchmarks"
+    os.environ.setdefault("CLAUDE_MODEL", "claude-haiku-4-5")
+    os.environ.setdefault("HAIKU_MODEL", "claude-haiku-4-5")
+
+
+def load_lesson_module(relative_path):
+    """Import a lesson script (e.g. prompts/007_...py) by file path.
+
+    The lesson scripts create their clients at import time, so call
+    `point_clients_at` first.
+    """
+    path = os.path.join(REPO_ROOT, relative_path)
+    module_dir = os.path.dirname(path)
+    if module_dir not in sys.path:
+        sys.path.insert(0, module_dir)
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
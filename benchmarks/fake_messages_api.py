@@ -0,0 +1,535 @@
+"""
+A local stand-in for the Anthropic Messages API, used by the benchmarks.
+
+It answers `POST /v1/messages` after a fixed artificial latency, with canned
+responses shaped like the ones the lesson scripts expect (JSON ideas, JSON
+test cases, JSON grades or arrays of per-case grades, code, or plain text).
+Idea lists are drawn from a fixed vocabulary, and some ideas rephrase earlier
+ones.
+It also stubs the Message Batches endpoints: a batch reports "ended"
+`batch_latency` seconds after it was created. System prompt blocks marked
+with `cache_control` are "cached" once they reach `min_cacheable_tokens`, and
+later requests with the same prefix report them as
+`cache_read_input_tokens`.
+
+When a request offers `tools` and the last user turn isn't tool results, the
+fake calls every offered tool once, with placeholder values for required
+fields; the turn after the tool results gets a plain text answer. Requests
+with `"stream": true` get server-sent events, and each content block takes
+`block_latency` seconds to "generate", streamed or not. With `chunk_latency`
+set, text also comes out at that many seconds per 40-character chunk, so
+streamed responses arrive piece by piece. Point a client at it with:
+
+    os.environ["ANTHROPIC_BASE_URL"] = server.url
+
+Use `serve_in_subprocess` when benchmarking throughput, so the server's
+threads don't compete with the client for the GIL.
+"""
+import collections
+import contextlib
+import json
+import multiprocessing
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _last_text(messages, role):
+    for message in reversed(messages):
+        if message["role"] != role:
+            continue
+        content = message["content"]
+        if isinstance(content, str):
+            return content
+        return "".join(
+            block.get("text", "") for block in content if block.get("type") == "text"
+        )
+    return ""
+
+
+# Each scenario part can be written two ways
+IDEA_ATHLETES = [
+    ("marathon runner", "long-distance runner"), ("powerlifter", "strength athlete"),
+    ("competitive swimmer", "club swimmer"), ("road cyclist", "cyclist"),
+    ("teenage footballer", "youth soccer player"), ("masters triathlete", "triathlete over 50"),
+    ("ballet dancer", "professional dancer"), ("rock climber", "boulderer"),
+    ("rugby prop", "rugby forward"), ("tennis player", "tennis pro"), ("rower", "crew rower"),
+    ("sprinter", "100m sprinter"), ("boxer making weight", "boxer cutting weight"),
+    ("ultra-trail runner", "ultramarathoner"), ("gymnast", "artistic gymnast"),
+    ("basketball center", "basketball player"),
+]
+IDEA_FOCUSES = [
+    ("carbohydrate loading", "carb loading"), ("lean muscle gain", "building lean muscle"),
+    ("fat loss", "losing body fat"), ("hydration", "fluid intake"),
+    ("recovery nutrition", "post-workout recovery"), ("iron intake", "iron levels"),
+    ("bone health", "bone density"), ("gut comfort", "digestive comfort"),
+    ("sleep quality", "better sleep"), ("pre-workout fueling", "pre-training meals"),
+    ("micronutrient balance", "vitamins and minerals"), ("electrolytes", "electrolyte balance"),
+]
+IDEA_CONSTRAINTS = [
+    ("on a tight budget", "on a limited grocery budget"), ("with a peanut allergy", "allergic to peanuts"),
+    ("while travelling", "on the road for competitions"), ("following a vegan diet", "eating plant-based only"),
+    ("with lactose intolerance", "who can't digest lactose"), ("without a kitchen", "with no cooking facilities"),
+    ("during Ramadan fasting", "while fasting for Ramadan"), ("with type 1 diabetes", "managing type 1 diabetes"),
+    ("eating halal only", "keeping a halal diet"), ("training twice a day", "doing double sessions daily"),
+]
+IDEA_PHRASINGS = [
+    "Testing with a {athlete} focused on {focus} {constraint}",
+    "Testing a {athlete} who needs {focus}, {constraint}",
+    "{athlete} prioritizing {focus} {constraint}",
+]
+
+
+def fake_ideas(prompt, count, repeat_rate=0.2):
+    """`count` varied test case ideas, the same ones for the same prompt.
+    About `repeat_rate` of them rephrase an earlier idea, as models do when
+    asked for many"""
+    rng = random.Random(prompt)
+    combos = []
+    ideas = []
+    for _ in range(count):
+        if combos and rng.random() < repeat_rate:
+            combo = rng.choice(combos)
+        else:
+            combo = tuple(rng.randrange(len(part)) for part in (IDEA_ATHLETES, IDEA_FOCUSES, IDEA_CONSTRAINTS))
+            combos.append(combo)
+        athlete, focus, constraint = (
+            rng.choice(part[i]) for part, i in zip((IDEA_ATHLETES, IDEA_FOCUSES, IDEA_CONSTRAINTS), combo)
+        )
+        idea = rng.choice(IDEA_PHRASINGS).format(athlete=athlete, focus=focus, constraint=constraint)
+        ideas.append(idea[0].upper() + idea[1:])
+    return ideas
+
+
+def fake_completion_text(params):
+    """Return a canned completion for a Messages API request body"""
+    messages = params.get("messages", [])
+    prompt = _last_text(messages, "user")
+    prefill = messages[-1]["content"] if messages[-1]["role"] == "assistant" else ""
+
+    if prefill == "```json":
+        match = re.search(r"Generate (\d+) unique", prompt)
+        if match:
+            ideas = fake_ideas(prompt, int(match.group(1)))
+            return "\n" + json.dumps(ideas, indent=2) + "\n"
+
+        if "Generate a single detailed test case" in prompt:
+            keys_match = re.search(
+                r"<allowed_input_keys>\s*(.*?)\s*</allowed_input_keys>", prompt, re.S
+            )
+            keys = re.findall(r'"([^"]+)"', keys_match.group(1)) if keys_match else []
+            test_case = {
+                "prompt_inputs": {key: f"example {key}" for key in keys},
+                "solution_criteria": ["Meets the task description"],
+            }
+            return "\n" + json.dumps(test_case, indent=2) + "\n"
+
+        if "Generate an evaluation dataset" in prompt:
+            tasks = [
+                {"task": "Write a Python function that returns an S3 bucket ARN", "format": "python"},
+                {"task": "Write a JSON IAM policy allowing s3:GetObject", "format": "json"},
+                {"task": "Write a regex that matches an EC2 instance id", "format": "regex"},
+            ]
+            return "\n" + json.dumps(tasks, indent=2) + "\n"
+
+        case_ids = re.findall(r'<case id="([^"]+)">', prompt)
+        if case_ids:
+            # Batched grading: one grade per case
+            grades = [
+                {
+                    "case_id": case_id,
+                    "strengths": ["Addresses the task"],
+                    "weaknesses": ["Could be more concise"],
+                    "reasoning": "The solution meets the listed criteria.",
+                    "score": 8,
+                }
+                for case_id in case_ids
+            ]
+            return "\n" + json.dumps(grades, indent=2) + "\n"
+
+        grade = {
+            "strengths": ["Addresses the task"],
+            "weaknesses": ["Could be more concise"],
+            "reasoning": "The solution meets the listed criteria.",
+            "score": 8,
+        }
+        return "\n" + json.dumps(grade, indent=2) + "\n"
+
+    if prefill == "```code":
+        return "\ndef bucket_arn(name):\n    return f'arn:aws:s3:::{name}'\n"
+
+    return "This is a fake response from the local Messages API stand-in."
+
+
+def _cached_prefix(params):
+    """The system blocks up to the last cache breakpoint, serialized, or None"""
+    system = params.get("system")
+    if not isinstance(system, list):
+        return None
+    breakpoints = [i for i, block in enumerate(system) if block.get("cache_control")]
+    if not breakpoints:
+        return None
+    return params.get("model", "") + json.dumps(system[: breakpoints[-1] + 1])
+
+
+_PLACEHOLDERS = {
+    "string": "example",
+    "number": 1,
+    "integer": 1,
+    "boolean": True,
+    "array": [],
+    "object": {},
+}
+
+
+def fake_tool_calls(params):
+    """tool_use blocks calling every offered tool, or None when the fake
+    should answer with text"""
+    tools = params.get("tools")
+    messages = params.get("messages", [])
+    if not tools or not messages:
+        return None
+    content = messages[-1]["content"]
+    if isinstance(content, list) and any(
+        block.get("type") == "tool_result" for block in content
+    ):
+        return None
+
+    calls = []
+    for tool in tools:
+        schema = tool["input_schema"]
+        properties = schema.get("properties", {})
+        calls.append(
+            {
+                "type": "tool_use",
+                "id": f"toolu_{uuid.uuid4().hex[:24]}",
+                "name": tool["name"],
+                "input": {
+                    name: _PLACEHOLDERS.get(properties.get(name, {}).get("type"), "example")
+                    for name in schema.get("required", [])
+                },
+            }
+        )
+    return calls
+
+
+def fake_message(params, cache_read=0, cache_write=0):
+    """Return a Messages API response body for a request body"""
+    tool_calls = fake_tool_calls(params)
+    text = "" if tool_calls else fake_completion_text(params)
+    prompt_tokens = len(
+        json.dumps(params.get("messages", [])) + json.dumps(params.get("system", ""))
+    ) // 4
+    stop_sequences = params.get("stop_sequences") or []
+    if tool_calls:
+        stop_reason = "tool_use"
+    elif stop_sequences:
+        stop_reason = "stop_sequence"
+    else:
+        stop_reason = "end_turn"
+    return {
+        "id": f"msg_{uuid.uuid4().hex[:24]}",
+        "type": "message",
+        "role": "assistant",
+        "model": params.get("model", "fake-model"),
+        "content": tool_calls or [{"type": "text", "text": text}],
+        "stop_reason": stop_reason,
+        "stop_sequence": stop_sequences[0] if stop_reason == "stop_sequence" else None,
+        "usage": {
+            "input_tokens": max(1, prompt_tokens - cache_read - cache_write),
+            "output_tokens": max(1, len(text or json.dumps(tool_calls)) // 4),
+            "cache_read_input_tokens": cache_read,
+            "cache_creation_input_tokens": cache_write,
+        },
+    }
+
+
+def _chunks(text, size):
+    return [text[i : i + size] for i in range(0, len(text), size)] or [""]
+
+
+def _iso(timestamp):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(timestamp))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, Nagle plus
+    # delayed ACKs add ~40 ms to every response.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("content-length", 0))
+        body = self.rfile.read(length)
+        if len(body) < length:
+            raise ConnectionResetError("client went away mid-request")
+        return json.loads(body or b"{}")
+
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _not_found(self):
+        error = {"type": "not_found_error", "message": self.path}
+        self._send_json(404, {"type": "error", "error": error})
+
+    def do_GET(self):
+        match = re.fullmatch(r"/v1/messages/batches/([\w-]+)(/results)?", self.path.split("?")[0])
+        batch = self.server.batches.get(match.group(1)) if match else None
+        if batch is None:
+            self._not_found()
+            return
+
+        if not match.group(2):
+            self._send_json(200, self.server.batch_status(match.group(1)))
+            return
+
+        lines = [
+            json.dumps({"custom_id": request["custom_id"], "result": {"type": "succeeded", "message": fake_message(request["params"])}})
+            for request in batch["requests"]
+        ]
+        payload = ("\n".join(lines) + "\n").encode()
+        self.send_response(200)
+        self.send_header("content-type", "application/binary")
+        self.send_header("content-length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        params = self._read_json()
+        path = self.path.split("?")[0]
+        if path == "/v1/messages/batches":
+            batch_id = self.server.create_batch(params["requests"])
+            self._send_json(200, self.server.batch_status(batch_id))
+            return
+        if path != "/v1/messages":
+            self._not_found()
+            return
+
+        allowed, remaining = self.server.record_request()
+        headers = {}
+        if self.server.requests_per_minute is not None:
+            headers = {
+                "anthropic-ratelimit-requests-limit": str(self.server.requests_per_minute),
+                "anthropic-ratelimit-requests-remaining": str(remaining),
+            }
+        if not allowed:
+            headers["retry-after"] = "1"
+            error = {"type": "rate_limit_error", "message": "Fake rate limit exceeded"}
+            self._send_json(429, {"type": "error", "error": error}, headers)
+            return
+
+        time.sleep(self.server.latency)
+
+        cache_read, cache_write = self.server.prompt_cache_usage(params)
+        message = fake_message(params, cache_read, cache_write)
+        if params.get("stream"):
+            self._send_stream(message, headers)
+            return
+        text_chunks = sum(
+            len(_chunks(block["text"], 40)) for block in message["content"] if block["type"] == "text"
+        )
+        time.sleep(
+            self.server.block_latency * len(message["content"])
+            + self.server.chunk_latency * text_chunks
+        )
+        self._send_json(200, message, headers)
+
+    def _send_stream(self, message, headers):
+        self.send_response(200)
+        self.send_header("content-type", "text/event-stream")
+        self.send_header("connection", "close")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.close_connection = True
+
+        def send(event):
+            self.wfile.write(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode())
+            self.wfile.flush()
+
+        start = dict(
+            message,
+            content=[],
+            stop_reason=None,
+            stop_sequence=None,
+            usage=dict(message["usage"], output_tokens=1),
+        )
+        send({"type": "message_start", "message": start})
+        for index, block in enumerate(message["content"]):
+            time.sleep(self.server.block_latency)
+            if block["type"] == "text":
+                send({"type": "content_block_start", "index": index, "content_block": {"type": "text", "text": ""}})
+                for chunk in _chunks(block["text"], 40):
+                    time.sleep(self.server.chunk_latency)
+                    send({"type": "content_block_delta", "index": index, "delta": {"type": "text_delta", "text": chunk}})
+            else:
+                send({"type": "content_block_start", "index": index, "content_block": dict(block, input={})})
+                for chunk in _chunks(json.dumps(block["input"]), 16):
+                    send({"type": "content_block_delta", "index": index, "delta": {"type": "input_json_delta", "partial_json": chunk}})
+            send({"type": "content_block_stop", "index": index})
+        send(
+            {
+                "type": "message_delta",
+                "delta": {"stop_reason": message["stop_reason"], "stop_sequence": message["stop_sequence"]},
+                "usage": {"output_tokens": message["usage"]["output_tokens"]},
+            }
+        )
+        send({"type": "message_stop"})
+
+
+class FakeMessagesAPI(ThreadingHTTPServer):
+    """Threaded HTTP server that fakes the Messages API with a fixed latency"""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(
+        self,
+        latency=0.05,
+        requests_per_minute=None,
+        batch_latency=1.0,
+        min_cacheable_tokens=0,
+        block_latency=0.0,
+        chunk_latency=0.0,
+        host="127.0.0.1",
+        port=0,
+    ):
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        self.batch_latency = batch_latency
+        self.min_cacheable_tokens = min_cacheable_tokens
+        self.block_latency = block_latency
+        self.chunk_latency = chunk_latency
+        self.cached_prefixes = set()
+        self.batches = {}
+        # When set, requests beyond this rate get a 429. Like the real API, the
+        # limit is enforced over short intervals (here: per second), so bursts
+        # are rejected even when the per-minute total is fine.
+        self.requests_per_minute = requests_per_minute
+        self.request_count = 0
+        self.rejected_count = 0
+        self._recent = collections.deque()
+        self._count_lock = threading.Lock()
+        self._thread = None
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return  # a client that went away, e.g. a worker process killed by a benchmark
+        super().handle_error(request, client_address)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record_request(self):
+        """Count a request. Returns (allowed, remaining requests this minute)"""
+        with self._count_lock:
+            if self.requests_per_minute is None:
+                self.request_count += 1
+                return True, None
+
+            per_second = max(1, self.requests_per_minute // 60)
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] >= 1:
+                self._recent.popleft()
+            if len(self._recent) >= per_second:
+                self.rejected_count += 1
+                return False, 0
+            self._recent.append(now)
+            self.request_count += 1
+            return True, (per_second - len(self._recent)) * 60
+
+    def prompt_cache_usage(self, params):
+        """Returns (cache read, cache write) input tokens for a request"""
+        prefix = _cached_prefix(params)
+        if prefix is None:
+            return 0, 0
+        tokens = len(prefix) // 4
+        if tokens < self.min_cacheable_tokens:
+            return 0, 0
+        with self._count_lock:
+            if prefix in self.cached_prefixes:
+                return tokens, 0
+            self.cached_prefixes.add(prefix)
+            return 0, tokens
+
+    def create_batch(self, requests):
+        batch_id = f"msgbatch_{uuid.uuid4().hex[:24]}"
+        with self._count_lock:
+            self.batches[batch_id] = {"created": time.time(), "requests": requests}
+        return batch_id
+
+    def batch_status(self, batch_id):
+        batch = self.batches[batch_id]
+        count = len(batch["requests"])
+        ended = time.time() - batch["created"] >= self.batch_latency
+        return {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {
+                "processing": 0 if ended else count,
+                "succeeded": count if ended else 0,
+                "errored": 0,
+                "canceled": 0,
+                "expired": 0,
+            },
+            "created_at": _iso(batch["created"]),
+            "expires_at": _iso(batch["created"] + 86400),
+            "ended_at": _iso(time.time()) if ended else None,
+            "archived_at": None,
+            "cancel_initiated_at": None,
+            "results_url": f"{self.url}/v1/messages/batches/{batch_id}/results" if ended else None,
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def _serve(url_queue, server_kwargs):
+    server = FakeMessagesAPI(**server_kwargs)
+    url_queue.put(server.url)
+    server.serve_forever()
+
+
+@contextlib.contextmanager
+def serve_in_subprocess(latency=0.05, requests_per_minute=None, **server_kwargs):
+    """Run a FakeMessagesAPI in a child process and yield its base URL"""
+    server_kwargs.update(latency=latency, requests_per_minute=requests_per_minute)
+    url_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=_serve, args=(url_queue, server_kwargs), daemon=True
+    )
+    process.start()
+    try:
+        yield url_queue.get(timeout=10)
+    finally:
+        process.terminate()
+        process.join()
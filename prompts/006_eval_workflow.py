@@ -1,19 +1,41 @@
-from anthropic import Anthropic
+from clients import ClientFactory
+from dataset_loader import load_dataset, write_jsonl
 from dotenv import load_dotenv
+from json_stream import loads_lenient
+from message_batches import batch_cost, run_message_batch
+from pipeline import PipelineMetrics, run_pipeline
+from rate_limiter import AdaptiveRateLimiter
+from response_cache import ResponseCache
+from results_store import ResultsStore
 from statistics import mean
+from syntax_validation import SyntaxValidator
+import argparse
+import hashlib
+import inspect
 import json
 import os
-# Functions to validate the output structure
-import re
-import ast
+import threading
+import time
 
 # iniitialize environment variables
 _ = load_dotenv(override=True)
 model = os.getenv("HAIKU_MODEL")
 # model = os.getenv("CLAUDE_MODEL")
 
-# initialize client
-client = Anthropic()
+# initialize client. One pool of keep-alive connections, sized by run_eval;
+# retries are left to the rate limiter, which needs to see every 429
+client_factory = ClientFactory(max_retries=0)
+rate_limiter = AdaptiveRateLimiter()
+# Unchanged temperature=0 requests are answered from disk on re-runs
+response_cache = ResponseCache(deterministic_only=True)
+# Parses outputs in worker processes, off the GIL the API threads need.
+# Made on first use, so importing this file starts nothing; see
+# get_syntax_validator
+syntax_validator = None
+_syntax_validator_lock = threading.Lock()
+# Scores of every run, for comparing prompt versions; see results_store.py.
+# Opened when a run is saved, so importing this file creates no directory
+results_store_path = "eval_results_store"
 
 # Initial prompt draft
 def generate_answer_prompt(user_question):
@@ -45,7 +67,10 @@ def chat(messages, system_prompt=None, temperature=0.0, stop_sequences=None):
     if system_prompt:
         params["system"] = system_prompt
     
-    message = client.messages.create(**params)
+    message = response_cache.get(params)
+    if message is None:
+        message = rate_limiter.create(client_factory.client, **params)
+        response_cache.put(params, message)
 
     return message.content[0].text
 
@@ -77,11 +102,11 @@ def generate_dataset():
     add_assistant_message(messages, "```json")
     text = chat(messages, stop_sequences=["```"])
 
-    return json.loads(text)
+    return loads_lenient(text)
 
 
-def run_prompt(test_case):
-    """Merges the prompt and test case input, then returns the result"""
+def build_prompt_messages(test_case):
+    """Merges the prompt and test case input into a prefilled conversation"""
     prompt = f"""
     Please solve the following task: 
     {test_case['task']}
@@ -92,44 +117,40 @@ def run_prompt(test_case):
     messages = []
     add_user_message(messages, prompt)
     add_assistant_message(messages, "```code")
-    answer = chat(messages, stop_sequences=["```"])
-    return answer
+    return messages
 
 
-#### Functions to validate output syntax
+def run_prompt(test_case):
+    """Merges the prompt and test case input, then returns the result"""
+    answer = chat(build_prompt_messages(test_case), stop_sequences=["```"])
+    return answer
 
-def validate_json(text):
-    try:
-        json.loads(text.strip())
-        return 10
-    except json.JSONDecodeError:
-        return 0
 
+#### Functions to validate output syntax
 
-def validate_python(text):
-    try:
-        ast.parse(text.strip())
-        return 10
-    except SyntaxError:
-        return 0
+def get_syntax_validator():
+    """The shared SyntaxValidator, made on first use. Close it with
+    close_syntax_validator when done"""
+    global syntax_validator
+    with _syntax_validator_lock:
+        if syntax_validator is None:
+            syntax_validator = SyntaxValidator()
+        return syntax_validator
 
 
-def validate_regex(text):
-    try:
-        re.compile(text.strip())
-        return 10
-    except re.error:
-        return 0
+def close_syntax_validator():
+    """Shuts down the validator's worker processes, if any were started"""
+    global syntax_validator
+    with _syntax_validator_lock:
+        validator, syntax_validator = syntax_validator, None
+    if validator is not None:
+        validator.close()
 
 
 def grade_syntax(response, test_case):
-    format = test_case["format"]
-    if format == "json":
-        return validate_json(response)
-    elif format == "python":
-        return validate_python(response)
-    else:
-        return validate_regex(response)
+    """(score, detail): 0-10 for how valid the output's syntax is, see
+    syntax_validation.py"""
+    return get_syntax_validator().validate(test_case["format"], response)
 
 ### EVAL WORKFLOW
 
@@ -138,38 +159,193 @@ def run_test_case(test_case):
     output = run_prompt(test_case)
 
     # GRADING
-    model_grade = grade_by_model(test_case, output)
-    model_score = model_grade['score']
-    reasoning = model_grade['reasoning']
+    return grade_test_case(test_case, output)
 
-    syntax_score = grade_syntax(output, test_case)
+
+def grade_test_case(test_case, output):
+    """Grades an output with the model and its syntax. A grader reply that
+    doesn't parse counts as a failed grade instead of raising"""
+    try:
+        model_grade = grade_by_model(test_case, output)
+    except json.JSONDecodeError as e:
+        model_grade = {"error": f"unparseable grade ({e})"}
+    return score_test_case(test_case, output, model_grade)
+
+
+def score_test_case(test_case, output, model_grade, syntax=None):
+    """Combines the model grade with the syntax grade into a result.
+    `syntax` is an already computed grade_syntax result. A model grade
+    without a score and reasoning scores 0, with a `grade_error`, so one bad
+    grader reply fails its case rather than the whole run"""
+    grade_error = None
+    try:
+        model_score = model_grade['score']
+        reasoning = model_grade['reasoning']
+    except (KeyError, TypeError):
+        model_score = 0
+        reasoning = ""
+        grade_error = f"Grader reply has no score and reasoning: {str(model_grade)[:200]}"
+
+    syntax_score, syntax_detail = syntax or grade_syntax(output, test_case)
 
     # Total average score
     score = (model_score + syntax_score) / 2
 
-    return {
+    result = {
         "output": output,
         "score": score,
         "test_case": test_case,
-        "reasoning": reasoning
+        "reasoning": reasoning,
+        "syntax_score": syntax_score,
+        "syntax_detail": syntax_detail,
     }
+    if grade_error:
+        result["grade_error"] = grade_error
+    return result
 
-def run_eval(dataset):
-    """Loads the dataset and calls run_test_case with each case"""
-    results = [run_test_case(test_case) for test_case in dataset]
+def run_eval(dataset, generation_workers=3, grading_workers=3):
+    """Runs every test case through a generate stage and a grade stage.
+
+    The stages run concurrently, so a case is graded while later cases are
+    still being generated. Results come back in dataset order.
+    """
+    client_factory.reserve(generation_workers + grading_workers)
+    metrics = PipelineMetrics(generation_workers, grading_workers, 2 * grading_workers)
+    graded = run_pipeline(
+        enumerate(dataset),
+        lambda item: run_prompt(item[1]),
+        lambda item, output: (item[0], grade_test_case(item[1], output)),
+        generation_workers=generation_workers,
+        grading_workers=grading_workers,
+        queue_size=metrics.queue_size,
+        metrics=metrics,
+    )
+    results = [result for _, result in sorted(graded, key=lambda pair: pair[0])]
+    failed = sum(1 for result in results if "grade_error" in result)
+    if failed:
+        print(f"{failed} cases had no valid model grade and scored 0 for it")
+    print(f"Pipeline:\n{metrics.summary()}")
+    print(f"Connection pool: {client_factory.pool_metrics.summary()}")
+    return save_eval_results(results)
+
+
+def run_eval_batch(dataset, poll_interval=10.0):
+    """Same as run_eval, but runs the prompts and then the model grades as two
+    Message Batches. Half the price, for offline suites that can wait."""
+    # Test cases are looked up by index, so a lazy JSONL dataset is read
+    # into a list
+    dataset = list(dataset)
+    if not dataset:
+        print("Batch backend: no test cases to run")
+        return []
+    start = time.perf_counter()
+
+    prompt_run = run_message_batch(
+        client_factory.client,
+        {
+            f"case-{index}": {
+                "model": model,
+                "max_tokens": 1000,
+                "messages": build_prompt_messages(test_case),
+                "temperature": 0.0,
+                "stop_sequences": ["```"],
+            }
+            for index, test_case in enumerate(dataset)
+        },
+        poll_interval,
+        label="prompts",
+    )
+    grade_run = run_message_batch(
+        client_factory.client,
+        {
+            custom_id: {
+                "model": model,
+                "max_tokens": 1000,
+                "messages": build_grade_messages(
+                    dataset[int(custom_id.split("-")[1])], prompt_run.text(custom_id)
+                ),
+                "temperature": 0.0,
+                "stop_sequences": ["```"],
+            }
+            for custom_id in prompt_run.messages
+        },
+        poll_interval,
+        label="grades",
+    )
 
-    average_score = mean([result["score"] for result in results])
-    print(f"Average score: {average_score}")
+    # All outputs are here at once, so validate them in one go
+    graded = [
+        index for index in range(len(dataset)) if f"case-{index}" in grade_run.messages
+    ]
+    syntax = get_syntax_validator().validate_many(
+        [(dataset[index]["format"], prompt_run.text(f"case-{index}")) for index in graded]
+    )
+
+    results = []
+    for index, syntax_grade in zip(graded, syntax):
+        custom_id = f"case-{index}"
+        try:
+            model_grade = loads_lenient(grade_run.text(custom_id))
+        except json.JSONDecodeError as e:
+            # score_test_case scores it 0 with a grade_error, as in run_eval
+            model_grade = {"error": f"unparseable grade ({e})"}
+        results.append(
+            score_test_case(dataset[index], prompt_run.text(custom_id), model_grade, syntax_grade)
+        )
+
+    failed = sum(1 for result in results if "grade_error" in result)
+    if failed:
+        print(f"{failed} cases had no valid model grade and scored 0 for it")
+
+    elapsed = time.perf_counter() - start
+    cost = batch_cost(
+        model,
+        prompt_run.input_tokens + grade_run.input_tokens,
+        prompt_run.output_tokens + grade_run.output_tokens,
+    )
+    cost_per_case = f"${cost / len(dataset):.5f}" if cost is not None else "n/a"
+    print(
+        f"Batch backend: {len(results)}/{len(dataset)} cases in {elapsed:.1f}s "
+        f"({len(dataset) / elapsed:.1f} cases/s), {cost_per_case} per case"
+    )
+
+    return save_eval_results(results)
+
+
+def save_eval_results(results):
+    if results:
+        print(f"Average score: {mean([result['score'] for result in results])}")
+    else:
+        print("No results to score")
+    print(f"Rate limiter: {rate_limiter.summary()}")
+    response_cache.flush()
+    print(f"Response cache: {response_cache.summary()}")
+    print(f"Syntax validation: {get_syntax_validator().summary()}")
 
     try:
         with open("eval_results.json", "w") as f:
             json.dump(results, f, indent=2)
     except Exception as e:
         print(f"Error saving eval results: {e}")
-    
+
+    results_store = ResultsStore(results_store_path)
+    run_id = results_store.append_run(results, prompt_fingerprint())
+    if run_id is not None:
+        print(f"Results store: run {run_id} added to {results_store.path}")
     return results
 
 
+def prompt_fingerprint():
+    """Hash of the model and the prompt and grader builders, so runs of
+    the same prompt version group together in the results store"""
+    parts = [
+        model or "",
+        inspect.getsource(build_prompt_messages),
+        inspect.getsource(build_grade_messages),
+    ]
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
 ############### GRADERS ############
 ##### Three different kinds.
 # 1. Code, 2. Model, 3. Human
@@ -183,7 +359,7 @@ def run_eval(dataset):
 # 3. Task Following - model grader
 
 # Function to grade a test case + output using a model
-def grade_by_model(test_case, output):
+def build_grade_messages(test_case, output):
     eval_prompt = f"""
     You are an expert AWS code reviewer. Your task is to evaluate the following AI-generated solution.
 
@@ -217,22 +393,37 @@ def grade_by_model(test_case, output):
     messages = []
     add_user_message(messages, eval_prompt)
     add_assistant_message(messages, "```json")
-    eval_text = chat(messages, stop_sequences=["```"])
+    return messages
 
-    return json.loads(eval_text)
 
+def grade_by_model(test_case, output):
+    eval_text = chat(build_grade_messages(test_case, output), stop_sequences=["```"])
 
+    return loads_lenient(eval_text)
 
 
-if __name__ == "__main__":
 
-    try: 
-        with open("generated_dataset.json", "r") as f:
-            dataset = json.load(f)
-    except FileNotFoundError:
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the eval workflow")
+    # A .jsonl dataset is read lazily, so the first case runs right away
+    parser.add_argument("--dataset", default="generated_dataset.json")
+    parser.add_argument("--sample", type=int, help="run this many random test cases")
+    parser.add_argument("--shard", help="run slice i of n of the dataset, e.g. 3/8")
+    args = parser.parse_args()
+
+    if os.path.exists(args.dataset):
+        dataset = load_dataset(args.dataset, args.sample, args.shard)
+    else:
         dataset = generate_dataset()
 
-        with open("generated_dataset.json", "w") as f:
-            json.dump(dataset, f, indent=2)
+        if args.dataset.endswith(".jsonl"):
+            write_jsonl(dataset, args.dataset)
+        else:
+            with open(args.dataset, "w") as f:
+                json.dump(dataset, f, indent=2)
 
-    results = run_eval(dataset)
+    try:
+        results = run_eval(dataset)
+    finally:
+        close_syntax_validator()
@@ -1,19 +1,90 @@
 # Imports
 import json
+import asyncio
+import hashlib
+import os
+import inspect
 import concurrent.futures
-import re
+import contextvars
+import time
 from textwrap import dedent
-from statistics import mean
 from dotenv import load_dotenv
-from anthropic import Anthropic
+from anthropic import AsyncAnthropic, DefaultAioHttpClient
+from batched_grading import (
+    DynamicBatcher,
+    GradingBatchStats,
+    estimate_tokens,
+    parse_batched_grades,
+)
+from clients import ClientFactory
+from dataset_loader import load_dataset
+from message_batches import batch_cost, run_message_batch
+from pipeline import PipelineMetrics, run_pipeline
+from instrumentation import CallMetrics, call_site, current_call_site, track_usage
+from idea_index import IdeaIndex
+from json_stream import JsonArrayParser, iter_json_array, loads_lenient
+from prompt_cache import cached_system
+from templates import compile_template
+from rate_limiter import AdaptiveRateLimiter
+from sharded_runner import SHARD_CALLS_FILE, SHARD_RESULTS_FILE
+from report import generate_prompt_evaluation_report, write_prompt_evaluation_report
+from response_cache import ResponseCache
+from results_store import ResultsStore
+from result_log import (
+    JsonlResultWriter,
+    iter_results,
+    logged_fingerprints,
+    prune_results,
+    write_json_array,
+)
 
 # Client Initialization and helper functions
 
 _ = load_dotenv()
 
-client = Anthropic()
+# One client, and one pool of keep-alive connections, for every sync call.
+# PromptEvaluator sizes the pool to its worker counts; see clients.py.
+# Retries are left to the rate limiter, which needs to see every 429
+client_factory = ClientFactory(max_retries=0)
 model = "claude-haiku-4-5"
 
+# Latency, tokens, stop reasons and retries of every call that reaches the
+# API, grouped by call site (run_prompt, grade_output, ...)
+call_metrics = CallMetrics()
+
+# Shared by every chat()/achat() call, so generate_dataset, run_evaluation and
+# run_evaluation_async all stay within the same rate limits
+rate_limiter = AdaptiveRateLimiter(on_retry=call_metrics.count_retry)
+
+# Unchanged requests are answered from disk on re-runs. Only temperature=0
+# calls (e.g. grading) are cached unless deterministic_only=False
+response_cache = ResponseCache(deterministic_only=True)
+
+# One AsyncAnthropic client per event loop, since aiohttp sessions can't be
+# shared across loops (e.g. two asyncio.run calls)
+_async_clients = {}
+
+
+def get_async_client():
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        try:
+            # httpx's async connection pool slows down badly past a few dozen
+            # concurrent requests; the aiohttp transport keeps up with hundreds.
+            # Install it with `pip install anthropic[aiohttp]`
+            _async_clients[loop] = AsyncAnthropic(
+                http_client=DefaultAioHttpClient(), max_retries=0
+            )
+        except RuntimeError:
+            _async_clients[loop] = AsyncAnthropic(max_retries=0)
+    return _async_clients[loop]
+
+
+async def close_async_client():
+    async_client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if async_client is not None:
+        await async_client.close()
+
 
 def add_user_message(messages, text):
     user_message = {"role": "user", "content": text}
@@ -25,7 +96,61 @@ def add_assistant_message(messages, text):
     messages.append(assistant_message)
 
 
-def chat(messages, system=None, temperature=1.0, stop_sequences=[]):
+def chat(messages, system=None, temperature=1.0, stop_sequences=[], max_tokens=1000):
+    params = {
+        "model": model,
+        "max_tokens": max_tokens,
+        "messages": messages,
+        "temperature": temperature,
+        "stop_sequences": stop_sequences,
+    }
+
+    if system:
+        params["system"] = system
+
+    message = response_cache.get(params)
+    if message is None:
+        with call_metrics.measure() as call:
+            message = rate_limiter.create(client_factory.client, **params)
+            call.finish(message)
+        response_cache.put(params, message)
+    return message.content[0].text
+
+
+def chat_stream(messages, system=None, temperature=1.0, stop_sequences=[], max_tokens=1000):
+    """chat(), but returns an iterator over the response text as it streams in"""
+    params = {
+        "model": model,
+        "max_tokens": max_tokens,
+        "messages": messages,
+        "temperature": temperature,
+        "stop_sequences": stop_sequences,
+    }
+
+    if system:
+        params["system"] = system
+
+    # Read now: the generator runs later, outside the caller's call_site()
+    return _stream_text(params, current_call_site())
+
+
+def _stream_text(params, site):
+    message = response_cache.get(params)
+    if message is not None:
+        yield message.content[0].text
+        return
+
+    with call_metrics.measure(site) as call:
+        with rate_limiter.stream(client_factory.client, **params) as stream:
+            for text in stream.text_stream:
+                call.first_token()
+                yield text
+            message = stream.get_final_message()
+        call.finish(message)
+    response_cache.put(params, message)
+
+
+async def achat(messages, system=None, temperature=1.0, stop_sequences=[]):
     params = {
         "model": model,
         "max_tokens": 1000,
@@ -37,219 +162,196 @@ def chat(messages, system=None, temperature=1.0, stop_sequences=[]):
     if system:
         params["system"] = system
 
-    message = client.messages.create(**params)
+    # The cache's SQLite reads and writes block, so they run in a thread
+    # rather than stalling every other coroutine on the event loop
+    cacheable = response_cache.cacheable(params)
+    message = await asyncio.to_thread(response_cache.get, params) if cacheable else None
+    if message is None:
+        with call_metrics.measure() as call:
+            message = await rate_limiter.acreate(get_async_client(), **params)
+            call.finish(message)
+        if cacheable:
+            await asyncio.to_thread(response_cache.put, params, message)
     return message.content[0].text
 
 
-# Report Builder
-def generate_prompt_evaluation_report(evaluation_results):
-    total_tests = len(evaluation_results)
-    scores = [result["score"] for result in evaluation_results]
-    avg_score = mean(scores) if scores else 0
-    max_possible_score = 10
-    pass_rate = (
-        100 * len([s for s in scores if s >= 7]) / total_tests if total_tests else 0
-    )
+# Grader prompt templates. All three are part of each test case's fingerprint,
+# so editing them invalidates earlier results in incremental runs.
+# GRADER_SYSTEM_PROMPT is identical for every grade, so it is sent as a cached
+# system prompt; only GRADER_TEMPLATE (the per-case part) changes between calls.
+GRADER_SYSTEM_PROMPT = """
+    You are an expert evaluator. Your task is to evaluate AI-generated solutions with EXTREME RIGOR.
+
+    Each request contains the original task description, the original task inputs, the solution to evaluate, the criteria you should use to evaluate it, and possibly mandatory requirements.
+
+    Scoring Guidelines:
+    * Score 1-3: Solution fails to meet one or more MANDATORY requirements
+    * Score 4-6: Solution meets all mandatory requirements but has significant deficiencies in secondary criteria
+    * Score 7-8: Solution meets all mandatory requirements and most secondary criteria, with minor issues
+    * Score 9-10: Solution meets all mandatory and secondary criteria
+
+    IMPORTANT SCORING INSTRUCTIONS:
+    * Grade the output based ONLY on the listed criteria. Do not add your own extra requirements.
+    * If a solution meets all of the mandatory and secondary criteria give it a 10
+    * Don't complain that the solution "only" meets the mandatory and secondary criteria. Solutions shouldn't go above and beyond - they should meet the exact listed criteria.
+    * ANY violation of a mandatory requirement MUST result in a score of 3 or lower
+    * The full 1-10 scale should be utilized - don't hesitate to give low scores when warranted
+
+    Output Format
+    Provide your evaluation as a structured JSON object with the following fields, in this specific order:
+    - "strengths": An array of 1-3 key strengths
+    - "weaknesses": An array of 1-3 key areas for improvement
+    - "reasoning": A concise explanation of your overall assessment
+    - "score": A number between 1-10
+
+    Respond with JSON. Keep your response concise and direct.
+    Example response shape:
+    {
+        "strengths": string[],
+        "weaknesses": string[],
+        "reasoning": string,
+        "score": number
+    }
+    """
 
-    html = f"""
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Prompt Evaluation Report</title>
-        <style>
-            body {{
-                font-family: Arial, sans-serif;
-                line-height: 1.6;
-                margin: 0;
-                padding: 20px;
-                color: #333;
-            }}
-            .header {{
-                background-color: #f0f0f0;
-                padding: 20px;
-                border-radius: 5px;
-                margin-bottom: 20px;
-            }}
-            .summary-stats {{
-                display: flex;
-                justify-content: space-between;
-                flex-wrap: wrap;
-                gap: 10px;
-            }}
-            .stat-box {{
-                background-color: #fff;
-                border-radius: 5px;
-                padding: 15px;
-                box-shadow: 0 2px 5px rgba(0,0,0,0.1);
-                flex-basis: 30%;
-                min-width: 200px;
-            }}
-            .stat-value {{
-                font-size: 24px;
-                font-weight: bold;
-                margin-top: 5px;
-            }}
-            table {{
-                width: 100%;
-                border-collapse: collapse;
-                margin-top: 20px;
-            }}
-            th {{
-                background-color: #4a4a4a;
-                color: white;
-                text-align: left;
-                padding: 12px;
-            }}
-            td {{
-                padding: 10px;
-                border-bottom: 1px solid #ddd;
-                vertical-align: top;
-            }}
-            tr:nth-child(even) {{
-                background-color: #f9f9f9;
-            }}
-            .output-cell {{
-                white-space: pre-wrap;
-            }}
-            .score {{
-                font-weight: bold;
-                padding: 5px 10px;
-                border-radius: 3px;
-                display: inline-block;
-            }}
-            .score-high {{
-                background-color: #c8e6c9;
-                color: #2e7d32;
-            }}
-            .score-medium {{
-                background-color: #fff9c4;
-                color: #f57f17;
-            }}
-            .score-low {{
-                background-color: #ffcdd2;
-                color: #c62828;
-            }}
-            .output {{
-                overflow: auto;
-                white-space: pre-wrap;
-            }}
-
-            .output pre {{
-                background-color: #f5f5f5;
-                border: 1px solid #ddd;
-                border-radius: 4px;
-                padding: 10px;
-                margin: 0;
-                font-family: 'Consolas', 'Monaco', 'Courier New', monospace;
-                font-size: 14px;
-                line-height: 1.4;
-                color: #333;
-                box-shadow: inset 0 1px 3px rgba(0, 0, 0, 0.1);
-                overflow-x: auto;
-                white-space: pre-wrap; 
-                word-wrap: break-word; 
-            }}
-
-            td {{
-                width: 20%;
-            }}
-            .score-col {{
-                width: 80px;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            <h1>Prompt Evaluation Report</h1>
-            <div class="summary-stats">
-                <div class="stat-box">
-                    <div>Total Test Cases</div>
-                    <div class="stat-value">{total_tests}</div>
-                </div>
-                <div class="stat-box">
-                    <div>Average Score</div>
-                    <div class="stat-value">{avg_score:.1f} / {max_possible_score}</div>
-                </div>
-                <div class="stat-box">
-                    <div>Pass Rate (≥7)</div>
-                    <div class="stat-value">{pass_rate:.1f}%</div>
-                </div>
-            </div>
-        </div>
-
-        <table>
-            <thead>
-                <tr>
-                    <th>Scenario</th>
-                    <th>Prompt Inputs</th>
-                    <th>Solution Criteria</th>
-                    <th>Output</th>
-                    <th>Score</th>
-                    <th>Reasoning</th>
-                </tr>
-            </thead>
-            <tbody>
+EXTRA_CRITERIA_TEMPLATE = """
+    Mandatory Requirements - ANY VIOLATION MEANS AUTOMATIC FAILURE (score of 3 or lower):
+    <extra_important_criteria>
+    {extra_criteria}
+    </extra_important_criteria>
     """
 
-    for result in evaluation_results:
-        prompt_inputs_html = "<br>".join(
-            [
-                f"<strong>{key}:</strong> {value}"
-                for key, value in result["test_case"]["prompt_inputs"].items()
-            ]
-        )
+GRADER_TEMPLATE = """
+    Evaluate the following AI-generated solution.
 
-        criteria_string = "<br>• ".join(result["test_case"]["solution_criteria"])
-
-        score = result["score"]
-        if score >= 8:
-            score_class = "score-high"
-        elif score <= 5:
-            score_class = "score-low"
-        else:
-            score_class = "score-medium"
-
-        html += f"""
-            <tr>
-                <td>{result["test_case"]["scenario"]}</td>
-                <td class="prompt-inputs">{prompt_inputs_html}</td>
-                <td class="criteria">• {criteria_string}</td>
-                <td class="output"><pre>{result["output"]}</pre></td>
-                <td class="score-col"><span class="score {score_class}">{score}</span></td>
-                <td class="reasoning">{result["reasoning"]}</td>
-            </tr>
-        """
+    Original task description:
+    <task_description>
+    {task_description}
+    </task_description>
+
+    Original task inputs:
+    <task_inputs>
+    {{ {prompt_inputs} }}
+    </task_inputs>
 
-    html += """
-            </tbody>
-        </table>
-    </body>
-    </html>
+    Solution to Evaluate:
+    <solution>
+    {output}
+    </solution>
+
+    Criteria you should use to evaluate the solution:
+    <criteria>
+    {solution_criteria}
+    </criteria>
+
+    {extra_criteria_section}
     """
 
-    return html
+# Batched grading (grading_batch_tokens) sends several GRADER_TEMPLATE
+# prompts, each wrapped in GRADER_CASE_TEMPLATE, in one BATCH_GRADER_TEMPLATE
+# request with the same system prompt. With batching on, these two are part
+# of the fingerprint too.
+GRADER_CASE_TEMPLATE = """<case id="{case_id}">
+{grader_prompt}
+</case>"""
+
+BATCH_GRADER_TEMPLATE = """
+    Evaluate each of the following {count} cases independently, exactly as if it were the only solution in this request. Do not compare the cases with each other.
+
+    {cases}
+
+    Respond with a JSON array holding one evaluation per case, in case order. Each evaluation is the JSON object described in the output format, plus a "case_id" field with the id of its case:
+    [
+        {{"case_id": string, "strengths": string[], "weaknesses": string[], "reasoning": string, "score": number}}
+    ]
+    """
+
+# Output tokens allowed per case in a batched grader call
+BATCH_GRADE_MAX_TOKENS_PER_CASE = 400
+
+# Appended to the idea prompt when asking for more ideas for a task
+EXISTING_IDEAS_PROMPT = """
+
+These ideas are already covered. Don't repeat or rephrase any of them:
+<existing_ideas>
+{ideas}
+</existing_ideas>
+"""
+# The most recent ideas listed there; older ones are still filtered out
+MAX_EXISTING_IDEAS = 100
+
+# Below the minimum cacheable length of Haiku 4.5, so sent without a cache
+# breakpoint there; see prompt_cache.py
+GRADER_SYSTEM = cached_system(dedent(GRADER_SYSTEM_PROMPT).strip(), model=model)
+
 
 # PromptEvaluator Implementation
 class PromptEvaluator:
-    def __init__(self, max_concurrent_tasks=3):
+    def __init__(
+        self,
+        max_concurrent_tasks=3,
+        max_in_flight_requests=200,
+        generation_workers=None,
+        grading_workers=None,
+        report_rows_per_page=None,
+        grading_batch_tokens=None,
+        grading_batch_size=8,
+        idea_index=None,
+        max_idea_requests=4,
+        results_store=None,
+    ):
         self.max_concurrent_tasks = max_concurrent_tasks
+        # Every run's scores, latency and tokens are appended to this
+        # ResultsStore (None: not kept). See results_store.py
+        self.results_store = results_store
+        # generate_dataset drops ideas this IdeaIndex has seen for the task
+        # (None: no check) and asks for more, up to `max_idea_requests`
+        # idea lists in all. See idea_index.py
+        self.idea_index = idea_index
+        self.max_idea_requests = max_idea_requests
+        # Only used by the asyncio engine (run_evaluation_async)
+        self.max_in_flight_requests = max_in_flight_requests
+        # run_evaluation grades up to `grading_batch_size` cases per grader
+        # call, packed up to `grading_batch_tokens` prompt tokens (None: one
+        # case per call). See batched_grading.py
+        self.grading_batch_tokens = grading_batch_tokens
+        self.grading_batch_size = grading_batch_size
+        self.grading_batch_stats = GradingBatchStats()
+        # run_evaluation sizes its generate and grade stages separately;
+        # both default to max_concurrent_tasks. With batching, the batcher
+        # packs the cases of the grading workers waiting at the same time
+        # into one call, so a batch holds at most `grading_workers` cases
+        self.generation_workers = generation_workers or max_concurrent_tasks
+        self.grading_workers = grading_workers or max_concurrent_tasks
+        # Split output.html into pages of this many rows (None: one file)
+        self.report_rows_per_page = report_rows_per_page
+        # Enough connections for the pipeline's two stages running at once
+        client_factory.reserve(
+            max(max_concurrent_tasks, self.generation_workers + self.grading_workers)
+        )
 
-    def render(self, template_string, variables):
-        placeholders = re.findall(r"{([^{}]+)}", template_string)
-
-        result = template_string
-        for placeholder in placeholders:
-            if placeholder in variables:
-                result = result.replace(
-                    "{" + placeholder + "}", str(variables[placeholder])
-                )
-
-        return result.replace("{{", "{").replace("}}", "}")
+    def render(self, template_string, variables, dedent=False):
+        """Fill {name} slots; the parsed template is cached per string"""
+        return compile_template(template_string, dedent).render(variables)
 
     def generate_unique_ideas(self, task_description, prompt_inputs_spec, num_cases):
         """Generate a list of unique ideas for test cases based on the task description"""
+        return list(
+            self.stream_unique_ideas(task_description, prompt_inputs_spec, num_cases)
+        )
+
+    def stream_unique_ideas(
+        self,
+        task_description,
+        prompt_inputs_spec,
+        num_cases,
+        parser=None,
+        existing_ideas=None,
+    ):
+        """Like generate_unique_ideas, but yields each idea as soon as the
+        model has finished writing it. Pass a JsonArrayParser to see whether
+        the list was cut off or had invalid entries, and `existing_ideas`
+        for ideas the new ones shouldn't repeat"""
 
         prompt = """
         Generate {num_cases} unique, diverse ideas for testing a prompt that accomplishes this task:
@@ -296,25 +398,35 @@ class PromptEvaluator:
             example_prompt_inputs += f'"{key}": str # {val},'
 
         rendered_prompt = self.render(
-            dedent(prompt),
+            prompt,
             {
                 "task_description": task_description,
                 "num_cases": num_cases,
                 "prompt_inputs": example_prompt_inputs,
             },
+            dedent=True,
         )
+        if existing_ideas:
+            rendered_prompt += self.render(
+                EXISTING_IDEAS_PROMPT,
+                {"ideas": "\n".join(f"- {idea}" for idea in existing_ideas)},
+                dedent=True,
+            )
 
         messages = []
         add_user_message(messages, rendered_prompt)
         add_assistant_message(messages, "```json")
-        text = chat(
-            messages,
-            stop_sequences=["```"],
-            system=system_prompt,
-            temperature=1.0,
-        )
+        with call_site("generate_unique_ideas"):
+            texts = chat_stream(
+                messages,
+                stop_sequences=["```"],
+                system=system_prompt,
+                temperature=1.0,
+                # Ideas are a sentence each; leave room for long lists
+                max_tokens=max(1000, 80 * num_cases),
+            )
 
-        return json.loads(text)
+        return iter_json_array(texts, parser)
 
     def generate_test_case(self, task_description, idea, prompt_inputs_spec={}):
         """Generate a single test case based on the task description and a specific idea"""
@@ -351,8 +463,13 @@ class PromptEvaluator:
         }}
         ```
         
+        IMPORTANT: You MUST ONLY use these exact input keys in your prompt_inputs: {allowed_keys}
+        """
+
+        # The requirements and the few-shot example are the same for every
+        # idea, so they go in the cached system prompt
+        instructions = """
         IMPORTANT REQUIREMENTS:
-        - You MUST ONLY use these exact input keys in your prompt_inputs: {allowed_keys}        
         - Do NOT add any additional keys to prompt_inputs
         - All keys listed in allowed_input_keys must be included in your response
         - Make the test case realistic and practically useful
@@ -394,28 +511,36 @@ class PromptEvaluator:
         """
 
         system_prompt = "You are a test case creator specializing in designing evaluation scenarios."
+        system = cached_system(system_prompt, dedent(instructions).strip(), model=model)
 
         rendered_prompt = self.render(
-            dedent(prompt),
+            prompt,
             {
                 "allowed_keys": allowed_keys,
                 "task_description": task_description,
                 "idea": idea,
                 "example_prompt_inputs": example_prompt_inputs,
             },
+            dedent=True,
         )
 
         messages = []
         add_user_message(messages, rendered_prompt)
         add_assistant_message(messages, "```json")
-        text = chat(
-            messages,
-            stop_sequences=["```"],
-            system=system_prompt,
-            temperature=0.7,
-        )
+        with call_site("generate_test_case"):
+            text = chat(
+                messages,
+                stop_sequences=["```"],
+                system=system,
+                temperature=0.7,
+            )
 
-        test_case = json.loads(text)
+        test_case = loads_lenient(text)
+        # A repaired, cut-off response can be missing whole fields
+        if not isinstance(test_case, dict) or not all(
+            key in test_case for key in ("prompt_inputs", "solution_criteria")
+        ):
+            raise ValueError(f"Incomplete test case: {text[:200]!r}")
         test_case["task_description"] = task_description
         test_case["scenario"] = idea
 
@@ -428,28 +553,69 @@ class PromptEvaluator:
         num_cases=1,
         output_file="dataset.json",
     ):
-        """Generate test dataset based on task description and save to file"""
-        ideas = self.generate_unique_ideas(
-            task_description, prompt_inputs_spec, num_cases
-        )
+        """Generate test dataset based on task description and save to file.
+
+        Ideas are streamed, and each one is handed to a worker as soon as it
+        is complete, so test cases are being written while later ideas are
+        still being generated.
+
+        With an idea_index, ideas too similar to one already indexed for the
+        task (including the scenarios already in `output_file`) are dropped
+        before a test case is written for them, and more ideas are requested
+        until there are `num_cases`. An idea whose test case fails is taken
+        out of the index again, so a later run can retry it."""
+        index = self.idea_index
+        if index is not None and os.path.exists(output_file):
+            index.add_dataset(output_file)
+        requests = 1 if index is None else self.max_idea_requests
 
         dataset = []
         completed = 0
-        total = len(ideas)
         last_reported_percentage = 0
+        duplicates = 0
+        received = 0
 
         with concurrent.futures.ThreadPoolExecutor(
             max_workers=self.max_concurrent_tasks
         ) as executor:
-            future_to_idea = {
-                executor.submit(
-                    self.generate_test_case,
-                    task_description,
-                    idea,
-                    prompt_inputs_spec,
-                ): idea
-                for idea in ideas
-            }
+            future_to_idea = {}
+            for _ in range(requests):
+                missing = num_cases - len(future_to_idea)
+                if missing <= 0:
+                    break
+                if received:
+                    # Ask for enough that, at the rate ideas have been
+                    # dropped so far, `missing` of them will be new
+                    kept = max(1, received - duplicates)
+                    missing = min(num_cases, -(-missing * received // kept))
+                existing = None
+                if index is not None:
+                    existing = index.ideas(task_description)[-MAX_EXISTING_IDEAS:]
+                parser = JsonArrayParser()
+                for idea in self.stream_unique_ideas(
+                    task_description, prompt_inputs_spec, missing, parser, existing
+                ):
+                    if len(future_to_idea) == num_cases:
+                        continue  # more than needed
+                    received += 1
+                    text = idea if isinstance(idea, str) else json.dumps(idea)
+                    if index is not None and index.add_if_new(text, task_description):
+                        duplicates += 1
+                        continue
+                    future = executor.submit(
+                        self.generate_test_case,
+                        task_description,
+                        idea,
+                        prompt_inputs_spec,
+                    )
+                    future_to_idea[future] = idea
+                if parser.truncated:
+                    print("Idea list was cut off")
+                if parser.errors:
+                    print(f"Skipped {len(parser.errors)} malformed ideas")
+            total = len(future_to_idea)
+            if total < num_cases:
+                print(f"Only got {total}/{num_cases} unique ideas")
 
             for future in concurrent.futures.as_completed(future_to_idea):
                 try:
@@ -465,14 +631,24 @@ class PromptEvaluator:
                     dataset.append(result)
                 except Exception as e:
                     print(f"Error generating test case: {e}")
+                    if index is not None:
+                        idea = future_to_idea[future]
+                        index.remove(
+                            idea if isinstance(idea, str) else json.dumps(idea),
+                            task_description,
+                        )
+
+        if index is not None:
+            print(f"Idea index: {index.summary()}")
+            index.save()
 
         with open(output_file, "w") as f:
             json.dump(dataset, f, indent=2)
 
         return dataset
 
-    def grade_output(self, test_case, output, extra_criteria):
-        """Grade the output of a test case using the model"""
+    def build_grader_prompt(self, test_case, output, extra_criteria):
+        """The per-case grader prompt for a test case output"""
 
         prompt_inputs = ""
         for key, value in test_case["prompt_inputs"].items():
@@ -481,74 +657,14 @@ class PromptEvaluator:
 
         extra_criteria_section = ""
         if extra_criteria:
-            extra_criteria_template = """
-            Mandatory Requirements - ANY VIOLATION MEANS AUTOMATIC FAILURE (score of 3 or lower):
-            <extra_important_criteria>
-            {extra_criteria}
-            </extra_important_criteria>
-            """
             extra_criteria_section = self.render(
-                dedent(extra_criteria_template),
+                EXTRA_CRITERIA_TEMPLATE,
                 {"extra_criteria": extra_criteria},
+                dedent=True,
             )
 
-        eval_template = """
-        Your task is to evaluate the following AI-generated solution with EXTREME RIGOR.
-
-        Original task description:
-        <task_description>
-        {task_description}
-        </task_description>
-
-        Original task inputs:
-        <task_inputs>
-        {{ {prompt_inputs} }}
-        </task_inputs>
-
-        Solution to Evaluate:
-        <solution>
-        {output}
-        </solution>
-
-        Criteria you should use to evaluate the solution:
-        <criteria>
-        {solution_criteria}
-        </criteria>
-
-        {extra_criteria_section}
-
-        Scoring Guidelines:
-        * Score 1-3: Solution fails to meet one or more MANDATORY requirements
-        * Score 4-6: Solution meets all mandatory requirements but has significant deficiencies in secondary criteria
-        * Score 7-8: Solution meets all mandatory requirements and most secondary criteria, with minor issues
-        * Score 9-10: Solution meets all mandatory and secondary criteria
-
-        IMPORTANT SCORING INSTRUCTIONS:
-        * Grade the output based ONLY on the listed criteria. Do not add your own extra requirements.
-        * If a solution meets all of the mandatory and secondary criteria give it a 10
-        * Don't complain that the solution "only" meets the mandatory and secondary criteria. Solutions shouldn't go above and beyond - they should meet the exact listed criteria.
-        * ANY violation of a mandatory requirement MUST result in a score of 3 or lower
-        * The full 1-10 scale should be utilized - don't hesitate to give low scores when warranted
-
-        Output Format
-        Provide your evaluation as a structured JSON object with the following fields, in this specific order:
-        - "strengths": An array of 1-3 key strengths
-        - "weaknesses": An array of 1-3 key areas for improvement
-        - "reasoning": A concise explanation of your overall assessment
-        - "score": A number between 1-10
-
-        Respond with JSON. Keep your response concise and direct.
-        Example response shape:
-        {{
-            "strengths": string[],
-            "weaknesses": string[],
-            "reasoning": string,
-            "score": number
-        }}
-        """
-
-        eval_prompt = self.render(
-            dedent(eval_template),
+        return self.render(
+            GRADER_TEMPLATE,
             {
                 "task_description": test_case["task_description"],
                 "prompt_inputs": prompt_inputs,
@@ -556,21 +672,132 @@ class PromptEvaluator:
                 "solution_criteria": "\n".join(test_case["solution_criteria"]),
                 "extra_criteria_section": extra_criteria_section,
             },
+            dedent=True,
         )
 
+    def build_grader_messages(self, test_case, output, extra_criteria):
+        """Build the prefilled grader conversation for a test case output"""
         messages = []
-        add_user_message(messages, eval_prompt)
+        add_user_message(
+            messages, self.build_grader_prompt(test_case, output, extra_criteria)
+        )
         add_assistant_message(messages, "```json")
-        eval_text = chat(
+        return messages
+
+    def build_batch_grader_messages(self, items, extra_criteria):
+        """Prefilled grader conversation for several (test_case, output)
+        pairs, as case-1, case-2, ..."""
+        cases = "\n\n".join(
+            self.render(
+                GRADER_CASE_TEMPLATE,
+                {
+                    "case_id": f"case-{index}",
+                    "grader_prompt": self.build_grader_prompt(
+                        test_case, output, extra_criteria
+                    ),
+                },
+            )
+            for index, (test_case, output) in enumerate(items, 1)
+        )
+        messages = []
+        add_user_message(
             messages,
-            stop_sequences=["```"],
-            temperature=0.0,
+            self.render(
+                BATCH_GRADER_TEMPLATE,
+                {"count": len(items), "cases": cases},
+                dedent=True,
+            ),
         )
-        return json.loads(eval_text)
+        add_assistant_message(messages, "```json")
+        return messages
+
+    def grade_output(self, test_case, output, extra_criteria):
+        """Grade the output of a test case using the model"""
+        messages = self.build_grader_messages(test_case, output, extra_criteria)
+        with call_site("grade_output"):
+            eval_text = chat(
+                messages,
+                system=GRADER_SYSTEM,
+                stop_sequences=["```"],
+                temperature=0.0,
+            )
+        return loads_lenient(eval_text)
+
+    def grade_batch(self, items, extra_criteria):
+        """Grade (test_case, output) pairs in one grader call. Cases without a
+        valid grade in the reply are graded again with grade_output. A case
+        whose regrade fails too gets a 0 grade with a `grade_error`, so it
+        doesn't fail the other cases of the batch."""
+        if len(items) == 1:
+            self.grading_batch_stats.record(1, single_calls=1)
+            return [self.grade_output(*items[0], extra_criteria)]
+
+        fallbacks = 0
+        try:
+            messages = self.build_batch_grader_messages(items, extra_criteria)
+            with call_site("grade_batch"):
+                eval_text = chat(
+                    messages,
+                    system=GRADER_SYSTEM,
+                    stop_sequences=["```"],
+                    temperature=0.0,
+                    max_tokens=BATCH_GRADE_MAX_TOKENS_PER_CASE * len(items),
+                )
+            case_ids = [f"case-{index}" for index in range(1, len(items) + 1)]
+            grades = parse_batched_grades(eval_text, case_ids)
+
+            results = []
+            for case_id, (test_case, output) in zip(case_ids, items):
+                if case_id in grades:
+                    results.append(grades[case_id])
+                    continue
+                fallbacks += 1
+                try:
+                    results.append(self.grade_output(test_case, output, extra_criteria))
+                except json.JSONDecodeError as e:
+                    results.append(
+                        {"score": 0, "reasoning": "", "grade_error": f"No valid grade: {e!r}"}
+                    )
+            return results
+        finally:
+            self.grading_batch_stats.record(
+                len(items), batched_calls=1, single_calls=fallbacks, fallbacks=fallbacks
+            )
+
+    def batch_grader(self, extra_criteria):
+        """A grade(test_case, output) function that batches concurrent calls
+        by prompt size, or plain grade_output if batching is off"""
+        if not self.grading_batch_tokens:
+            return lambda test_case, output: self.grade_output(
+                test_case, output, extra_criteria
+            )
+
+        batcher = DynamicBatcher(
+            lambda items: self.grade_batch(items, extra_criteria),
+            size_of=lambda item: estimate_tokens(
+                self.build_grader_prompt(item[0], item[1], extra_criteria)
+            ),
+            token_budget=self.grading_batch_tokens,
+            max_items=self.grading_batch_size,
+        )
+        return lambda test_case, output: batcher((test_case, output))
+
+    async def agrade_output(self, test_case, output, extra_criteria):
+        """Async variant of grade_output, built on the AsyncAnthropic client"""
+        messages = self.build_grader_messages(test_case, output, extra_criteria)
+        with call_site("grade_output"):
+            eval_text = await achat(
+                messages,
+                system=GRADER_SYSTEM,
+                stop_sequences=["```"],
+                temperature=0.0,
+            )
+        return loads_lenient(eval_text)
 
     def run_test_case(self, test_case, run_prompt_function, extra_criteria=None):
         """Run a test case and grade the result"""
-        output = run_prompt_function(test_case["prompt_inputs"])
+        with call_site("run_prompt"), track_usage() as usage:
+            output = run_prompt_function(test_case["prompt_inputs"])
 
         model_grade = self.grade_output(test_case, output, extra_criteria)
         model_score = model_grade["score"]
@@ -581,8 +808,213 @@ class PromptEvaluator:
             "test_case": test_case,
             "score": model_score,
             "reasoning": reasoning,
+            **usage.fields(),
+        }
+
+    async def arun_test_case(
+        self, test_case, run_prompt_function, extra_criteria=None, executor=None
+    ):
+        """Run a test case and grade the result as coroutines.
+
+        `run_prompt_function` may be a coroutine function (e.g. one that uses
+        `achat`). A plain function is run in a thread of `executor` (None:
+        the event loop's default one) so it doesn't block the event loop.
+        """
+        with call_site("run_prompt"), track_usage() as usage:
+            if inspect.iscoroutinefunction(run_prompt_function):
+                output = await run_prompt_function(test_case["prompt_inputs"])
+            else:
+                # Run in a copy of the context, as asyncio.to_thread does, so
+                # the call is still counted under run_prompt and in `usage`
+                context = contextvars.copy_context()
+                output = await asyncio.get_running_loop().run_in_executor(
+                    executor,
+                    context.run,
+                    run_prompt_function,
+                    test_case["prompt_inputs"],
+                )
+
+        model_grade = await self.agrade_output(test_case, output, extra_criteria)
+        model_score = model_grade["score"]
+        reasoning = model_grade["reasoning"]
+
+        return {
+            "output": output,
+            "test_case": test_case,
+            "score": model_score,
+            "reasoning": reasoning,
+            **usage.fields(),
         }
 
+    def open_result_log(self, jsonl_output_file, resume):
+        """Open the JSONL results log. Returns (writer, fingerprints already
+        logged), where the fingerprints are only read when resuming"""
+        already_logged = logged_fingerprints(jsonl_output_file) if resume else set()
+        if resume:
+            print(f"Resuming: {len(already_logged)} results already in {jsonl_output_file}")
+        return JsonlResultWriter(jsonl_output_file, append=resume), already_logged
+
+    def drop_stale_results(self, jsonl_output_file, already_logged, planned):
+        """After a resumed run, remove the results it found in the log whose
+        test case is no longer part of the run, e.g. because the prompt or
+        criteria changed since. Otherwise they would sit next to the new
+        results for the same test cases"""
+        stale = already_logged - planned
+        if stale:
+            dropped = prune_results(jsonl_output_file, planned)
+            print(f"Dropped {dropped} stale results from {jsonl_output_file}")
+
+    def save_results(
+        self,
+        jsonl_output_file,
+        json_output_file,
+        html_output_file,
+        return_results,
+        metrics_output_file=None,
+        prompt_fingerprint=None,
+    ):
+        """Print the average score and API call metrics, and derive the JSON
+        and HTML artifacts from the JSONL results log, one result at a time.
+        With a results_store, the run is also appended to it under
+        `prompt_fingerprint`. The per-site API call metrics are written to
+        `metrics_output_file` if given"""
+        if metrics_output_file:
+            call_metrics.export(metrics_output_file)
+        write_json_array(iter_results(jsonl_output_file), json_output_file)
+        report = write_prompt_evaluation_report(
+            jsonl_output_file,
+            html_output_file,
+            call_metrics.site_summaries(),
+            self.report_rows_per_page,
+        )
+
+        print(f"Average score: {report.average_score}")
+        print(f"Rate limiter: {rate_limiter.summary()}")
+        response_cache.flush()
+        print(f"Response cache: {response_cache.summary()}")
+        print(f"Prompt cache: {call_metrics.prompt_cache.summary()}")
+        print(f"API calls:\n{call_metrics.summary()}")
+        print(f"Connection pool: {client_factory.pool_metrics.summary()}")
+        if len(report.page_files()) > 1:
+            print(f"Report: {len(report.page_files())} pages, starting at {html_output_file}")
+        if self.results_store is not None:
+            self.store_run(jsonl_output_file, prompt_fingerprint)
+
+        if return_results:
+            return list(iter_results(jsonl_output_file))
+
+    def store_run(self, jsonl_output_file, prompt_fingerprint):
+        """Append the logged results to the results store, and print how many
+        scenarios scored lower than in the store's previous run"""
+        store = self.results_store
+        run_id = store.append_run(iter_results(jsonl_output_file), prompt_fingerprint)
+        if run_id is None:
+            return
+        line = f"Results store: run {run_id} added to {store.path}"
+        if len(store.runs()) > 1:
+            regressions = store.regressions()
+            line += f", {len(regressions)} scenarios scored 1+ points lower than in the previous run"
+        print(line)
+
+    def evaluation_fingerprint(self, run_prompt_function, extra_criteria):
+        """Hash of everything besides the test case itself that affects a result:
+        the model, the source of `run_prompt_function`, the grader templates
+        and `extra_criteria`"""
+        try:
+            prompt_source = inspect.getsource(run_prompt_function)
+        except (OSError, TypeError):
+            prompt_source = getattr(
+                run_prompt_function, "__qualname__", repr(run_prompt_function)
+            )
+
+        parts = [
+            model,
+            prompt_source,
+            GRADER_SYSTEM_PROMPT,
+            EXTRA_CRITERIA_TEMPLATE,
+            GRADER_TEMPLATE,
+            extra_criteria or "",
+        ]
+        if self.grading_batch_tokens:
+            parts += [GRADER_CASE_TEMPLATE, BATCH_GRADER_TEMPLATE]
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def fingerprint_test_case(self, test_case, evaluation_fingerprint):
+        canonical = json.dumps(test_case, sort_keys=True)
+        return hashlib.sha256(
+            (evaluation_fingerprint + canonical).encode()
+        ).hexdigest()
+
+    def plan_run(
+        self,
+        dataset,
+        run_prompt_function,
+        extra_criteria,
+        previous_results_file,
+        incremental,
+        already_logged=(),
+        lazy=False,
+        planned=None,
+    ):
+        """Fingerprint the dataset and split it into reusable and pending work.
+
+        Returns (reused_results, pending), where pending is a list of
+        (fingerprint, test_case) pairs. Prior results are only reused when
+        `incremental` is set and their fingerprint is unchanged. Test cases
+        whose fingerprint is in `already_logged` are skipped entirely. The
+        fingerprint of every test case is added to the `planned` set, if
+        given.
+
+        With `lazy` and without `incremental`, pending is a generator that
+        fingerprints each test case as the dataset yields it, so work can
+        start before the whole dataset is read.
+        """
+        evaluation_fingerprint = self.evaluation_fingerprint(
+            run_prompt_function, extra_criteria
+        )
+        if planned is None:
+            planned = set()
+        if lazy and not incremental:
+
+            def pending():
+                for test_case in dataset:
+                    fingerprint = self.fingerprint_test_case(
+                        test_case, evaluation_fingerprint
+                    )
+                    planned.add(fingerprint)
+                    if fingerprint not in already_logged:
+                        yield fingerprint, test_case
+
+            return [], pending()
+
+        previous = {}
+        if incremental and os.path.exists(previous_results_file):
+            with open(previous_results_file, "r") as f:
+                previous = {
+                    result["fingerprint"]: result
+                    for result in json.load(f)
+                    if "fingerprint" in result
+                }
+
+        reused_results = []
+        pending = []
+        for test_case in dataset:
+            fingerprint = self.fingerprint_test_case(test_case, evaluation_fingerprint)
+            planned.add(fingerprint)
+            if fingerprint in already_logged:
+                continue
+            if fingerprint in previous:
+                reused_results.append(previous.pop(fingerprint))
+            else:
+                pending.append((fingerprint, test_case))
+
+        if incremental:
+            print(
+                f"Reusing {len(reused_results)} unchanged results, "
+                f"running {len(pending)} test cases"
+            )
+        return reused_results, pending
+
     def run_evaluation(
         self,
         run_prompt_function,
@@ -590,31 +1022,246 @@ class PromptEvaluator:
         extra_criteria=None,
         json_output_file="output.json",
         html_output_file="output.html",
+        incremental=False,
+        jsonl_output_file="output.jsonl",
+        resume=False,
+        return_results=True,
+        metrics_output_file=None,
+        sample=None,
+        shard=None,
+    ):
+        """Run evaluation on all test cases in the dataset.
+
+        Outputs are generated by `generation_workers` threads and handed to
+        `grading_workers` threads through a bounded queue, so slow grading
+        doesn't hold up generation. Each result is appended to `jsonl_output_file` as soon as it is
+        graded; `json_output_file` and `html_output_file` are derived from
+        it at the end. With `resume=True`, test cases already in the JSONL
+        file (e.g. from a crashed run) are skipped.
+
+        With `incremental=True`, results in `json_output_file` whose
+        fingerprint still matches are reused and only changed test cases run.
+
+        Pass `return_results=False` for large suites, so results are never
+        all held in memory.
+
+        With `grading_batch_tokens` set, cases that finish generating around
+        the same time are graded together in one call; see
+        batched_grading.py.
+
+        A `.jsonl` dataset is read lazily: the first test case starts as soon
+        as its line is parsed. `sample=N` runs N random test cases and
+        `shard="3/8"` the third of eight slices of the dataset; see
+        dataset_loader.py.
+        """
+        dataset = load_dataset(dataset_file, sample, shard)
+
+        self.evaluate_to_log(
+            run_prompt_function,
+            dataset,
+            extra_criteria,
+            jsonl_output_file,
+            json_output_file,
+            incremental,
+            resume,
+        )
+        return self.save_results(
+            jsonl_output_file,
+            json_output_file,
+            html_output_file,
+            return_results,
+            metrics_output_file,
+            self.evaluation_fingerprint(run_prompt_function, extra_criteria),
+        )
+
+    def run_evaluation_shard(
+        self, run_prompt_function, dataset_file, output_dir, extra_criteria=None
     ):
-        """Run evaluation on all test cases in the dataset"""
-        with open(dataset_file, "r") as f:
-            dataset = json.load(f)
+        """Evaluate one shard of a sharded run (see sharded_runner.py).
+
+        Results go to output.jsonl in `output_dir` and the API calls made for
+        them to calls.jsonl; the runner merges every shard's into the final
+        report. Results and calls an earlier, failed attempt already wrote
+        are kept.
+        """
+        dataset = load_dataset(dataset_file)
+
+        with call_metrics.recording(os.path.join(output_dir, SHARD_CALLS_FILE), append=True):
+            self.evaluate_to_log(
+                run_prompt_function,
+                dataset,
+                extra_criteria,
+                os.path.join(output_dir, SHARD_RESULTS_FILE),
+                None,
+                incremental=False,
+                resume=True,
+            )
 
-        results = []
+    def evaluate_to_log(
+        self,
+        run_prompt_function,
+        dataset,
+        extra_criteria,
+        jsonl_output_file,
+        json_output_file,
+        incremental,
+        resume,
+    ):
+        """The generate and grade pipeline of run_evaluation, writing each
+        result to `jsonl_output_file`"""
+        result_log, already_logged = self.open_result_log(jsonl_output_file, resume)
+        planned = set()
+        reused_results, pending = self.plan_run(
+            dataset,
+            run_prompt_function,
+            extra_criteria,
+            json_output_file,
+            incremental,
+            already_logged,
+            lazy=True,
+            planned=planned,
+        )
         completed = 0
-        total = len(dataset)
+        # Unknown while a lazy dataset is still being read
+        total = len(pending) if isinstance(pending, list) else None
         last_reported_percentage = 0
 
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=self.max_concurrent_tasks
-        ) as executor:
-            future_to_test_case = {
-                executor.submit(
-                    self.run_test_case,
-                    test_case,
-                    run_prompt_function,
-                    extra_criteria,
-                ): test_case
-                for test_case in dataset
+        def generate(work):
+            _, test_case = work
+            with call_site("run_prompt"), track_usage() as usage:
+                output = run_prompt_function(test_case["prompt_inputs"])
+            return output, usage
+
+        grade_output = self.batch_grader(extra_criteria)
+
+        def grade(work, generated):
+            fingerprint, test_case = work
+            output, usage = generated
+            grade_error = None
+            try:
+                model_grade = grade_output(test_case, output)
+                score, reasoning = model_grade["score"], model_grade["reasoning"]
+                # Set by grade_batch for a case it couldn't grade
+                grade_error = model_grade.get("grade_error")
+            except (json.JSONDecodeError, KeyError, TypeError) as e:
+                # One bad grader reply fails its case, not the whole run
+                score, reasoning = 0, ""
+                grade_error = f"No valid grade: {e!r}"
+            result = {
+                "output": output,
+                "test_case": test_case,
+                "score": score,
+                "reasoning": reasoning,
+                "fingerprint": fingerprint,
+                **usage.fields(),
             }
+            if grade_error:
+                result["grade_error"] = grade_error
+            return result
+
+        metrics = PipelineMetrics(
+            self.generation_workers, self.grading_workers, 2 * self.grading_workers
+        )
+        with result_log:
+            for result in reused_results:
+                result_log.write(result)
+
+            for result in run_pipeline(
+                pending,
+                generate,
+                grade,
+                generation_workers=self.generation_workers,
+                grading_workers=self.grading_workers,
+                queue_size=metrics.queue_size,
+                metrics=metrics,
+            ):
+                completed += 1
+                if total is None:
+                    if completed % 1000 == 0:
+                        print(f"Graded {completed} test cases")
+                else:
+                    current_percentage = int((completed / total) * 100)
+                    milestone_percentage = (current_percentage // 20) * 20
+
+                    if milestone_percentage > last_reported_percentage:
+                        print(f"Graded {completed}/{total} test cases")
+                        last_reported_percentage = milestone_percentage
+                result_log.write(result)
+        self.drop_stale_results(jsonl_output_file, already_logged, planned)
+
+        print(f"Pipeline:\n{metrics.summary()}")
+        if self.grading_batch_tokens:
+            print(f"Batched grading: {self.grading_batch_stats.summary()}")
+
+    async def run_evaluation_async(
+        self,
+        run_prompt_function,
+        dataset_file,
+        extra_criteria=None,
+        json_output_file="output.json",
+        html_output_file="output.html",
+        incremental=False,
+        jsonl_output_file="output.jsonl",
+        resume=False,
+        return_results=True,
+        metrics_output_file=None,
+    ):
+        """Run evaluation on all test cases in the dataset using asyncio.
+
+        Same inputs, outputs and result shape as `run_evaluation`, but every test case
+        runs as a coroutine and up to `max_in_flight_requests` of them are in
+        flight at once instead of `max_concurrent_tasks` threads. A plain
+        (not async) `run_prompt_function` gets a thread per in-flight test
+        case, rather than the few of asyncio's default executor.
+
+        Usage: asyncio.run(evaluator.run_evaluation_async(run_prompt, "dataset.json"))
+        """
+        dataset = load_dataset(dataset_file)
+
+        semaphore = asyncio.Semaphore(self.max_in_flight_requests)
+        # The shared limiter would otherwise start at a handful of requests
+        # and take hundreds of calls to grow to max_in_flight_requests
+        rate_limiter.ensure_concurrency(self.max_in_flight_requests)
+        executor = None
+        if not inspect.iscoroutinefunction(run_prompt_function):
+            executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_in_flight_requests
+            )
+            client_factory.reserve(self.max_in_flight_requests)
+
+        async def run_limited(fingerprint, test_case):
+            async with semaphore:
+                result = await self.arun_test_case(
+                    test_case, run_prompt_function, extra_criteria, executor
+                )
+            result["fingerprint"] = fingerprint
+            return result
+
+        result_log, already_logged = self.open_result_log(jsonl_output_file, resume)
+        planned = set()
+        reused_results, pending = self.plan_run(
+            dataset,
+            run_prompt_function,
+            extra_criteria,
+            json_output_file,
+            incremental,
+            already_logged,
+            planned=planned,
+        )
+        completed = 0
+        total = len(pending)
+        last_reported_percentage = 0
+
+        for result in reused_results:
+            result_log.write(result)
 
-            for future in concurrent.futures.as_completed(future_to_test_case):
-                result = future.result()
+        tasks = [
+            asyncio.create_task(run_limited(fingerprint, test_case))
+            for fingerprint, test_case in pending
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
                 completed += 1
                 current_percentage = int((completed / total) * 100)
                 milestone_percentage = (current_percentage // 20) * 20
@@ -622,25 +1269,168 @@ class PromptEvaluator:
                 if milestone_percentage > last_reported_percentage:
                     print(f"Graded {completed}/{total} test cases")
                     last_reported_percentage = milestone_percentage
-                results.append(result)
+                result_log.write(result)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if executor is not None:
+                executor.shutdown(wait=False)
+            result_log.close()
+            await close_async_client()
+        self.drop_stale_results(jsonl_output_file, already_logged, planned)
+
+        return self.save_results(
+            jsonl_output_file,
+            json_output_file,
+            html_output_file,
+            return_results,
+            metrics_output_file,
+            self.evaluation_fingerprint(run_prompt_function, extra_criteria),
+        )
+    
+    def run_evaluation_batch(
+        self,
+        build_prompt_request,
+        dataset_file,
+        extra_criteria=None,
+        json_output_file="output.json",
+        html_output_file="output.html",
+        incremental=False,
+        poll_interval=10.0,
+        jsonl_output_file="output.jsonl",
+        resume=False,
+        return_results=True,
+        metrics_output_file=None,
+    ):
+        """Run evaluation through the Message Batches API.
 
-        average_score = mean([result["score"] for result in results])
-        print(f"Average score: {average_score}")
+        Every prompt is submitted as one batch and, once it has ended, every
+        grade as a second batch; results are joined back by custom_id into
+        the same result dicts as `run_evaluation`. Batches cost half as much
+        as individual calls but can take minutes to hours.
 
-        with open(json_output_file, "w") as f:
-            json.dump(results, f, indent=2)
+        `build_prompt_request(prompt_inputs)` returns the Messages params for
+        a test case instead of calling the API, e.g. {"messages": [...]}.
+        Model, max_tokens and temperature default to the ones `chat` uses.
+        """
+        dataset = load_dataset(dataset_file)
+
+        result_log, already_logged = self.open_result_log(jsonl_output_file, resume)
+        planned = set()
+        reused_results, pending = self.plan_run(
+            dataset,
+            build_prompt_request,
+            extra_criteria,
+            json_output_file,
+            incremental,
+            already_logged,
+            planned=planned,
+        )
+        start = time.perf_counter()
+
+        prompt_requests = {}
+        for index, (_, test_case) in enumerate(pending):
+            params = {"model": model, "max_tokens": 1000, "temperature": 1.0}
+            params.update(build_prompt_request(test_case["prompt_inputs"]))
+            prompt_requests[f"case-{index}"] = params
+        prompt_run = run_message_batch(
+            client_factory.client, prompt_requests, poll_interval, label="prompts"
+        )
 
-        html = generate_prompt_evaluation_report(results)
-        with open(html_output_file, "w", encoding="utf-8") as f:
-            f.write(html)
+        grade_requests = {}
+        for index, (_, test_case) in enumerate(pending):
+            custom_id = f"case-{index}"
+            if custom_id not in prompt_run.messages:
+                print(f"Skipping {custom_id}: {prompt_run.errors.get(custom_id)}")
+                continue
+            grade_requests[custom_id] = {
+                "model": model,
+                "max_tokens": 1000,
+                "system": GRADER_SYSTEM,
+                "messages": self.build_grader_messages(
+                    test_case, prompt_run.text(custom_id), extra_criteria
+                ),
+                "temperature": 0.0,
+                "stop_sequences": ["```"],
+            }
+        grade_run = run_message_batch(
+            client_factory.client, grade_requests, poll_interval, label="grades"
+        )
+
+        graded = 0
+        failed = 0
+        with result_log:
+            for result in reused_results:
+                result_log.write(result)
+
+            for index, (fingerprint, test_case) in enumerate(pending):
+                custom_id = f"case-{index}"
+                if custom_id not in grade_run.messages:
+                    continue
+                grade_error = None
+                try:
+                    model_grade = loads_lenient(grade_run.text(custom_id))
+                    score, reasoning = model_grade["score"], model_grade["reasoning"]
+                except (json.JSONDecodeError, KeyError, TypeError) as e:
+                    # As in evaluate_to_log: the case scores 0, the run goes on
+                    score, reasoning = 0, ""
+                    grade_error = f"No valid grade: {e!r}"
+                    failed += 1
+                prompt_usage = prompt_run.messages[custom_id].usage
+                result = {
+                    "output": prompt_run.text(custom_id),
+                    "test_case": test_case,
+                    "score": score,
+                    "reasoning": reasoning,
+                    "fingerprint": fingerprint,
+                    # A batch has no per-request latency
+                    "input_tokens": prompt_usage.input_tokens,
+                    "output_tokens": prompt_usage.output_tokens,
+                }
+                if grade_error:
+                    result["grade_error"] = grade_error
+                result_log.write(result)
+                graded += 1
+        if failed:
+            print(f"{failed} cases had no valid grade and scored 0")
+        self.drop_stale_results(jsonl_output_file, already_logged, planned)
+
+        elapsed = time.perf_counter() - start
+        if pending:
+            cost = batch_cost(
+                model,
+                prompt_run.input_tokens + grade_run.input_tokens,
+                prompt_run.output_tokens + grade_run.output_tokens,
+            )
+            cost_per_case = f"${cost / len(pending):.5f}" if cost is not None else "n/a"
+            print(
+                f"Batch backend: {graded}/{len(pending)} cases in {elapsed:.1f}s "
+                f"({len(pending) / elapsed:.1f} cases/s), {cost_per_case} per case"
+            )
+
+        return self.save_results(
+            jsonl_output_file,
+            json_output_file,
+            html_output_file,
+            return_results,
+            metrics_output_file,
+            self.evaluation_fingerprint(build_prompt_request, extra_criteria),
+        )
 
-        return results
-    
 
 if __name__ == "__main__":
     # Create an instance of PromptEvaluator
-    # Increase `max_concurrent_tasks` for greater concurrency, but beware of rate limit errors!
-    evaluator = PromptEvaluator(max_concurrent_tasks=6)
+    # Increase `max_concurrent_tasks` for greater concurrency. The shared rate
+    # limiter backs off and retries on rate limit errors, so extra workers
+    # simply wait when the account's limits are reached.
+    evaluator = PromptEvaluator(
+        max_concurrent_tasks=6,
+        # Skips ideas that repeat each other or an earlier dataset's scenarios
+        idea_index=IdeaIndex("idea_index.json"),
+        # Keeps every run's scores for comparing prompt versions; query it
+        # with `python results_store.py regressions` and friends
+        results_store=ResultsStore("results_store"),
+    )
 
     dataset = evaluator.generate_dataset(
     task_description="Write a compact, concise 1 day meal pln for an athelete",
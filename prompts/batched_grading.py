@@ -0,0 +1,165 @@
+"""
+Dynamic batching of grader calls.
+
+Every grade_output call sends the same grader instructions for one test
+case. `DynamicBatcher` lets the grading workers share calls. Each worker
+hands its (test case, output) to the batcher and blocks. The first worker to
+arrive waits up to `max_wait` seconds for others to join. The batch is sent
+as one grader request once it would go over `token_budget` prompt tokens or
+reaches `max_items`, or when the wait is up. A case that is over budget by
+itself is sent alone.
+
+`parse_batched_grades` reads the grader's JSON array of per-case grades.
+Cases it can't find a valid grade for are regraded one by one by the caller,
+so a malformed reply costs extra calls but never loses a grade.
+"""
+import json
+import threading
+import time
+
+from json_stream import loads_lenient
+
+
+def estimate_tokens(text):
+    """Rough prompt size, the same ~4 characters per token as the rate limiter"""
+    return len(text) // 4 + 1
+
+
+def parse_batched_grades(text, case_ids):
+    """{case_id: grade} for every well-formed grade in the grader's reply.
+
+    The reply should be a JSON array of objects with "case_id", "score" and
+    "reasoning". Missing, duplicate or malformed entries are left out; a
+    reply cut off at max_tokens still yields the grades before the cut.
+    """
+    try:
+        entries = loads_lenient(text)
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(entries, list):
+        return {}
+
+    wanted = set(case_ids)
+    grades = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        case_id = entry.get("case_id")
+        score = entry.get("score")
+        if (
+            case_id in wanted
+            and case_id not in grades
+            and isinstance(score, (int, float))
+            and not isinstance(score, bool)
+            and isinstance(entry.get("reasoning"), str)
+        ):
+            grades[case_id] = entry
+    return grades
+
+
+class GradingBatchStats:
+    def __init__(self):
+        self.cases = 0
+        self.batched_calls = 0
+        self.single_calls = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    def record(self, cases, batched_calls=0, single_calls=0, fallbacks=0):
+        with self._lock:
+            self.cases += cases
+            self.batched_calls += batched_calls
+            self.single_calls += single_calls
+            self.fallbacks += fallbacks
+
+    @property
+    def calls(self):
+        return self.batched_calls + self.single_calls
+
+    def summary(self):
+        if not self.cases:
+            return "no cases graded"
+        return (
+            f"{self.cases} cases in {self.calls} grader calls "
+            f"({self.batched_calls} batched, {self.single_calls} single; "
+            f"{self.cases - self.calls} calls saved), "
+            f"{self.fallbacks} cases regraded singly after a bad batch reply"
+        )
+
+
+class _Slot:
+    def __init__(self, item, tokens):
+        self.item = item
+        self.tokens = tokens
+        self.taken = False
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class DynamicBatcher:
+    """Call `batcher(item)` from many threads; items are processed together
+    by `process_batch(items)`, which returns one result per item, in order.
+    `size_of(item)` gives an item's size in tokens."""
+
+    def __init__(self, process_batch, size_of, token_budget, max_items=8, max_wait=0.05):
+        self.process_batch = process_batch
+        self.size_of = size_of
+        self.token_budget = token_budget
+        self.max_items = max_items
+        self.max_wait = max_wait
+        self._pending = []
+        self._pending_tokens = 0
+        self._cond = threading.Condition()
+
+    def _take(self):
+        """Claim the pending slots as a batch. Call with the lock held"""
+        batch = self._pending
+        for slot in batch:
+            slot.taken = True
+        self._pending = []
+        self._pending_tokens = 0
+        self._cond.notify_all()
+        return batch
+
+    def _run(self, batch):
+        try:
+            results = self.process_batch([slot.item for slot in batch])
+            for slot, result in zip(batch, results):
+                slot.result = result
+        except Exception as e:
+            for slot in batch:
+                slot.error = e
+        for slot in batch:
+            slot.done.set()
+
+    def __call__(self, item):
+        slot = _Slot(item, self.size_of(item))
+        full = None
+        with self._cond:
+            if self._pending and self._pending_tokens + slot.tokens > self.token_budget:
+                full = self._take()  # this item would overflow the batch
+            self._pending.append(slot)
+            self._pending_tokens += slot.tokens
+            leader = len(self._pending) == 1
+            if len(self._pending) >= self.max_items or self._pending_tokens >= self.token_budget:
+                batch = self._take()
+            else:
+                batch = None
+        if full:
+            self._run(full)
+        if batch:
+            self._run(batch)
+        elif leader:
+            deadline = time.monotonic() + self.max_wait
+            with self._cond:
+                while not slot.taken and time.monotonic() < deadline:
+                    self._cond.wait(deadline - time.monotonic())
+                batch = None if slot.taken else self._take()
+            if batch:
+                self._run(batch)
+
+        slot.done.wait()
+        if slot.error is not None:
+            raise slot.error
+        return slot.result
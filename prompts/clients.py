@@ -0,0 +1,209 @@
+"""
+Shared Anthropic clients with a connection pool sized to the workload.
+
+    client_factory = ClientFactory(max_retries=0)
+    client_factory.reserve(6)        # e.g. from PromptEvaluator.__init__
+    client_factory.client.messages.create(...)
+
+`ClientFactory` hands out one client for the whole script, so
+generate_dataset, run_evaluation and the batch backend reuse the same
+keep-alive connections. Its httpx pool allows `reserve()`d concurrency plus
+`headroom` connections, and keeps that many alive between requests. The SDK's
+default keeps at most 100 connections alive, in a pool of up to 1000. Asking
+for more concurrency than the current pool allows builds a bigger client;
+calls already running on the old one finish there.
+
+HTTP/2 is turned on when the `h2` package is installed
+(`pip install httpx[http2]`). It only takes effect over TLS, where one
+connection then carries many requests at once.
+
+Every request goes through `PoolMetricsTransport`, which uses httpcore's
+`trace` request extension to time how long the request waited for a
+connection. That is the time until the request starts connecting, or starts
+sending headers on a reused connection. It also counts new vs reused
+connections. `pool_metrics.summary()` reports them. (The asyncio engine
+keeps its own clients, see get_async_client in 007.)
+
+Passing our own transport turns off httpx's HTTP(S)_PROXY support, so
+make_client reads the proxy variables itself (honouring NO_PROXY) and mounts
+a transport with the same pool settings for each proxy.
+
+The SDK's default pool also drops idle connections after 5 seconds.
+Here they are kept for `keepalive_expiry` (30 seconds), long enough to
+survive the pause between generate_dataset and run_evaluation.
+"""
+import socket
+import threading
+import time
+
+import httpx
+from anthropic import DEFAULT_TIMEOUT, Anthropic
+
+from instrumentation import Reservoir
+
+try:
+    from httpx._utils import get_environment_proxies
+except ImportError:  # moved in some future httpx: no proxy support then
+    def get_environment_proxies():
+        return {}
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+def connection_limits(max_concurrency, headroom=2, keepalive_expiry=30.0):
+    """httpx Limits for `max_concurrency` concurrent requests"""
+    size = max_concurrency + headroom
+    return httpx.Limits(
+        max_connections=size,
+        max_keepalive_connections=size,
+        keepalive_expiry=keepalive_expiry,
+    )
+
+
+def _socket_options():
+    """TCP keep-alive probes, as the SDK's default transport sets them"""
+    options = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, True)]
+    for name, value in (("TCP_KEEPIDLE", 60), ("TCP_KEEPINTVL", 60), ("TCP_KEEPCNT", 5)):
+        if hasattr(socket, name):
+            options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+    return options
+
+
+class PoolMetrics:
+    def __init__(self):
+        # Pool waits, in seconds; a bounded sample for the percentiles
+        self.waits = Reservoir()
+        self.new_connections = 0
+        self.reused_connections = 0
+        self._lock = threading.Lock()
+
+    def record(self, wait, new_connection):
+        with self._lock:
+            self.waits.add(wait)
+            if new_connection:
+                self.new_connections += 1
+            else:
+                self.reused_connections += 1
+
+    def summary(self):
+        with self._lock:
+            count, total = self.waits.count, self.waits.total
+            p50, p95, p99 = self.waits.percentiles()
+            new, reused = self.new_connections, self.reused_connections
+        if not count:
+            return "no requests"
+        return (
+            f"{count} requests, {new} new connections, {reused} reused; "
+            f"pool wait p50 {p50 * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms, "
+            f"p99 {p99 * 1000:.1f} ms, total {total:.2f}s"
+        )
+
+
+class _RequestTrace:
+    """httpcore trace callback timing one request's wait for a connection"""
+
+    def __init__(self, metrics, inner=None):
+        self.metrics = metrics
+        self.inner = inner
+        self.start = time.perf_counter()
+        self.recorded = False
+
+    def event(self, name, info):
+        if self.recorded:
+            return
+        if name == "connection.connect_tcp.started":
+            new_connection = True
+        elif name.endswith(".send_request_headers.started"):
+            new_connection = False
+        else:
+            return
+        self.recorded = True
+        self.metrics.record(time.perf_counter() - self.start, new_connection)
+
+    def __call__(self, name, info):
+        self.event(name, info)
+        if self.inner is not None:
+            self.inner(name, info)
+
+
+class PoolMetricsTransport(httpx.BaseTransport):
+    def __init__(self, transport, metrics):
+        self.transport = transport
+        self.metrics = metrics
+
+    def handle_request(self, request):
+        request.extensions["trace"] = _RequestTrace(self.metrics, request.extensions.get("trace"))
+        return self.transport.handle_request(request)
+
+    def close(self):
+        self.transport.close()
+
+
+def make_client(max_concurrency, pool_metrics=None, http2=None, limits=None, **client_kwargs):
+    """An Anthropic client whose pool fits `max_concurrency` requests, or
+    has the given httpx `limits`"""
+    limits = limits or connection_limits(max_concurrency)
+    http2 = HTTP2_AVAILABLE if http2 is None else http2
+
+    def make_transport(proxy=None):
+        transport = httpx.HTTPTransport(
+            limits=limits, http2=http2, socket_options=_socket_options(), proxy=proxy
+        )
+        if pool_metrics is not None:
+            transport = PoolMetricsTransport(transport, pool_metrics)
+        return transport
+
+    # None: a NO_PROXY pattern, which the default transport serves
+    mounts = {
+        pattern: None if proxy is None else make_transport(proxy)
+        for pattern, proxy in get_environment_proxies().items()
+    }
+    http_client = httpx.Client(
+        transport=make_transport(),
+        mounts=mounts,
+        timeout=DEFAULT_TIMEOUT,
+        follow_redirects=True,
+    )
+    return Anthropic(http_client=http_client, **client_kwargs)
+
+
+class ClientFactory:
+    def __init__(self, max_concurrency=4, **client_kwargs):
+        self.max_concurrency = max_concurrency
+        self.client_kwargs = client_kwargs
+        self.pool_metrics = PoolMetrics()
+        self._client = None
+        self._retired = []
+        self._lock = threading.Lock()
+
+    def reserve(self, max_concurrency):
+        """Make sure the pool fits `max_concurrency` concurrent requests"""
+        with self._lock:
+            if max_concurrency > self.max_concurrency:
+                self.max_concurrency = max_concurrency
+                # Built again on next use; the old client stays usable
+                # until close()
+                if self._client is not None:
+                    self._retired.append(self._client)
+                self._client = None
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = make_client(
+                    self.max_concurrency, self.pool_metrics, **self.client_kwargs
+                )
+            return self._client
+
+    def close(self):
+        with self._lock:
+            clients = self._retired + ([self._client] if self._client else [])
+            self._retired, self._client = [], None
+        for client in clients:
+            client.close()
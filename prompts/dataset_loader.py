@@ -0,0 +1,261 @@
+"""
+Lazy loading of large datasets.
+
+`json.load` on a dataset file parses every test case before the first one
+can run, and keeps them all in memory. A JSONL dataset (one test case per
+line) can be read as it is needed instead: `JsonlDataset` maps the file
+with mmap and parses one line at a time, so an evaluation's first API call
+goes out as soon as the first line is parsed, and memory holds only the
+cases in flight.
+
+Slices don't need a full parse either. Shard i/n (1 to n) is the lines that
+start in the i-th of n equal byte ranges of the file, found by seeking, so
+shards split a file without overlap and without reading it first. Random
+samples and `len()` need the byte offset of every line: the offsets are
+found by scanning for newlines (with NumPy when it is installed) and saved
+next to the dataset as `<file>.idx`, which later runs reuse until the
+dataset changes.
+
+    for test_case in load_dataset("dataset.jsonl", sample=1000, shard="3/8"):
+        ...
+
+JSON array datasets still work with the same options, but are loaded whole.
+Convert one with `python prompts/dataset_loader.py convert dataset.json
+dataset.jsonl`.
+"""
+import argparse
+import array
+import bisect
+import json
+import mmap
+import os
+import random
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Bytes scanned for newlines at a time when indexing
+_CHUNK = 1 << 26
+_NEWLINE = ord("\n")
+# Bytes other than newlines that bytes.strip() removes
+_SPACES = list(b" \t\r\x0b\x0c")
+
+
+def parse_shard(shard):
+    """(i, n) from "i/n", for 1 <= i <= n"""
+    try:
+        number, count = (int(part) for part in shard.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard should look like 3/8, not {shard!r}") from None
+    if not 1 <= number <= count:
+        raise ValueError(f"Shard {shard!r} is out of range: use 1/{count} to {count}/{count}")
+    return number, count
+
+
+class JsonlDataset:
+    """Test cases of a JSONL file, parsed as they are read. Empty and
+    whitespace-only lines are skipped"""
+
+    def __init__(self, path, index_path=None):
+        self.path = path
+        self.index_path = index_path or f"{path}.idx"
+        self.size = os.path.getsize(path)
+        self._mapped = None
+        self._offsets = None
+
+    def _map(self):
+        if self._mapped is None:
+            if self.size == 0:
+                self._mapped = b""
+            else:
+                with open(self.path, "rb") as f:
+                    self._mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mapped
+
+    def _is_blank(self, start):
+        mapped = self._map()
+        end = mapped.find(b"\n", start)
+        return not mapped[start : end if end != -1 else self.size].strip()
+
+    def _loads(self, line, start):
+        try:
+            return json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{self.path}: malformed test case at byte {start}: {e}") from e
+
+    def _parse(self, start):
+        mapped = self._map()
+        end = mapped.find(b"\n", start)
+        return self._loads(mapped[start : end if end != -1 else self.size], start)
+
+    def _read(self, start, stop):
+        """Test cases of the lines that start at or after byte `start` and
+        before byte `stop`"""
+        mapped = self._map()
+        position = start
+        if position > 0:
+            # Skip the rest of the line `start` falls in
+            newline = mapped.find(b"\n", position - 1)
+            position = newline + 1 if newline != -1 else self.size
+        while position < stop:
+            end = mapped.find(b"\n", position)
+            if end == -1:
+                end = self.size
+            line = mapped[position:end]
+            if line.strip():
+                yield self._loads(line, position)
+            position = end + 1
+
+    def __iter__(self):
+        return self._read(0, self.size)
+
+    def shard(self, number, count):
+        """Iterate over shard `number` (1 to `count`) of the file"""
+        return self._read(self.size * (number - 1) // count, self.size * number // count)
+
+    def offsets(self):
+        """Byte offset of every non-blank line; built or loaded from the
+        index file on first use"""
+        if self._offsets is None:
+            self._offsets = self._load_index()
+            if self._offsets is None:
+                self._offsets = self._build_index()
+                self._save_index()
+        return self._offsets
+
+    def _stamp(self):
+        stat = os.stat(self.path)
+        return array.array("Q", [stat.st_size, stat.st_mtime_ns])
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return None
+        with open(self.index_path, "rb") as f:
+            stamp = array.array("Q")
+            try:
+                stamp.fromfile(f, 2)
+            except EOFError:
+                return None
+            if stamp != self._stamp():
+                return None
+            length = os.fstat(f.fileno()).st_size - 2 * stamp.itemsize
+            if length % stamp.itemsize:
+                return None
+            if length == 0:
+                return array.array("Q")
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)[2 * stamp.itemsize :]
+        if np is not None:
+            return np.frombuffer(view, dtype=np.uint64)
+        return view.cast("Q")
+
+    def _build_index(self):
+        mapped = self._map()
+        if np is not None:
+            data = np.frombuffer(mapped, dtype=np.uint8)
+            starts = [np.zeros(1, dtype=np.uint64)]
+            for chunk in range(0, self.size, _CHUNK):
+                newlines = np.flatnonzero(data[chunk : chunk + _CHUNK] == _NEWLINE)
+                starts.append((newlines + chunk + 1).astype(np.uint64))
+            starts = np.concatenate(starts)
+            starts = starts[starts < self.size]
+            starts = starts[data[starts] != _NEWLINE]
+            # Only lines starting with a space can be blank; check those one
+            # by one, there are few
+            keep = np.ones(len(starts), dtype=bool)
+            for line in np.flatnonzero(np.isin(data[starts], _SPACES)):
+                keep[line] = not self._is_blank(int(starts[line]))
+            return starts[keep]
+        starts = array.array("Q")
+        position = 0
+        while position < self.size:
+            end = mapped.find(b"\n", position)
+            if end == -1:
+                end = self.size
+            if mapped[position:end].strip():
+                starts.append(position)
+            position = end + 1
+        return starts
+
+    def _save_index(self):
+        tmp_path = f"{self.index_path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                self._stamp().tofile(f)
+                f.write(memoryview(self._offsets).cast("B"))
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            # E.g. a read-only dataset directory: index again next time
+            pass
+
+    def __len__(self):
+        return len(self.offsets())
+
+    def __getitem__(self, index):
+        return self._parse(int(self.offsets()[index]))
+
+    def lines(self, number=None, count=None):
+        """(first, stop) line numbers of a shard, or of the whole file"""
+        offsets = self.offsets()
+        if number is None:
+            return 0, len(offsets)
+        start = self.size * (number - 1) // count
+        stop = self.size * number // count
+        return bisect.bisect_left(offsets, start), bisect.bisect_left(offsets, stop)
+
+    def sample(self, k, seed=0, shard=None):
+        """Iterate over `k` random test cases, of shard (i, n) if given, in
+        file order"""
+        first, stop = self.lines(*(shard or ()))
+        lines = random.Random(seed).sample(range(first, stop), min(k, stop - first))
+        offsets = self.offsets()
+        return (self._parse(int(offsets[line])) for line in sorted(lines))
+
+
+def load_dataset(path, sample=None, shard=None, seed=0):
+    """The test cases of a JSONL or JSON array dataset file, or `sample`
+    random ones of them, of shard `shard` ("i/n") if given. JSONL files are
+    read lazily"""
+    shard = parse_shard(shard) if isinstance(shard, str) else shard
+    if path.endswith(".jsonl"):
+        dataset = JsonlDataset(path)
+        if sample is not None:
+            return dataset.sample(sample, seed, shard)
+        return dataset.shard(*shard) if shard else iter(dataset)
+
+    with open(path, "r") as f:
+        dataset = json.load(f)
+    if shard:
+        number, count = shard
+        dataset = dataset[len(dataset) * (number - 1) // count : len(dataset) * number // count]
+    if sample is not None and sample < len(dataset):
+        lines = random.Random(seed).sample(range(len(dataset)), sample)
+        dataset = [dataset[line] for line in sorted(lines)]
+    return dataset
+
+
+def write_jsonl(test_cases, path):
+    with open(path, "w", encoding="utf-8") as f:
+        for test_case in test_cases:
+            f.write(json.dumps(test_case) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prepare datasets for lazy loading")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="write a JSON array dataset as JSONL, indexed")
+    convert.add_argument("json_file")
+    convert.add_argument("jsonl_file")
+    index = commands.add_parser("index", help="build the line index of a JSONL dataset")
+    index.add_argument("jsonl_file")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        write_jsonl(load_dataset(args.json_file), args.jsonl_file)
+    print(f"{args.jsonl_file}: {len(JsonlDataset(args.jsonl_file))} test cases")
+
+
+if __name__ == "__main__":
+    main()
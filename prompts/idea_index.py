@@ -0,0 +1,257 @@
+"""
+Near-duplicate detection for generated test case ideas.
+
+Asking the model for "clearly distinct" ideas doesn't stop it from writing
+"Testing with a vegan athlete needing plant-based protein" and, twenty ideas
+later, "Testing a vegan athlete who requires plant-based protein sources".
+Each of those becomes a full generate_test_case call, and the dataset then
+tests the same thing twice.
+
+`IdeaIndex` compares ideas by the Jaccard similarity of their word sets,
+after lowercasing, dropping filler words ("testing", "with", "a", ...) and
+crude suffix stripping, so word order and phrasing matter little. Each idea
+is stored with a MinHash signature; locality-sensitive hashing over bands of
+the signature finds the few stored ideas that could be similar, and only
+those are compared exactly. Lookups stay fast with thousands of ideas.
+Signatures are computed with NumPy when it is installed; without it the
+same values are computed element by element.
+
+Ideas are scoped by task description, and the index is a JSON file, so a
+new dataset for the same task avoids the scenarios of earlier ones:
+
+    index = IdeaIndex("idea_index.json")
+    index.add_dataset("dataset.json")
+    if index.add_if_new(idea, task) is None:
+        ...  # a new idea
+    index.remove(idea, task)  # if it didn't become a test case after all
+    index.save()
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 2**31 - 1: hashes and permutation coefficients stay below it, so a * h + b
+# fits in 64 bits
+_PRIME = (1 << 31) - 1
+
+STOPWORDS = frozenset(
+    """
+    a an the and or of for to in on at by with from into as is are be being
+    that this these those which who whose when where how what while their its
+    test tests testing tested scenario scenarios case cases example
+    focus focused focusing need needs needing require requires requiring
+    prioritizing prioritising emphasizing involving
+    """.split()
+)
+_SUFFIXES = ("ing", "ed", "es", "s")
+
+
+def tokens(text):
+    """Normalized content words of `text`"""
+    words = []
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        if word in STOPWORDS:
+            continue
+        for suffix in _SUFFIXES:
+            if len(word) > 4 and word.endswith(suffix):
+                word = word[: -len(suffix)]
+                break
+        words.append(word)
+    return words
+
+
+def shingles(text):
+    """The set compared between ideas; the whole text if it has no content words"""
+    return frozenset(tokens(text)) or frozenset([text.strip().lower()])
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def _hash(shingle):
+    digest = hashlib.blake2b(shingle.encode(), digest_size=4).digest()
+    return int.from_bytes(digest, "little") % _PRIME
+
+
+def choose_bands(num_perm, threshold, recall=0.95):
+    """(bands, rows): the most selective split of a signature that still
+    makes ideas exactly at `threshold` candidates with probability `recall`"""
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        if 1 - (1 - threshold**rows) ** bands >= recall:
+            best = (bands, rows)
+    return best
+
+
+class IdeaIndex:
+    def __init__(self, path=None, threshold=0.5, num_perm=128, seed=1):
+        # Saved to and loaded from `path` (None: kept in memory only)
+        self.path = path
+        # Ideas at least this similar (Jaccard, 0-1) are duplicates
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.seed = seed
+        rng = random.Random(seed)
+        self._perms = [
+            (rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)
+        ]
+        if np is not None:
+            self._a = np.array([a for a, _ in self._perms], dtype=np.uint64)[:, None]
+            self._b = np.array([b for _, b in self._perms], dtype=np.uint64)[:, None]
+        self.bands, self.rows = choose_bands(num_perm, threshold)
+        self.checked = 0
+        self.duplicates = 0
+        self._entries = []  # {"task", "idea", "source", "signature"}
+        self._shingles = []  # shingles of each entry
+        self._buckets = {}  # (task, band, band hash) -> entry indexes
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load(path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def signature(self, text):
+        """MinHash signature of the idea's shingles"""
+        hashes = [_hash(shingle) for shingle in shingles(text)]
+        if np is not None:
+            values = (self._a * np.array(hashes, dtype=np.uint64) + self._b) % _PRIME
+            return values.min(axis=1).tolist()
+        return [min((a * h + b) % _PRIME for h in hashes) for a, b in self._perms]
+
+    def _band_keys(self, task, signature):
+        rows = self.rows
+        return [
+            (task, band, hash(tuple(signature[band * rows : (band + 1) * rows])))
+            for band in range(self.bands)
+        ]
+
+    def _insert(self, entry):
+        index = len(self._entries)
+        self._entries.append(entry)
+        self._shingles.append(shingles(entry["idea"]))
+        for key in self._band_keys(entry["task"], entry["signature"]):
+            self._buckets.setdefault(key, []).append(index)
+
+    def _find(self, task, text, signature):
+        candidates = set()
+        for key in self._band_keys(task, signature):
+            candidates.update(self._buckets.get(key, ()))
+        if not candidates:
+            return None
+        words = shingles(text)
+        best = None
+        for index in candidates:
+            similarity = jaccard(words, self._shingles[index])
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (self._entries[index]["idea"], similarity)
+        return best
+
+    def find_duplicate(self, idea, task=""):
+        """(stored idea, similarity) of the closest duplicate of `idea` for
+        `task`, or None"""
+        signature = self.signature(idea)
+        with self._lock:
+            return self._find(task, idea, signature)
+
+    def add(self, idea, task="", source="generated"):
+        signature = self.signature(idea)
+        with self._lock:
+            self._insert(
+                {"task": task, "idea": idea, "source": source, "signature": signature}
+            )
+
+    def add_if_new(self, idea, task="", source="generated"):
+        """Adds `idea` unless it duplicates one already indexed for `task`.
+        Returns the duplicate as (stored idea, similarity), or None if added"""
+        signature = self.signature(idea)
+        with self._lock:
+            self.checked += 1
+            duplicate = self._find(task, idea, signature)
+            if duplicate is not None:
+                self.duplicates += 1
+                return duplicate
+            self._insert(
+                {"task": task, "idea": idea, "source": source, "signature": signature}
+            )
+            return None
+
+    def remove(self, idea, task=""):
+        """Drops `idea` from the ideas indexed for `task`, e.g. because no
+        test case could be written for it. Returns whether it was indexed"""
+        with self._lock:
+            kept = [
+                entry
+                for entry in self._entries
+                if entry["task"] != task or entry["idea"] != idea
+            ]
+            if len(kept) == len(self._entries):
+                return False
+            # Bucket entries are positions, so rebuild them; failures are rare
+            self._entries = []
+            self._shingles = []
+            self._buckets = {}
+            for entry in kept:
+                self._insert(entry)
+            return True
+
+    def ideas(self, task=""):
+        """Indexed ideas for `task`, oldest first"""
+        with self._lock:
+            return [entry["idea"] for entry in self._entries if entry["task"] == task]
+
+    def add_dataset(self, path):
+        """Indexes the scenarios of a generate_dataset file that aren't
+        indexed yet. Returns how many were added"""
+        with open(path) as f:
+            dataset = json.load(f)
+        with self._lock:
+            known = {(entry["task"], entry["idea"]) for entry in self._entries}
+        added = 0
+        for test_case in dataset:
+            idea = test_case.get("scenario")
+            task = test_case.get("task_description", "")
+            if idea and (task, idea) not in known:
+                known.add((task, idea))
+                self.add(idea, task, source=path)
+                added += 1
+        return added
+
+    def _load(self, path):
+        with open(path) as f:
+            saved = json.load(f)
+        # Signatures only compare if they were made by the same permutations
+        same_hashes = saved.get("num_perm") == self.num_perm and saved.get("seed") == self.seed
+        for entry in saved["entries"]:
+            if not same_hashes:
+                entry["signature"] = self.signature(entry["idea"])
+            self._insert(entry)
+
+    def save(self, path=None):
+        path = path or self.path
+        if not path:
+            return
+        with self._lock:
+            saved = {"num_perm": self.num_perm, "seed": self.seed, "entries": self._entries}
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(saved, f, separators=(",", ":"))
+            os.replace(tmp_path, path)
+
+    def summary(self):
+        return (
+            f"{self.duplicates}/{self.checked} ideas were near-duplicates "
+            f"(similarity >= {self.threshold}); {len(self)} ideas indexed"
+        )
@@ -0,0 +1,365 @@
+"""
+Latency and token instrumentation for Messages API calls.
+
+Wrap each API call in `CallMetrics.measure()` and pass the response to
+`call.finish(message)`. Every call records its wall time, input, output and
+cached tokens, stop_reason and number of retries, plus time to first token for
+streams (call `call.first_token()` on the first streamed event).
+
+Calls are grouped by call site, set with `call_site("grade_output")` around
+the code that makes them. The site is a context variable, so it follows the
+call into `chat()` and is kept separate per thread and per asyncio task.
+`summary()` and `export()` report p50/p95/p99 latency and token totals per
+site. Only per-site totals and a bounded sample of latencies (see Reservoir)
+are kept, so memory stays flat however many calls a run makes. Percentiles
+can't be combined after the fact, so processes that each measure part of a
+run stream their calls to a JSONL file inside `recording()`, and
+`CallMetrics.read_calls()` loads them back into one CallMetrics.
+
+`track_usage()` totals the calls made inside it, e.g. the tokens one test
+case's prompt used, for saving with that case's result.
+"""
+import collections
+import contextlib
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+import types
+from statistics import quantiles
+
+from prompt_cache import PromptCacheStats
+
+_current_site = contextvars.ContextVar("call_site", default="other")
+_current_call = contextvars.ContextVar("current_call", default=None)
+_current_usage = contextvars.ContextVar("current_usage", default=None)
+
+
+@contextlib.contextmanager
+def call_site(name):
+    """Attribute API calls made inside this block to `name`"""
+    token = _current_site.set(name)
+    try:
+        yield
+    finally:
+        _current_site.reset(token)
+
+
+def current_call_site():
+    return _current_site.get()
+
+
+class Usage:
+    """Wall time of a track_usage() block and tokens of the calls in it"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.elapsed = None
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def add(self, call):
+        self.calls += 1
+        self.input_tokens += call.input_tokens
+        self.output_tokens += call.output_tokens
+
+    def fields(self):
+        """The latency and token fields saved with a result"""
+        return {
+            "latency": self.elapsed,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+        }
+
+
+@contextlib.contextmanager
+def track_usage():
+    """Yields a Usage that totals the API calls measured inside this block"""
+    usage = Usage()
+    token = _current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _current_usage.reset(token)
+        usage.elapsed = time.perf_counter() - usage.start
+
+
+def percentiles(values):
+    """Returns (p50, p95, p99) of a non-empty list"""
+    if len(values) == 1:
+        return values[0], values[0], values[0]
+    cuts = quantiles(values, n=100, method="inclusive")
+    return cuts[49], cuts[94], cuts[98]
+
+
+class Reservoir:
+    """Count and total of every value added, and a uniform random sample of
+    at most `size` of them to take percentiles from, so memory stays flat
+    however long a run is. Percentiles are exact up to `size` values"""
+
+    def __init__(self, size=10_000, seed=0):
+        self.size = size
+        self.count = 0
+        self.total = 0.0
+        self.values = []
+        self._random = random.Random(seed)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if len(self.values) < self.size:
+            self.values.append(value)
+        else:
+            slot = self._random.randrange(self.count)
+            if slot < self.size:
+                self.values[slot] = value
+
+    def percentiles(self):
+        """(p50, p95, p99), or Nones when empty"""
+        if not self.values:
+            return None, None, None
+        return percentiles(self.values)
+
+
+class CallRecord:
+    def __init__(self, site):
+        self.site = site
+        self.start = time.perf_counter()
+        self.elapsed = None
+        self.time_to_first_token = None
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cache_read_tokens = 0
+        self.cache_write_tokens = 0
+        self.stop_reason = None
+        self.retries = 0
+        self.error = None
+        self.usage = None
+
+    def first_token(self):
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.perf_counter() - self.start
+
+    def finish(self, message):
+        usage = message.usage
+        self.usage = usage
+        self.input_tokens = usage.input_tokens
+        self.output_tokens = usage.output_tokens
+        self.cache_read_tokens = getattr(usage, "cache_read_input_tokens", None) or 0
+        self.cache_write_tokens = getattr(usage, "cache_creation_input_tokens", None) or 0
+        self.stop_reason = message.stop_reason
+
+
+# CallRecord fields saved by recording()
+_RECORD_FIELDS = (
+    "site",
+    "elapsed",
+    "time_to_first_token",
+    "input_tokens",
+    "output_tokens",
+    "cache_read_tokens",
+    "cache_write_tokens",
+    "stop_reason",
+    "retries",
+    "error",
+)
+
+
+class SiteStats:
+    """Totals of the calls made from one call site"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.latencies = Reservoir()
+        self.ttfts = Reservoir()
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cache_read_tokens = 0
+        self.cache_write_tokens = 0
+        self.stop_reasons = collections.Counter()
+
+    def add(self, call):
+        self.calls += 1
+        if call.error:
+            self.errors += 1
+        self.retries += call.retries
+        self.latencies.add(call.elapsed)
+        if call.time_to_first_token is not None:
+            self.ttfts.add(call.time_to_first_token)
+        self.input_tokens += call.input_tokens
+        self.output_tokens += call.output_tokens
+        self.cache_read_tokens += call.cache_read_tokens
+        self.cache_write_tokens += call.cache_write_tokens
+        if call.stop_reason:
+            self.stop_reasons[call.stop_reason] += 1
+
+    def summary(self):
+        summary = {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "latency_p50": None,
+            "latency_p95": None,
+            "latency_p99": None,
+            "ttft_p50": None,
+            "ttft_p95": None,
+            "ttft_p99": None,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cache_read_tokens": self.cache_read_tokens,
+            "cache_write_tokens": self.cache_write_tokens,
+            "stop_reasons": dict(self.stop_reasons),
+        }
+        (
+            summary["latency_p50"],
+            summary["latency_p95"],
+            summary["latency_p99"],
+        ) = self.latencies.percentiles()
+        summary["ttft_p50"], summary["ttft_p95"], summary["ttft_p99"] = (
+            self.ttfts.percentiles()
+        )
+        return summary
+
+
+def _drop_partial_line(path):
+    """Truncate a file after its last newline, dropping a line a killed
+    process left half written"""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - 65536)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b"\n")
+            if newline != -1:
+                position = start + newline + 1
+                break
+            position = start
+        if position < end:
+            f.truncate(position)
+
+
+def _to_record(call):
+    record = {field: getattr(call, field) for field in _RECORD_FIELDS}
+    record["has_usage"] = call.usage is not None
+    return record
+
+
+class CallMetrics:
+    def __init__(self):
+        self.sites = collections.defaultdict(SiteStats)
+        # Cached vs uncached input tokens, with hit/miss latency
+        self.prompt_cache = PromptCacheStats()
+        self._lock = threading.Lock()
+        # Open file of recording(), or None
+        self._sink = None
+
+    @contextlib.contextmanager
+    def measure(self, site=None):
+        """Time one API call, attributed to `site` or the current call site"""
+        call = CallRecord(site or _current_site.get())
+        token = _current_call.set(call)
+        try:
+            yield call
+        except BaseException as e:
+            call.error = type(e).__name__
+            raise
+        finally:
+            _current_call.reset(token)
+            call.elapsed = time.perf_counter() - call.start
+            with self._lock:
+                self.sites[call.site].add(call)
+                if self._sink is not None:
+                    self._sink.write(json.dumps(_to_record(call)) + "\n")
+                usage = _current_usage.get()
+                if usage is not None:
+                    usage.add(call)
+            if call.usage is not None:
+                self.prompt_cache.record(call.usage, call.elapsed)
+
+    def count_retry(self):
+        """Count a retry against the call being measured in this context"""
+        call = _current_call.get()
+        if call is not None:
+            call.retries += 1
+
+    def site_summaries(self):
+        with self._lock:
+            return {site: stats.summary() for site, stats in sorted(self.sites.items())}
+
+    def summary(self):
+        lines = []
+        for site, s in self.site_summaries().items():
+            line = (
+                f"{site}: {s['calls']} calls, latency p50 {s['latency_p50']:.2f}s "
+                f"p95 {s['latency_p95']:.2f}s p99 {s['latency_p99']:.2f}s, "
+                f"{s['input_tokens']} in / {s['output_tokens']} out / "
+                f"{s['cache_read_tokens']} cached tokens, {s['retries']} retries"
+            )
+            if s["ttft_p50"] is not None:
+                line += f", TTFT p50 {s['ttft_p50']:.2f}s"
+            if s["errors"]:
+                line += f", {s['errors']} errors"
+            lines.append(line)
+        return "\n".join(lines) if lines else "no API calls"
+
+    @contextlib.contextmanager
+    def recording(self, path, append=False):
+        """Write a record of every call measured inside this block to a
+        JSONL file, one per line, for read_calls. With `append`, records
+        are added after those already in the file, e.g. by an earlier
+        attempt at the same shard"""
+        if append:
+            _drop_partial_line(path)
+        # Line buffered, so a killed process loses at most the call in flight
+        with open(path, "a" if append else "w", encoding="utf-8", buffering=1) as f:
+            with self._lock:
+                self._sink = f
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self._sink = None
+
+    @classmethod
+    def read_calls(cls, paths):
+        """A CallMetrics totalling the calls in recording() files"""
+        metrics = cls()
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        continue  # cut off by a killed process
+                    record = json.loads(line)
+                    call = CallRecord(record["site"])
+                    for field in _RECORD_FIELDS:
+                        setattr(call, field, record[field])
+                    metrics.sites[call.site].add(call)
+                    if record["has_usage"]:
+                        usage = types.SimpleNamespace(
+                            input_tokens=call.input_tokens,
+                            cache_read_input_tokens=call.cache_read_tokens,
+                            cache_creation_input_tokens=call.cache_write_tokens,
+                        )
+                        metrics.prompt_cache.record(usage, call.elapsed)
+        return metrics
+
+    def export(self, path):
+        """Write the per-site aggregates to a JSON file"""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                    "sites": self.site_summaries(),
+                    "prompt_cache": self.prompt_cache.summary(),
+                },
+                f,
+                indent=2,
+            )
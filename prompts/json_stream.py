@@ -0,0 +1,290 @@
+"""
+Incremental and forgiving JSON parsing for prefilled "```json" responses.
+
+`JsonArrayParser` reads a JSON array as it streams in. `feed(text)` returns
+the elements completed by that piece of text, so the caller can start
+working on idea #1 while the model is still writing idea #20:
+
+    parser = JsonArrayParser()
+    for text in stream.text_stream:
+        for idea in parser.feed(text):
+            ...
+    parser.finish()
+
+An element that isn't valid JSON is skipped and recorded in `errors`; the
+rest of the array is still read. If the response stops before the closing
+bracket (e.g. at max_tokens), `finish()` sets `truncated` and drops the
+unfinished last element, and everything before it is kept.
+
+`loads_lenient(text)` is `json.loads` for whole responses that tolerates what
+models commonly get wrong: a document cut off mid-way, trailing commas,
+`//` comments copied from an example, and text after the closing bracket.
+`repair_json(text)` does the fixing. It keeps everything up to the last
+complete value, closes an unterminated string value where it stops, and
+closes the open brackets.
+"""
+import json
+import re
+
+_LITERAL = re.compile(r"-?(?:\d+\.?\d*(?:[eE][+-]?\d+)?)|true|false|null")
+_ARRAY_SPECIAL = re.compile(r'["\[\]{},]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+
+
+def _string_end(text, start):
+    """Index just past the string opening at `start`, or None if it's cut off"""
+    i = start + 1
+    while True:
+        match = _STRING_SPECIAL.search(text, i)
+        if match is None:
+            return None
+        if match.group() == '"':
+            return match.end()
+        i = match.end() + 1  # skip the escaped character
+        if i > len(text):
+            return None
+
+
+def _unterminated_string(text):
+    """A cut-off string's text, minus a dangling escape sequence"""
+    return re.sub(r"\\(u[0-9a-fA-F]{0,3})?$", "", text)
+
+
+def repair_json(text):
+    """The longest valid JSON document that `text` starts with, closed off.
+
+    Text before the first { or [ and after the top-level value is dropped.
+    Returns `text` unchanged if there is nothing to salvage.
+    """
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return text
+
+    out = []  # the repaired document so far
+    stack = []  # [bracket, state]; state is "key", "colon", "value" or "comma"
+    cut = None  # (len(out), closers) after the last complete value
+    pending_comma = False
+
+    def closers():
+        return "".join("}" if bracket == "{" else "]" for bracket, _ in reversed(stack))
+
+    def value_done():
+        nonlocal cut
+        if stack:
+            stack[-1][1] = "comma"
+        cut = (len(out), closers())
+
+    def start_value():
+        nonlocal pending_comma
+        if pending_comma:
+            out.append(",")
+            pending_comma = False
+
+    i = min(starts)
+    n = len(text)
+    while i < n:
+        ch = text[i]
+        state = stack[-1][1] if stack else "value"
+        if ch in " \t\r\n":
+            i += 1
+        elif text.startswith("//", i):
+            newline = text.find("\n", i)
+            i = n if newline < 0 else newline
+        elif text.startswith("/*", i):
+            end = text.find("*/", i)
+            i = n if end < 0 else end + 2
+        elif ch == '"':
+            end = _string_end(text, i)
+            if state not in ("key", "value"):
+                break
+            is_key = state == "key"
+            if end is None:
+                if is_key:
+                    break
+                start_value()
+                out.append(_unterminated_string(text[i:]) + '"')
+                value_done()
+                break
+            start_value()
+            out.append(text[i:end])
+            if is_key:
+                stack[-1][1] = "colon"
+            else:
+                value_done()
+            i = end
+        elif ch in "{[":
+            if state != "value":
+                break
+            start_value()
+            out.append(ch)
+            stack.append([ch, "key" if ch == "{" else "value"])
+            cut = (len(out), closers())
+            i += 1
+        elif ch in "}]":
+            if not stack:
+                break
+            pending_comma = False  # a trailing comma
+            out.append("}" if stack.pop()[0] == "{" else "]")
+            value_done()
+            i += 1
+            if not stack:
+                break  # the top-level value is complete
+        elif ch == ":" and state == "colon":
+            out.append(ch)
+            stack[-1][1] = "value"
+            i += 1
+        elif ch == "," and state == "comma":
+            pending_comma = True
+            stack[-1][1] = "key" if stack[-1][0] == "{" else "value"
+            i += 1
+        else:
+            match = _LITERAL.match(text, i)
+            if match is None or state != "value":
+                break
+            token = match.group()
+            if match.end() == n and token[-1] in ".eE+-":
+                break  # a number cut off mid-way
+            start_value()
+            out.append(token)
+            value_done()
+            i = match.end()
+
+    if cut is None:
+        return text
+    length, closing = cut
+    return "".join(out[:length]) + closing
+
+
+def loads_lenient(text):
+    """json.loads, falling back to repair_json; raises the original
+    JSONDecodeError if the repaired text doesn't parse either"""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError as e:
+        error = e
+    try:
+        return json.loads(repair_json(text))
+    except json.JSONDecodeError:
+        raise error from None
+
+
+class JsonArrayParser:
+    def __init__(self, keep_partial=False):
+        # Whether finish() repairs and returns an unfinished last element
+        self.keep_partial = keep_partial
+        self.started = False
+        self.closed = False
+        self.truncated = False
+        self.count = 0
+        self.errors = []  # (element text, error message) of skipped elements
+        self._text = []  # everything fed, for a response that isn't an array
+        self._element = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def _emit(self, elements):
+        text = "".join(self._element).strip()
+        self._element = []
+        if not text:
+            return  # "[]" or a trailing comma
+        try:
+            elements.append(loads_lenient(text))
+            self.count += 1
+        except json.JSONDecodeError as e:
+            self.errors.append((text, str(e)))
+
+    def feed(self, text):
+        """Elements completed by `text`, in order"""
+        self._text.append(text)
+        elements = []
+        i, n = 0, len(text)
+        if not self.started:
+            pending = "".join(self._text).lstrip()
+            if not pending:
+                return elements
+            if pending[0] != "[":
+                self.closed = True  # not an array; finish() parses it whole
+                return elements
+            self.started = True
+            text, i, n = pending, 1, len(pending)
+
+        while i < n and not self.closed:
+            if self._in_string:
+                if self._escaped:
+                    self._element.append(text[i])
+                    self._escaped = False
+                    i += 1
+                    continue
+                match = _STRING_SPECIAL.search(text, i)
+                end = n if match is None else match.end()
+                self._element.append(text[i:end])
+                if match is not None:
+                    if match.group() == '"':
+                        self._in_string = False
+                    else:
+                        self._escaped = True
+                i = end
+                continue
+
+            match = _ARRAY_SPECIAL.search(text, i)
+            if match is None:
+                self._element.append(text[i:])
+                break
+            self._element.append(text[i : match.start()])
+            ch = match.group()
+            i = match.end()
+            if ch == '"':
+                self._in_string = True
+                self._element.append(ch)
+            elif ch in "[{":
+                self._depth += 1
+                self._element.append(ch)
+            elif self._depth == 0 and ch in ",]":
+                self._emit(elements)
+                self.closed = ch == "]"
+            elif ch in "]}":
+                self._depth -= 1
+                self._element.append(ch)
+            else:
+                self._element.append(ch)
+        return elements
+
+    def finish(self):
+        """Call once the response is complete. Returns any elements still to
+        come: the repaired last element with keep_partial, or all of them
+        if the response wasn't an array (or an object wrapping one)."""
+        if not self.started:
+            text = "".join(self._text)
+            if not text.strip():
+                self.truncated = self.closed = True  # stopped before the "["
+                return []
+            value = loads_lenient(text)
+            if isinstance(value, dict):
+                # e.g. {"ideas": [...]}: the array is the only list in it
+                lists = [item for item in value.values() if isinstance(item, list)]
+                value = lists[0] if len(lists) == 1 else value
+            if not isinstance(value, list):
+                raise ValueError(f"expected a JSON array, got {type(value).__name__}")
+            self.started = self.closed = True
+            self.count += len(value)
+            return value
+        if self.closed:
+            return []
+
+        self.truncated = True
+        self.closed = True
+        elements = []
+        if self.keep_partial:
+            self._emit(elements)
+        else:
+            self._element = []
+        return elements
+
+
+def iter_json_array(texts, parser=None):
+    """Yield the elements of a JSON array streamed as pieces of text"""
+    parser = parser or JsonArrayParser()
+    for text in texts:
+        yield from parser.feed(text)
+    yield from parser.finish()
@@ -0,0 +1,95 @@
+"""
+Message Batches API backend for offline evaluations.
+
+A Message Batch runs many Messages requests asynchronously, at half the price
+of individual calls and without counting against the per-minute rate limits.
+Results usually arrive within minutes (at most 24 hours), which is fine for
+large offline suites where nobody is waiting on a single answer.
+
+`run_message_batch` submits a {custom_id: params} mapping, polls until every
+batch has ended, and joins the results back by custom_id.
+"""
+import time
+
+MAX_REQUESTS_PER_BATCH = 100_000
+
+# Standard USD prices per million (input, output) tokens, matched by model
+# name prefix. Batch requests are billed at BATCH_DISCOUNT of these.
+PRICES_PER_MTOK = {
+    "claude-haiku-4-5": (1.00, 5.00),
+    "claude-sonnet-4-5": (3.00, 15.00),
+    "claude-sonnet-4": (3.00, 15.00),
+    "claude-opus-4-1": (15.00, 75.00),
+    "claude-3-5-haiku": (0.80, 4.00),
+}
+BATCH_DISCOUNT = 0.5
+
+
+def batch_cost(model, input_tokens, output_tokens):
+    """USD cost of batch usage, or None for a model without a known price"""
+    for prefix, (input_price, output_price) in PRICES_PER_MTOK.items():
+        if model and model.startswith(prefix):
+            standard = (input_tokens * input_price + output_tokens * output_price) / 1e6
+            return standard * BATCH_DISCOUNT
+    return None
+
+
+class BatchRun:
+    """Joined results of one or more Message Batches"""
+
+    def __init__(self):
+        self.messages = {}
+        self.errors = {}
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.elapsed = 0.0
+
+    def add(self, entry):
+        result = entry.result
+        if result.type == "succeeded":
+            self.messages[entry.custom_id] = result.message
+            self.input_tokens += result.message.usage.input_tokens
+            self.output_tokens += result.message.usage.output_tokens
+        elif result.type == "errored":
+            self.errors[entry.custom_id] = f"errored: {result.error.error.message}"
+        else:
+            self.errors[entry.custom_id] = result.type
+
+    def text(self, custom_id):
+        return self.messages[custom_id].content[0].text
+
+
+def run_message_batch(client, requests, poll_interval=10.0, label="requests"):
+    """Submit {custom_id: params} as Message Batches and wait for the results"""
+    run = BatchRun()
+    start = time.perf_counter()
+
+    items = list(requests.items())
+    batch_ids = []
+    for offset in range(0, len(items), MAX_REQUESTS_PER_BATCH):
+        chunk = items[offset : offset + MAX_REQUESTS_PER_BATCH]
+        batch = client.messages.batches.create(
+            requests=[
+                {"custom_id": custom_id, "params": params} for custom_id, params in chunk
+            ]
+        )
+        batch_ids.append(batch.id)
+    print(f"Submitted {len(items)} {label} in {len(batch_ids)} batch(es)")
+
+    pending = list(batch_ids)
+    while pending:
+        for batch_id in list(pending):
+            batch = client.messages.batches.retrieve(batch_id)
+            if batch.processing_status == "ended":
+                pending.remove(batch_id)
+                for entry in client.messages.batches.results(batch_id):
+                    run.add(entry)
+        if pending:
+            time.sleep(poll_interval)
+
+    run.elapsed = time.perf_counter() - start
+    print(
+        f"Finished {len(run.messages)}/{len(items)} {label} "
+        f"in {run.elapsed:.1f}s ({len(run.errors)} failed)"
+    )
+    return run
@@ -0,0 +1,191 @@
+"""
+Two-stage generate-then-grade pipeline.
+
+Instead of one worker running the prompt and then grading it, generation and
+grading get their own independently sized thread pools, connected by a
+bounded hand-off queue. A slow grader no longer holds a slot that could be
+generating the next output, and a full queue makes the generators wait
+(backpressure) instead of piling up outputs in memory.
+
+Per-stage latency and hand-off queue depth are recorded in `PipelineMetrics`,
+in fixed-size reservoirs and running totals, so they don't grow with the
+number of items.
+"""
+import queue
+import threading
+import time
+
+from instrumentation import Reservoir
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+class StageMetrics:
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.latencies = Reservoir()
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.latencies.add(seconds)
+
+    def summary(self):
+        if not self.latencies.count:
+            return f"{self.name}: {self.workers} workers, no items"
+        p50, p95, _ = self.latencies.percentiles()
+        return (
+            f"{self.name}: {self.workers} workers, {self.latencies.count} items, "
+            f"p50 {p50:.2f}s, p95 {p95:.2f}s"
+        )
+
+
+class PipelineMetrics:
+    def __init__(self, generation_workers, grading_workers, queue_size):
+        self.generation = StageMetrics("generate", generation_workers)
+        self.grading = StageMetrics("grade", grading_workers)
+        self.queue_size = queue_size
+        self.queue_samples = 0
+        self.queue_depth_total = 0
+        self.queue_depth_max = 0
+        self._lock = threading.Lock()
+
+    def sample_queue(self, handoff):
+        depth = handoff.qsize()
+        with self._lock:
+            self.queue_samples += 1
+            self.queue_depth_total += depth
+            self.queue_depth_max = max(self.queue_depth_max, depth)
+
+    def summary(self):
+        depth = (
+            f"avg {self.queue_depth_total / self.queue_samples:.1f}, "
+            f"max {self.queue_depth_max}"
+            if self.queue_samples
+            else "no samples"
+        )
+        return "\n".join(
+            [
+                self.generation.summary(),
+                self.grading.summary(),
+                f"hand-off queue (size {self.queue_size}): depth {depth}",
+            ]
+        )
+
+
+def _put(target, item, stop):
+    """Blocking put that gives up once the pipeline is stopped"""
+    while not stop.is_set():
+        try:
+            target.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def run_pipeline(
+    items,
+    generate,
+    grade,
+    generation_workers=3,
+    grading_workers=3,
+    queue_size=None,
+    metrics=None,
+):
+    """Yield grade(item, generate(item)) for every item, in completion order.
+
+    `items` is consumed lazily, so it can be a generator over a dataset that
+    doesn't fit in memory. The first exception raised by either stage, or by
+    `items`, stops the pipeline and is re-raised here.
+    """
+    queue_size = queue_size or 2 * grading_workers
+    if metrics is None:
+        metrics = PipelineMetrics(generation_workers, grading_workers, queue_size)
+
+    item_iterator = iter(items)
+    items_lock = threading.Lock()
+    handoff = queue.Queue(maxsize=queue_size)
+    results = queue.Queue()
+    stop = threading.Event()
+
+    def next_item():
+        with items_lock:
+            return next(item_iterator, _DONE)
+
+    def generation_worker():
+        while not stop.is_set():
+            try:
+                # A lazy dataset can raise here too, e.g. on a malformed line
+                item = next_item()
+                if item is _DONE:
+                    return
+                start = time.perf_counter()
+                output = generate(item)
+            except Exception as e:
+                results.put(_Failure(e))
+                stop.set()
+                return
+            metrics.generation.record(time.perf_counter() - start)
+            if not _put(handoff, (item, output), stop):
+                return
+            metrics.sample_queue(handoff)
+
+    def grading_worker():
+        while not stop.is_set():
+            try:
+                work = handoff.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if work is _DONE:
+                return
+            metrics.sample_queue(handoff)
+            item, output = work
+            start = time.perf_counter()
+            try:
+                result = grade(item, output)
+            except Exception as e:
+                results.put(_Failure(e))
+                stop.set()
+                return
+            metrics.grading.record(time.perf_counter() - start)
+            results.put(result)
+
+    generators = [
+        threading.Thread(target=generation_worker, daemon=True)
+        for _ in range(generation_workers)
+    ]
+    graders = [
+        threading.Thread(target=grading_worker, daemon=True)
+        for _ in range(grading_workers)
+    ]
+
+    def close_stages():
+        for thread in generators:
+            thread.join()
+        for _ in graders:
+            _put(handoff, _DONE, stop)
+        for thread in graders:
+            thread.join()
+        results.put(_DONE)
+
+    for thread in generators + graders:
+        thread.start()
+    threading.Thread(target=close_stages, daemon=True).start()
+
+    try:
+        while True:
+            result = results.get()
+            if result is _DONE:
+                return
+            if isinstance(result, _Failure):
+                raise result.error
+            yield result
+    finally:
+        stop.set()
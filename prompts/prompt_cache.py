@@ -0,0 +1,96 @@
+"""
+Prompt caching helpers.
+
+Large instructions that never change between calls (grading rubrics, few-shot
+examples) go into the system prompt with a `cache_control` breakpoint, and
+everything that varies per call goes after it, in the messages. Repeated calls
+then read the static prefix from the prompt cache instead of processing it
+again, which is cheaper and lowers time to first token.
+
+A prefix is only cached once it reaches the model's minimum cacheable length
+(for example 1024 tokens on Sonnet and 4096 on Haiku 4.5). The API silently
+ignores a breakpoint on a shorter prefix, so `cached_system(..., model=...)`
+leaves the breakpoint out when the blocks are estimated to fall short, and
+the prompt is sent uncached on purpose rather than by accident.
+
+`PromptCacheStats` tallies cached vs uncached input tokens from each
+response's usage, along with the latency of calls that did and didn't read
+from the cache.
+"""
+import threading
+
+# Minimum cacheable prefix in tokens, by model name prefix
+MIN_CACHEABLE_TOKENS = {
+    "claude-opus-4-5": 4096,
+    "claude-haiku-4-5": 4096,
+    "claude-3-5-haiku": 2048,
+    "claude-3-haiku": 2048,
+}
+# Sonnet, and Opus before 4.5
+DEFAULT_MIN_CACHEABLE_TOKENS = 1024
+
+
+def min_cacheable_tokens(model):
+    for prefix, minimum in MIN_CACHEABLE_TOKENS.items():
+        if model.startswith(prefix):
+            return minimum
+    return DEFAULT_MIN_CACHEABLE_TOKENS
+
+
+def _estimate_tokens(text):
+    """Rough token count (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+def cached_system(*blocks, model=None):
+    """System prompt blocks with a cache breakpoint after the last one. With
+    `model`, only if the blocks are estimated to reach its minimum cacheable
+    length"""
+    system = [{"type": "text", "text": text} for text in blocks]
+    if model is None or _estimate_tokens("".join(blocks)) >= min_cacheable_tokens(model):
+        system[-1]["cache_control"] = {"type": "ephemeral"}
+    return system
+
+
+class PromptCacheStats:
+    def __init__(self):
+        self.cache_read_tokens = 0
+        self.cache_write_tokens = 0
+        self.uncached_tokens = 0
+        # Number and total wall time of API calls that read from the cache,
+        # and of those that didn't
+        self.hits = 0
+        self.hit_time = 0.0
+        self.misses = 0
+        self.miss_time = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, usage, elapsed):
+        """Add one response's usage and the wall time of its API call"""
+        cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+        cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+        with self._lock:
+            self.cache_read_tokens += cache_read
+            self.cache_write_tokens += cache_write
+            self.uncached_tokens += usage.input_tokens
+            if cache_read:
+                self.hits += 1
+                self.hit_time += elapsed
+            else:
+                self.misses += 1
+                self.miss_time += elapsed
+
+    def summary(self):
+        total = self.cache_read_tokens + self.cache_write_tokens + self.uncached_tokens
+        cached_share = 100 * self.cache_read_tokens / total if total else 0
+        text = (
+            f"{self.cache_read_tokens} cached input tokens read, "
+            f"{self.cache_write_tokens} written, {self.uncached_tokens} uncached "
+            f"({cached_share:.0f}% of input read from cache)"
+        )
+        if self.hits and self.misses:
+            hit, miss = self.hit_time / self.hits, self.miss_time / self.misses
+            text += (
+                f"; avg latency {hit:.2f}s on cache hits vs {miss:.2f}s on misses"
+            )
+        return text
@@ -0,0 +1,388 @@
+"""
+Adaptive, rate-limit-aware scheduling for Messages API calls.
+
+`AdaptiveRateLimiter` sits in front of `client.messages.create` (and
+`.stream`) and keeps a run close to the account's rate limits without
+failing on them:
+
+* Requests-per-minute, input-tokens-per-minute and output-tokens-per-minute
+  budgets are tracked as token buckets. Budgets can be passed in, and are
+  otherwise learned from the `anthropic-ratelimit-*` response headers.
+* The number of requests in flight follows AIMD: it grows by one slot per
+  success until the first throttle (slow start), then by roughly one slot
+  per window of successful calls, and is halved on every 429/529.
+* A 429 pauses all callers until its `retry-after` has passed, then the
+  request is retried, so a single rate-limit error no longer aborts a run.
+
+The same limiter can be shared by threads (`create`, `stream`) and
+coroutines (`acreate`). Clients used with it should be created with
+`max_retries=0`, so the limiter sees every 429 instead of the SDK retrying
+them silently.
+"""
+import asyncio
+import collections
+import contextlib
+import json
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from anthropic import (
+    APIConnectionError,
+    InternalServerError,
+    OverloadedError,
+    RateLimitError,
+)
+
+# Response header prefix -> bucket name
+_HEADER_BUCKETS = {
+    "anthropic-ratelimit-requests": "requests",
+    "anthropic-ratelimit-input-tokens": "input_tokens",
+    "anthropic-ratelimit-output-tokens": "output_tokens",
+}
+
+
+class _TokenBucket:
+    """Budget of `capacity` units per minute, refilled continuously"""
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        if self.capacity is not None:
+            elapsed = now - self.updated
+            self.level = min(self.capacity, self.level + elapsed * self.capacity / 60)
+        self.updated = now
+
+    def seconds_until(self, amount):
+        if self.capacity is None:
+            return 0
+        # Never ask for more than a full bucket, or a huge request would wait forever
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0
+        return (amount - self.level) * 60 / self.capacity
+
+    def consume(self, amount):
+        if self.capacity is not None:
+            self.level -= amount
+
+    def set_capacity(self, capacity):
+        if self.capacity is None:
+            self.level = capacity
+        self.capacity = capacity
+
+
+def estimate_input_tokens(params):
+    """Cheap input token estimate (~4 characters per token) for budgeting"""
+    text = json.dumps(params.get("messages", [])) + json.dumps(params.get("system", ""))
+    return len(text) // 4 + 1
+
+
+def _retry_after_seconds(headers):
+    value = headers.get("retry-after") if headers else None
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def _set_done(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AdaptiveRateLimiter:
+    def __init__(
+        self,
+        requests_per_minute=None,
+        input_tokens_per_minute=None,
+        output_tokens_per_minute=None,
+        initial_concurrency=4,
+        min_concurrency=1,
+        max_concurrency=256,
+        max_retries=8,
+        on_retry=None,
+    ):
+        self._buckets = {
+            "requests": _TokenBucket(requests_per_minute),
+            "input_tokens": _TokenBucket(input_tokens_per_minute),
+            "output_tokens": _TokenBucket(output_tokens_per_minute),
+        }
+        # Budgets passed in explicitly win over the limits reported by the API
+        self._fixed_budgets = {
+            name for name, bucket in self._buckets.items() if bucket.capacity is not None
+        }
+        self.concurrency = float(initial_concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        # Called (with no arguments) from the retrying thread or task
+        self.on_retry = on_retry
+
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._slow_start = True
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self._cond = threading.Condition()
+        # (loop, future) of coroutines waiting for a free slot, woken from
+        # _release instead of polling
+        self._async_waiters = collections.deque()
+
+    # Scheduling
+
+    def _reserve(self, input_tokens, output_tokens):
+        """Reserve a slot and budget. Returns 0 on success, else seconds to wait.
+
+        Must be called with `self._cond` held. Returns None when the caller
+        should wait for another request to finish.
+        """
+        now = time.monotonic()
+        if self.paused_until > now:
+            return self.paused_until - now
+        if self.in_flight >= max(self.min_concurrency, int(self.concurrency)):
+            return None
+
+        for bucket in self._buckets.values():
+            bucket.refill(now)
+        wait = max(
+            self._buckets["requests"].seconds_until(1),
+            self._buckets["input_tokens"].seconds_until(input_tokens),
+            self._buckets["output_tokens"].seconds_until(output_tokens),
+        )
+        if wait > 0:
+            return wait
+
+        self._buckets["requests"].consume(1)
+        self._buckets["input_tokens"].consume(input_tokens)
+        self._buckets["output_tokens"].consume(output_tokens)
+        self.in_flight += 1
+        return 0
+
+    def _acquire(self, input_tokens, output_tokens):
+        with self._cond:
+            while True:
+                wait = self._reserve(input_tokens, output_tokens)
+                if wait == 0:
+                    return
+                self._cond.wait(timeout=wait)
+
+    async def _aacquire(self, input_tokens, output_tokens):
+        loop = asyncio.get_running_loop()
+        while True:
+            waiter = None
+            with self._cond:
+                wait = self._reserve(input_tokens, output_tokens)
+                if wait is None:
+                    waiter = (loop, loop.create_future())
+                    self._async_waiters.append(waiter)
+            if wait == 0:
+                return
+            if waiter is None:
+                await asyncio.sleep(wait)
+                continue
+            try:
+                await waiter[1]
+            except asyncio.CancelledError:
+                with self._cond:
+                    if waiter in self._async_waiters:
+                        self._async_waiters.remove(waiter)
+                    else:
+                        # Already woken: hand the wakeup on
+                        self._wake_async(1)
+                raise
+
+    def _wake_async(self, count=None):
+        """Wake `count` (None: all) waiting coroutines. Must be called with
+        `self._cond` held"""
+        if count is None:
+            count = len(self._async_waiters)
+        while count > 0 and self._async_waiters:
+            loop, future = self._async_waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(_set_done, future)
+            except RuntimeError:
+                continue  # its event loop is closed
+            count -= 1
+
+    def _notify(self):
+        """Wake every waiting thread and coroutine. Must be called with
+        `self._cond` held"""
+        self._cond.notify_all()
+        self._wake_async()
+
+    def _release(self, reserved_input, reserved_output, headers=None, usage=None):
+        with self._cond:
+            self.in_flight -= 1
+            self.requests += 1
+            if usage is not None:
+                # Settle the estimates against what the request actually used
+                actual_input = usage.input_tokens + (
+                    getattr(usage, "cache_creation_input_tokens", None) or 0
+                )
+                self._buckets["input_tokens"].consume(actual_input - reserved_input)
+                self._buckets["output_tokens"].consume(usage.output_tokens - reserved_output)
+
+                # Additive increase: +1 slot per success during slow start,
+                # afterwards about +1 slot per window of successful calls. Only
+                # grow when the window is actually full, otherwise it would
+                # drift far above what the callers ever use.
+                if self.in_flight + 1 >= int(self.concurrency):
+                    step = 1 if self._slow_start else 1 / max(self.concurrency, 1)
+                    self.concurrency = min(self.max_concurrency, self.concurrency + step)
+            if headers is not None:
+                self._sync_with_headers(headers)
+            self._cond.notify_all()
+            # One coroutine per free slot; the rest would only queue up again
+            self._wake_async(max(1, int(self.concurrency) - self.in_flight))
+
+    def _backoff(self, attempt, headers, throttled):
+        delay = _retry_after_seconds(headers)
+        if delay is None:
+            delay = min(60, 2**attempt) * (0.5 + random.random() / 2)
+        with self._cond:
+            if throttled:
+                self.throttled += 1
+                self._slow_start = False
+                now = time.monotonic()
+                # Multiplicative decrease, once per burst of 429s: requests that
+                # were already in flight when we paused don't halve it again
+                if now >= self.paused_until:
+                    self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+                # Everyone waits out a 429, not just the request that got it
+                self.paused_until = max(self.paused_until, now + delay)
+            self.retries += 1
+            self._notify()
+        if self.on_retry is not None:
+            self.on_retry()
+        return delay
+
+    def _sync_with_headers(self, headers):
+        for prefix, name in _HEADER_BUCKETS.items():
+            bucket = self._buckets[name]
+            limit = headers.get(f"{prefix}-limit")
+            if limit is not None and name not in self._fixed_budgets:
+                bucket.set_capacity(float(limit))
+            remaining = headers.get(f"{prefix}-remaining")
+            if remaining is not None and bucket.capacity is not None:
+                bucket.level = min(bucket.level, float(remaining))
+
+    # Public API
+
+    def ensure_concurrency(self, concurrency):
+        """Start with room for at least `concurrency` requests in flight (up
+        to max_concurrency), e.g. for an engine that keeps that many going.
+        Once a request has been throttled, the learned window is kept"""
+        with self._cond:
+            if self._slow_start:
+                target = min(self.max_concurrency, concurrency)
+                self.concurrency = max(self.concurrency, float(target))
+            self._notify()
+
+    def _open(self, request, input_tokens, output_tokens):
+        """Call `request()` in a reserved slot, retrying rate limits and
+        server errors. The slot is still held when it returns"""
+        for attempt in range(self.max_retries + 1):
+            self._acquire(input_tokens, output_tokens)
+            try:
+                return request()
+            except (RateLimitError, OverloadedError) as e:
+                self._release(input_tokens, output_tokens, e.response.headers)
+                if attempt == self.max_retries:
+                    raise
+                delay = self._backoff(attempt, e.response.headers, throttled=True)
+                time.sleep(delay)
+            except (InternalServerError, APIConnectionError) as e:
+                headers = getattr(getattr(e, "response", None), "headers", None)
+                self._release(input_tokens, output_tokens, headers)
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self._backoff(attempt, headers, throttled=False))
+            except BaseException:
+                self._release(input_tokens, output_tokens)
+                raise
+
+    def create(self, client, **params):
+        """Rate-limited `client.messages.create(**params)`"""
+        input_tokens = estimate_input_tokens(params)
+        output_tokens = params.get("max_tokens", 0)
+        raw = self._open(
+            lambda: client.messages.with_raw_response.create(**params),
+            input_tokens,
+            output_tokens,
+        )
+        return self._parse_and_release(raw, input_tokens, output_tokens)
+
+    def _parse_and_release(self, raw, input_tokens, output_tokens):
+        """Parse a raw response and release its slot, even if parsing fails"""
+        usage = None
+        try:
+            message = raw.parse()
+            usage = message.usage
+            return message
+        finally:
+            self._release(input_tokens, output_tokens, raw.headers, usage)
+
+    @contextlib.contextmanager
+    def stream(self, client, **params):
+        """Rate-limited `with client.messages.stream(**params) as stream:`.
+
+        Opening the stream is retried like create(); an error after the
+        response has started is raised to the caller. The slot is held until
+        the block exits, and settled against the final message's usage.
+        """
+        input_tokens = estimate_input_tokens(params)
+        output_tokens = params.get("max_tokens", 0)
+        manager = client.messages.stream(**params)
+        stream = self._open(manager.__enter__, input_tokens, output_tokens)
+        usage = None
+        try:
+            yield stream
+            usage = stream.get_final_message().usage
+        finally:
+            stream.close()
+            self._release(input_tokens, output_tokens, stream.response.headers, usage)
+
+    async def acreate(self, async_client, **params):
+        """Rate-limited `await async_client.messages.create(**params)`"""
+        input_tokens = estimate_input_tokens(params)
+        output_tokens = params.get("max_tokens", 0)
+
+        for attempt in range(self.max_retries + 1):
+            await self._aacquire(input_tokens, output_tokens)
+            try:
+                raw = await async_client.messages.with_raw_response.create(**params)
+            except (RateLimitError, OverloadedError) as e:
+                self._release(input_tokens, output_tokens, e.response.headers)
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self._backoff(attempt, e.response.headers, throttled=True))
+                continue
+            except (InternalServerError, APIConnectionError) as e:
+                headers = getattr(getattr(e, "response", None), "headers", None)
+                self._release(input_tokens, output_tokens, headers)
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self._backoff(attempt, headers, throttled=False))
+                continue
+            except BaseException:
+                self._release(input_tokens, output_tokens)
+                raise
+
+            return self._parse_and_release(raw, input_tokens, output_tokens)
+
+    def summary(self):
+        return (
+            f"{self.requests} requests, {self.throttled} rate limited, "
+            f"{self.retries} retries, concurrency now {self.concurrency:.1f}"
+        )
@@ -0,0 +1,372 @@
+"""
+HTML report for prompt evaluation results.
+
+`generate_prompt_evaluation_report` renders a list of results to a string.
+For large suites, `ReportWriter` streams rows to disk as results arrive,
+keeping only running totals for the summary, and can split the report into
+pages of `rows_per_page` rows.
+"""
+import os
+import tempfile
+from statistics import mean
+
+from result_log import iter_results
+
+
+def report_summary_stats(scores):
+    """Returns (total_tests, avg_score, pass_rate) for a list of scores"""
+    total_tests = len(scores)
+    avg_score = mean(scores) if scores else 0
+    pass_rate = (
+        100 * len([s for s in scores if s >= 7]) / total_tests if total_tests else 0
+    )
+    return total_tests, avg_score, pass_rate
+
+
+def report_header(
+    total_tests, avg_score, pass_rate, api_calls_html="", pages_html=""
+):
+    max_possible_score = 10
+    return f"""
+    <!DOCTYPE html>
+    <html lang="en">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <title>Prompt Evaluation Report</title>
+        <style>
+            body {{
+                font-family: Arial, sans-serif;
+                line-height: 1.6;
+                margin: 0;
+                padding: 20px;
+                color: #333;
+            }}
+            .header {{
+                background-color: #f0f0f0;
+                padding: 20px;
+                border-radius: 5px;
+                margin-bottom: 20px;
+            }}
+            .summary-stats {{
+                display: flex;
+                justify-content: space-between;
+                flex-wrap: wrap;
+                gap: 10px;
+            }}
+            .stat-box {{
+                background-color: #fff;
+                border-radius: 5px;
+                padding: 15px;
+                box-shadow: 0 2px 5px rgba(0,0,0,0.1);
+                flex-basis: 30%;
+                min-width: 200px;
+            }}
+            .stat-value {{
+                font-size: 24px;
+                font-weight: bold;
+                margin-top: 5px;
+            }}
+            table {{
+                width: 100%;
+                border-collapse: collapse;
+                margin-top: 20px;
+            }}
+            th {{
+                background-color: #4a4a4a;
+                color: white;
+                text-align: left;
+                padding: 12px;
+            }}
+            td {{
+                padding: 10px;
+                border-bottom: 1px solid #ddd;
+                vertical-align: top;
+            }}
+            tr:nth-child(even) {{
+                background-color: #f9f9f9;
+            }}
+            .output-cell {{
+                white-space: pre-wrap;
+            }}
+            .score {{
+                font-weight: bold;
+                padding: 5px 10px;
+                border-radius: 3px;
+                display: inline-block;
+            }}
+            .score-high {{
+                background-color: #c8e6c9;
+                color: #2e7d32;
+            }}
+            .score-medium {{
+                background-color: #fff9c4;
+                color: #f57f17;
+            }}
+            .score-low {{
+                background-color: #ffcdd2;
+                color: #c62828;
+            }}
+            .output {{
+                overflow: auto;
+                white-space: pre-wrap;
+            }}
+
+            .output pre {{
+                background-color: #f5f5f5;
+                border: 1px solid #ddd;
+                border-radius: 4px;
+                padding: 10px;
+                margin: 0;
+                font-family: 'Consolas', 'Monaco', 'Courier New', monospace;
+                font-size: 14px;
+                line-height: 1.4;
+                color: #333;
+                box-shadow: inset 0 1px 3px rgba(0, 0, 0, 0.1);
+                overflow-x: auto;
+                white-space: pre-wrap; 
+                word-wrap: break-word; 
+            }}
+
+            td {{
+                width: 20%;
+            }}
+            .score-col {{
+                width: 80px;
+            }}
+        </style>
+    </head>
+    <body>
+        <div class="header">
+            <h1>Prompt Evaluation Report</h1>
+            <div class="summary-stats">
+                <div class="stat-box">
+                    <div>Total Test Cases</div>
+                    <div class="stat-value">{total_tests}</div>
+                </div>
+                <div class="stat-box">
+                    <div>Average Score</div>
+                    <div class="stat-value">{avg_score:.1f} / {max_possible_score}</div>
+                </div>
+                <div class="stat-box">
+                    <div>Pass Rate (≥7)</div>
+                    <div class="stat-value">{pass_rate:.1f}%</div>
+                </div>
+            </div>
+        </div>
+{api_calls_html}{pages_html}
+        <table>
+            <thead>
+                <tr>
+                    <th>Scenario</th>
+                    <th>Prompt Inputs</th>
+                    <th>Solution Criteria</th>
+                    <th>Output</th>
+                    <th>Score</th>
+                    <th>Reasoning</th>
+                </tr>
+            </thead>
+            <tbody>
+    """
+
+
+def report_row(result):
+    prompt_inputs_html = "<br>".join(
+        [
+            f"<strong>{key}:</strong> {value}"
+            for key, value in result["test_case"]["prompt_inputs"].items()
+        ]
+    )
+
+    criteria_string = "<br>• ".join(result["test_case"]["solution_criteria"])
+
+    score = result["score"]
+    if score >= 8:
+        score_class = "score-high"
+    elif score <= 5:
+        score_class = "score-low"
+    else:
+        score_class = "score-medium"
+
+    return f"""
+            <tr>
+                <td>{result["test_case"]["scenario"]}</td>
+                <td class="prompt-inputs">{prompt_inputs_html}</td>
+                <td class="criteria">• {criteria_string}</td>
+                <td class="output"><pre>{result["output"]}</pre></td>
+                <td class="score-col"><span class="score {score_class}">{score}</span></td>
+                <td class="reasoning">{result["reasoning"]}</td>
+            </tr>
+        """
+
+
+def report_api_calls(site_summaries):
+    """Per call site latency and token table for the report header"""
+    if not site_summaries:
+        return ""
+
+    def seconds(value):
+        return "-" if value is None else f"{value:.2f}s"
+
+    rows = "".join(
+        f"""
+                <tr>
+                    <td>{site}</td>
+                    <td>{s["calls"]} ({s["retries"]} retries, {s["errors"]} errors)</td>
+                    <td>{seconds(s["latency_p50"])} / {seconds(s["latency_p95"])} / {seconds(s["latency_p99"])}</td>
+                    <td>{seconds(s["ttft_p50"])} / {seconds(s["ttft_p95"])} / {seconds(s["ttft_p99"])}</td>
+                    <td>{s["input_tokens"]} / {s["output_tokens"]} / {s["cache_read_tokens"]}</td>
+                    <td>{", ".join(f"{reason}: {count}" for reason, count in s["stop_reasons"].items())}</td>
+                </tr>"""
+        for site, s in site_summaries.items()
+    )
+    return f"""
+        <h2>API Calls</h2>
+        <table class="api-calls">
+            <thead>
+                <tr>
+                    <th>Call Site</th>
+                    <th>Calls</th>
+                    <th>Latency p50 / p95 / p99</th>
+                    <th>TTFT p50 / p95 / p99</th>
+                    <th>Tokens in / out / cached</th>
+                    <th>Stop Reasons</th>
+                </tr>
+            </thead>
+            <tbody>{rows}
+            </tbody>
+        </table>
+    """
+
+
+REPORT_FOOTER = """
+            </tbody>
+        </table>
+    </body>
+    </html>
+    """
+
+
+def generate_prompt_evaluation_report(evaluation_results):
+    scores = [result["score"] for result in evaluation_results]
+    parts = [report_header(*report_summary_stats(scores))]
+    parts.extend(report_row(result) for result in evaluation_results)
+    parts.append(REPORT_FOOTER)
+    return "".join(parts)
+
+
+class ReportWriter:
+    """Streams report rows to disk and assembles the report on close.
+
+    Rows go to a temporary body file as they are added, while the summary
+    stats are kept as running totals. The header needs those totals, so it
+    is written, followed by a copy of the body, when the writer is closed.
+    With `rows_per_page`, the report is split into `report.html`,
+    `report-2.html`, `report-3.html`, ... with links between the pages.
+    """
+
+    def __init__(self, html_output_file, rows_per_page=None, site_summaries=None):
+        self.html_output_file = html_output_file
+        self.rows_per_page = rows_per_page
+        self.site_summaries = site_summaries
+        self.total_tests = 0
+        self.score_sum = 0
+        self.passed = 0
+        # Byte offset in the body file where each page starts
+        self._page_starts = [0]
+        self._body = tempfile.TemporaryFile(
+            dir=os.path.dirname(os.path.abspath(html_output_file))
+        )
+
+    def add(self, result):
+        if (
+            self.rows_per_page
+            and self.total_tests
+            and self.total_tests % self.rows_per_page == 0
+        ):
+            self._page_starts.append(self._body.tell())
+        self._body.write(report_row(result).encode("utf-8"))
+        self.total_tests += 1
+        self.score_sum += result["score"]
+        if result["score"] >= 7:
+            self.passed += 1
+
+    @property
+    def average_score(self):
+        return self.score_sum / self.total_tests if self.total_tests else 0
+
+    @property
+    def pass_rate(self):
+        return 100 * self.passed / self.total_tests if self.total_tests else 0
+
+    def page_files(self):
+        root, ext = os.path.splitext(self.html_output_file)
+        return [self.html_output_file] + [
+            f"{root}-{page}{ext}" for page in range(2, len(self._page_starts) + 1)
+        ]
+
+    def _pages_html(self, page):
+        if len(self._page_starts) == 1:
+            return ""
+        links = " ".join(
+            f"<strong>{number}</strong>"
+            if number == page
+            else f'<a href="{os.path.basename(path)}">{number}</a>'
+            for number, path in enumerate(self.page_files(), start=1)
+        )
+        first = (page - 1) * self.rows_per_page + 1
+        last = min(page * self.rows_per_page, self.total_tests)
+        return f"""
+        <div class="pages">Rows {first}-{last} of {self.total_tests}. Page: {links}</div>
+    """
+
+    def close(self):
+        if self._body.closed:
+            return
+        api_calls_html = report_api_calls(self.site_summaries)
+
+        page_ends = self._page_starts[1:] + [self._body.tell()]
+        for page, (path, start, end) in enumerate(
+            zip(self.page_files(), self._page_starts, page_ends), start=1
+        ):
+            header = report_header(
+                self.total_tests,
+                self.average_score,
+                self.pass_rate,
+                api_calls_html,
+                self._pages_html(page),
+            )
+            with open(path, "wb") as f:
+                f.write(header.encode("utf-8"))
+                self._body.seek(start)
+                _copy_bytes(self._body, f, end - start)
+                f.write(REPORT_FOOTER.encode("utf-8"))
+        self._body.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _copy_bytes(source, target, length, chunk_size=1024 * 1024):
+    while length > 0:
+        chunk = source.read(min(chunk_size, length))
+        if not chunk:
+            break
+        target.write(chunk)
+        length -= len(chunk)
+
+
+def write_prompt_evaluation_report(
+    results_jsonl_file, html_output_file, site_summaries=None, rows_per_page=None
+):
+    """Write the HTML report from a JSONL results file in a single pass,
+    without loading it into memory. `site_summaries` (from CallMetrics) adds
+    an API call metrics table; `rows_per_page` splits it into pages.
+    Returns the closed ReportWriter, for its summary stats and page files."""
+    with ReportWriter(html_output_file, rows_per_page, site_summaries) as writer:
+        for result in iter_results(results_jsonl_file):
+            writer.add(result)
+    return writer
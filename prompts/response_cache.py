@@ -0,0 +1,180 @@
+"""
+Persistent, content-addressed cache for Messages API responses.
+
+Responses are stored in a SQLite file, keyed by a SHA-256 hash of the request
+fields that determine the answer (model, system, messages, temperature,
+stop_sequences, max_tokens, tools). Re-running an eval after a small prompt
+change then only pays for the requests that actually changed.
+
+The cache is bounded by `max_size_bytes` and evicts least recently used
+entries first. With `deterministic_only=True` (the default) only
+`temperature=0` requests are cached, since sampled responses are supposed to
+vary between runs.
+
+A hit only reads the database: its new last-used time is kept in memory and
+written with the next `put`, every `flush_every` hits, or on `flush()` /
+`close()`, so hits don't each pay for a committed write.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from anthropic.types import Message
+
+KEY_FIELDS = (
+    "model",
+    "system",
+    "messages",
+    "temperature",
+    "stop_sequences",
+    "max_tokens",
+    "tools",
+)
+
+
+def cache_key(params):
+    """Hash of the request fields that determine the response"""
+    keyed = {field: params.get(field) for field in KEY_FIELDS}
+    canonical = json.dumps(keyed, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        path="response_cache.sqlite3",
+        max_size_bytes=256 * 1024 * 1024,
+        deterministic_only=True,
+        enabled=True,
+        flush_every=256,
+    ):
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        self.deterministic_only = deterministic_only
+        self.enabled = enabled
+        self.flush_every = flush_every
+        # key -> last-used time of hits not yet written
+        self._touched = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self._size = 0
+
+    def _connect(self):
+        # Opened lazily, so importing a module that creates a cache is free
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )
+                """
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)"
+            )
+            self._size = self._db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()[0]
+        return self._db
+
+    def cacheable(self, params):
+        if not self.enabled:
+            return False
+        return not self.deterministic_only or params.get("temperature") == 0
+
+    def get(self, params):
+        """Return the cached Message for a request, or None"""
+        if not self.cacheable(params):
+            return None
+
+        key = cache_key(params)
+        with self._lock:
+            db = self._connect()
+            row = db.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._touched[key] = time.time()
+            if len(self._touched) >= self.flush_every:
+                self._write_touched(db)
+                db.commit()
+            self.hits += 1
+        return Message.model_validate_json(row[0])
+
+    def _write_touched(self, db):
+        if self._touched:
+            db.executemany(
+                "UPDATE responses SET last_used = ? WHERE key = ?",
+                [(used, key) for key, used in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def flush(self):
+        """Write the last-used times of recent hits"""
+        with self._lock:
+            if self._db is not None and self._touched:
+                self._write_touched(self._db)
+                self._db.commit()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def put(self, params, message):
+        if not self.cacheable(params):
+            return
+
+        key = cache_key(params)
+        response = message.model_dump_json()
+        size = len(response)
+        with self._lock:
+            db = self._connect()
+            previous = db.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            db.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time()),
+            )
+            self._size += size - (previous[0] if previous else 0)
+            # Evict by up-to-date last-used times
+            self._write_touched(db)
+            self._evict(db)
+            db.commit()
+
+    def _evict(self, db):
+        while self._size > self.max_size_bytes:
+            rows = db.execute(
+                "SELECT key, size FROM responses ORDER BY last_used LIMIT 64"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._size -= size
+                self.evictions += 1
+                if self._size <= self.max_size_bytes:
+                    break
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        hit_rate = 100 * self.hits / lookups if lookups else 0
+        return (
+            f"{self.hits} hits, {self.misses} misses ({hit_rate:.0f}% hit rate), "
+            f"{self.evictions} evictions"
+        )
@@ -0,0 +1,131 @@
+"""
+Crash-safe, streaming storage for evaluation results.
+
+Results are appended to a JSONL file (one JSON object per line) as soon as
+they are produced. Every line is flushed to the OS immediately and the file
+is fsync'ed in batches, so a crash loses at most the result being written,
+and a resumed run can skip everything already in the file.
+
+The final `output.json` is derived from the JSONL stream one result at a
+time, so neither the run nor the export holds every result in memory.
+"""
+import json
+import os
+import textwrap
+import time
+
+
+class JsonlResultWriter:
+    """Append-only JSONL writer with batched fsync. Use from a single thread."""
+
+    def __init__(self, path, append=False, fsync_every=50, fsync_interval=1.0):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        if append:
+            _drop_partial_last_line(path)
+        self._file = open(path, "a" if append else "w", encoding="utf-8")
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def write(self, result):
+        self._file.write(json.dumps(result) + "\n")
+        self._file.flush()
+        self._unsynced += 1
+        if (
+            self._unsynced >= self.fsync_every
+            or time.monotonic() - self._last_sync >= self.fsync_interval
+        ):
+            self.sync()
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _drop_partial_last_line(path):
+    """Truncate a line left half-written by a crash, so appends start clean"""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+
+        # Walk back to the last complete line
+        position = size
+        while position > 0:
+            step = min(4096, position)
+            position -= step
+            f.seek(position)
+            newline = f.read(step).rfind(b"\n")
+            if newline != -1:
+                f.truncate(position + newline + 1)
+                return
+        f.truncate(0)
+
+
+def iter_results(path):
+    """Yield results from a JSONL file one at a time, skipping a truncated last line"""
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                # Half-written by a crash
+                break
+            if line.strip():
+                yield json.loads(line)
+
+
+def logged_fingerprints(path):
+    """Fingerprints of the results already in a JSONL file"""
+    return {
+        result["fingerprint"] for result in iter_results(path) if "fingerprint" in result
+    }
+
+
+def prune_results(path, fingerprints):
+    """Rewrite a JSONL file without the results whose fingerprint is not in
+    `fingerprints`. Returns how many were dropped"""
+    tmp_path = f"{path}.tmp"
+    dropped = 0
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for result in iter_results(path):
+            if "fingerprint" in result and result["fingerprint"] not in fingerprints:
+                dropped += 1
+                continue
+            f.write(json.dumps(result) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return dropped
+
+
+def write_json_array(results, path):
+    """Stream results into a JSON array, formatted like json.dump(..., indent=2)"""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[")
+        separator = "\n"
+        for result in results:
+            f.write(separator)
+            f.write(textwrap.indent(json.dumps(result, indent=2), "  "))
+            separator = ",\n"
+        f.write("\n]" if separator == ",\n" else "]")
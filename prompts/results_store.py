@@ -0,0 +1,399 @@
+"""
+Columnar history of evaluation runs.
+
+Every run rewrites output.json, so comparing prompt versions means loading
+several large JSON files, output text and all. `ResultsStore` appends the
+per-case numbers of each run to a directory of column files instead, and
+answers the usual questions without touching output text:
+
+    store = ResultsStore("results_store")
+    store.append_run(iter_results("output.jsonl"), prompt_fingerprint)
+    store.regressions()   # scenarios that scored lower than in the previous run
+    store.by_prompt()     # average score, latency and tokens per prompt version
+    store.worst(10)       # the lowest-scoring cases of every run
+
+Each column is a file of fixed-width values in native byte order: the
+scenario as an int32 code into scenarios.jsonl, and the score, latency,
+input and output tokens as float64, NaN where a result didn't record them.
+A run is appended as contiguous rows, so the run id and prompt fingerprint
+aren't repeated per row; runs.jsonl holds each run's first row and row
+count. Queries memory-map just the columns they use. With NumPy installed
+they are vectorized over the mapped files; without it the same queries run
+element by element over memoryviews of them.
+
+A run's column rows are fsync'ed before its line in runs.jsonl is written,
+and only runs listed there are read, so rows left by an append that crashed
+half-way are ignored and then overwritten. Appends are meant for one process
+at a time; `refresh()` picks up runs another process has appended.
+
+    python prompts/results_store.py --store results_store regressions --min-drop 2
+"""
+import argparse
+import array
+import bisect
+import heapq
+import json
+import math
+import mmap
+import os
+import time
+import uuid
+
+from result_log import JsonlResultWriter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Column -> array typecode
+COLUMNS = {
+    "scenario": "i",
+    "score": "d",
+    "latency": "d",
+    "input_tokens": "d",
+    "output_tokens": "d",
+}
+_NUMPY_TYPES = {"i": "=i4", "d": "=f8"}
+# Columns a result may not have
+_OPTIONAL = ("latency", "input_tokens", "output_tokens")
+
+
+def scenario_key(test_case):
+    """What identifies a test case across runs: its scenario, else its task,
+    else the whole test case"""
+    for key in ("scenario", "task"):
+        if isinstance(test_case.get(key), str):
+            return test_case[key]
+    return json.dumps(test_case, sort_keys=True)
+
+
+def _read_jsonl(path):
+    """Complete lines of a JSONL file; a line cut off by a crash is skipped"""
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.endswith("\n")]
+
+
+def _value(value):
+    return None if math.isnan(value) else value
+
+
+class ResultsStore:
+    def __init__(self, path="results_store"):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.refresh()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def refresh(self):
+        """Re-read the runs and scenarios, e.g. after another process appended"""
+        self._runs = _read_jsonl(self._file("runs.jsonl"))
+        self._starts = [run["start"] for run in self._runs]
+        self.rows = self._runs[-1]["start"] + self._runs[-1]["rows"] if self._runs else 0
+        self._scenarios = _read_jsonl(self._file("scenarios.jsonl"))
+        self._codes = {scenario: code for code, scenario in enumerate(self._scenarios)}
+        self._columns = {}
+
+    def runs(self):
+        return [dict(run) for run in self._runs]
+
+    def append_run(self, results, prompt_fingerprint, label=None):
+        """Append a run's results (dicts as in output.jsonl). Returns the new
+        run id, or None if there were no results"""
+        columns = {name: array.array(typecode) for name, typecode in COLUMNS.items()}
+        added = {}
+        for result in results:
+            scenario = scenario_key(result["test_case"])
+            code = self._codes.get(scenario)
+            if code is None:
+                code = added.setdefault(scenario, len(self._scenarios) + len(added))
+            columns["scenario"].append(code)
+            columns["score"].append(float(result["score"]))
+            for name in _OPTIONAL:
+                value = result.get(name)
+                columns[name].append(math.nan if value is None else float(value))
+        rows = len(columns["score"])
+        if not rows:
+            return None
+
+        if added:
+            with JsonlResultWriter(self._file("scenarios.jsonl"), append=True) as writer:
+                for scenario in added:
+                    writer.write(scenario)
+        for name, values in columns.items():
+            with open(self._file(f"{name}.col"), "ab") as f:
+                # Drop rows a crashed append left behind
+                f.truncate(self.rows * values.itemsize)
+                values.tofile(f)
+                f.flush()
+                os.fsync(f.fileno())
+
+        run = {
+            "run_id": f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}",
+            "prompt_fingerprint": prompt_fingerprint,
+            "label": label,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "start": self.rows,
+            "rows": rows,
+            "average_score": sum(columns["score"]) / rows,
+        }
+        with JsonlResultWriter(self._file("runs.jsonl"), append=True) as writer:
+            writer.write(run)
+
+        self._runs.append(run)
+        self._starts.append(run["start"])
+        self.rows += rows
+        for scenario, code in added.items():
+            self._scenarios.append(scenario)
+            self._codes[scenario] = code
+        self._columns = {}
+        return run["run_id"]
+
+    def _column(self, name):
+        """The rows of every listed run in one column, memory-mapped"""
+        column = self._columns.get(name)
+        if column is None:
+            typecode = COLUMNS[name]
+            size = self.rows * array.array(typecode).itemsize
+            if size == 0:
+                mapped = b""
+            else:
+                with open(self._file(f"{name}.col"), "rb") as f:
+                    mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            if np is not None:
+                column = np.frombuffer(mapped, dtype=_NUMPY_TYPES[typecode])
+            else:
+                column = memoryview(mapped).cast(typecode)
+            self._columns[name] = column
+        return column
+
+    def _run(self, run):
+        """A run by id, or by index (-1: the latest)"""
+        if isinstance(run, int):
+            if -len(self._runs) <= run < len(self._runs):
+                return self._runs[run]
+        else:
+            for entry in self._runs:
+                if entry["run_id"] == run:
+                    return entry
+        raise KeyError(f"No run {run!r} in {self.path} ({len(self._runs)} runs)")
+
+    def _row(self, row):
+        run = self._runs[bisect.bisect_right(self._starts, row) - 1]
+        return {
+            "run_id": run["run_id"],
+            "prompt_fingerprint": run["prompt_fingerprint"],
+            # Position of the result in that run's results
+            "index": row - run["start"],
+            "scenario": self._scenarios[self._column("scenario")[row]],
+            "score": float(self._column("score")[row]),
+            **{name: _value(float(self._column(name)[row])) for name in _OPTIONAL},
+        }
+
+    def _scenario_means(self, run):
+        """(scenario codes, average scores) of the scenarios in `run`"""
+        start, stop = run["start"], run["start"] + run["rows"]
+        codes = self._column("scenario")[start:stop]
+        scores = self._column("score")[start:stop]
+        if np is not None:
+            counts = np.bincount(codes, minlength=len(self._scenarios))
+            sums = np.bincount(codes, weights=scores, minlength=len(self._scenarios))
+            present = np.flatnonzero(counts)
+            return present, sums[present] / counts[present]
+        totals = {}
+        for code, score in zip(codes, scores):
+            total = totals.setdefault(code, [0.0, 0])
+            total[0] += score
+            total[1] += 1
+        present = sorted(totals)
+        return present, [totals[code][0] / totals[code][1] for code in present]
+
+    def regressions(self, before=-2, after=-1, min_drop=1.0):
+        """Scenarios whose average score in run `after` is at least `min_drop`
+        lower than in run `before`, biggest drop first"""
+        before_codes, before_scores = self._scenario_means(self._run(before))
+        after_codes, after_scores = self._scenario_means(self._run(after))
+        if np is not None:
+            _, before_at, after_at = np.intersect1d(
+                before_codes, after_codes, assume_unique=True, return_indices=True
+            )
+            old, new = before_scores[before_at], after_scores[after_at]
+            dropped = np.flatnonzero(new - old <= -min_drop)
+            dropped = dropped[np.lexsort((dropped, new[dropped] - old[dropped]))]
+            found = zip(
+                before_codes[before_at[dropped]].tolist(),
+                old[dropped].tolist(),
+                new[dropped].tolist(),
+            )
+        else:
+            old_scores = dict(zip(before_codes, before_scores))
+            found = [
+                (code, old_scores[code], score)
+                for code, score in zip(after_codes, after_scores)
+                if code in old_scores and score - old_scores[code] <= -min_drop
+            ]
+            found.sort(key=lambda item: item[2] - item[1])
+        return [
+            {
+                "scenario": self._scenarios[code],
+                "before": old,
+                "after": new,
+                "change": new - old,
+            }
+            for code, old, new in found
+        ]
+
+    def scenario_history(self, scenario):
+        """Every result for `scenario`, oldest run first"""
+        code = self._codes.get(scenario)
+        if code is None:
+            return []
+        codes = self._column("scenario")
+        if np is not None:
+            rows = np.flatnonzero(codes == code).tolist()
+        else:
+            rows = [row for row, value in enumerate(codes) if value == code]
+        return [self._row(row) for row in rows]
+
+    def _run_totals(self, name):
+        """(sum, count) of the non-NaN values in column `name`, per run"""
+        column = self._column(name)
+        if not self._runs:
+            return []
+        if np is not None:
+            present = ~np.isnan(column)
+            sums = np.add.reduceat(np.where(present, column, 0.0), self._starts)
+            counts = np.add.reduceat(present, self._starts, dtype=np.int64)
+            return list(zip(sums.tolist(), counts.tolist()))
+        totals = []
+        for run in self._runs:
+            values = [
+                value
+                for value in column[run["start"] : run["start"] + run["rows"]]
+                if not math.isnan(value)
+            ]
+            totals.append((sum(values), len(values)))
+        return totals
+
+    def by_prompt(self):
+        """Per prompt fingerprint, in order of first run: runs, cases, and the
+        average score, latency and tokens of its cases"""
+        names = ("score",) + _OPTIONAL
+        run_totals = {name: self._run_totals(name) for name in names}
+        prompts = {}
+        for index, run in enumerate(self._runs):
+            prompt = prompts.setdefault(
+                run["prompt_fingerprint"],
+                {
+                    "prompt_fingerprint": run["prompt_fingerprint"],
+                    "label": None,
+                    "runs": 0,
+                    "cases": 0,
+                    "first_run": run["run_id"],
+                    "totals": {name: [0.0, 0] for name in names},
+                },
+            )
+            prompt["label"] = run["label"] or prompt["label"]
+            prompt["runs"] += 1
+            prompt["cases"] += run["rows"]
+            prompt["last_run"] = run["run_id"]
+            for name in names:
+                total, count = run_totals[name][index]
+                prompt["totals"][name][0] += total
+                prompt["totals"][name][1] += count
+        for prompt in prompts.values():
+            for name, (total, count) in prompt.pop("totals").items():
+                prompt[f"average_{name}"] = total / count if count else None
+        return list(prompts.values())
+
+    def worst(self, n=10, run=None):
+        """The `n` lowest-scoring results of `run`, or of every run; ties go
+        to the earlier result"""
+        if run is None:
+            start, stop = 0, self.rows
+        else:
+            entry = self._run(run)
+            start, stop = entry["start"], entry["start"] + entry["rows"]
+        scores = self._column("score")[start:stop]
+        n = min(n, len(scores))
+        if n <= 0:
+            return []
+        if np is not None:
+            cutoff = np.partition(scores, n - 1)[n - 1]
+            below = np.flatnonzero(scores < cutoff)
+            picked = np.concatenate([below, np.flatnonzero(scores == cutoff)[: n - len(below)]])
+            rows = picked[np.lexsort((picked, scores[picked]))].tolist()
+        else:
+            rows = heapq.nsmallest(n, range(len(scores)), key=lambda row: (scores[row], row))
+        return [self._row(start + row) for row in rows]
+
+    def summary(self):
+        return f"{len(self._runs)} runs, {self.rows} results, {len(self._scenarios)} scenarios"
+
+
+def _format(value, spec):
+    return "n/a" if value is None else format(value, spec)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the history of evaluation runs")
+    parser.add_argument("--store", default="results_store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("runs", help="list the runs")
+    commands.add_parser("prompts", help="averages per prompt fingerprint")
+    regressions = commands.add_parser(
+        "regressions", help="scenarios that scored lower in one run than in another"
+    )
+    regressions.add_argument("--before", default="-2", help="run id or index")
+    regressions.add_argument("--after", default="-1", help="run id or index")
+    regressions.add_argument("--min-drop", type=float, default=1.0)
+    worst = commands.add_parser("worst", help="the lowest-scoring results")
+    worst.add_argument("-n", type=int, default=10)
+    worst.add_argument("--run", help="run id or index (default: every run)")
+    history = commands.add_parser("history", help="every result for one scenario")
+    history.add_argument("scenario")
+    args = parser.parse_args()
+
+    def run_arg(text):
+        return int(text) if text.lstrip("-").isdigit() else text
+
+    store = ResultsStore(args.store)
+    print(store.summary())
+    if args.command == "runs":
+        for run in store.runs():
+            print(
+                f"  {run['run_id']}  {run['prompt_fingerprint'][:12]}  "
+                f"{run['rows']:7} cases  average {run['average_score']:.2f}  {run['label'] or ''}".rstrip()
+            )
+    elif args.command == "prompts":
+        for prompt in store.by_prompt():
+            print(
+                f"  {prompt['prompt_fingerprint'][:12]}  {prompt['runs']:3} runs "
+                f"{prompt['cases']:8} cases  score {_format(prompt['average_score'], '.2f')}  "
+                f"latency {_format(prompt['average_latency'], '.2f')}s  "
+                f"tokens {_format(prompt['average_input_tokens'], '.0f')} in / "
+                f"{_format(prompt['average_output_tokens'], '.0f')} out  {prompt['label'] or ''}".rstrip()
+            )
+    elif args.command == "regressions":
+        found = store.regressions(run_arg(args.before), run_arg(args.after), args.min_drop)
+        print(f"{len(found)} scenarios dropped by {args.min_drop} or more")
+        for item in found:
+            print(f"  {item['before']:5.2f} -> {item['after']:5.2f}  {item['scenario']}")
+    else:
+        if args.command == "worst":
+            rows = store.worst(args.n, run_arg(args.run) if args.run else None)
+        else:
+            rows = store.scenario_history(args.scenario)
+        for row in rows:
+            print(
+                f"  {row['score']:5.2f}  {row['run_id']} #{row['index']:<6} "
+                f"latency {_format(row['latency'], '.2f')}s  {row['scenario']}"
+            )
+
+
+if __name__ == "__main__":
+    main()
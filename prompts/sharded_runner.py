@@ -0,0 +1,428 @@
+"""
+Runs an evaluation split into shards, across processes or hosts.
+
+One PromptEvaluator is one process, so a machine's CPU and connections cap
+how fast it gets through a suite. `ShardedRunner` splits the dataset into
+shard files and runs them in worker processes, then merges the per-shard
+results into one output.jsonl, output.json, output.html and
+(if asked for) metrics.json, with the summary stats and API call percentiles
+computed over every case:
+
+    runner = ShardedRunner("eval_shards")
+    runner.split("dataset.json", num_shards=16)
+    runner.run("my_eval.py:run_shard", workers=8)
+    runner.merge(metrics_output_file="metrics.json")
+
+The worker is named as "module:function" or "path/to/file.py:function" so
+the worker processes can import it. Each process imports it once and calls
+it for every shard it claims, as
+`run_shard(shard_dataset_file, output_dir)` and must write its results to
+output.jsonl in `output_dir`, and may write its API calls to calls.jsonl:
+PromptEvaluator.run_evaluation_shard in 007 does both.
+
+The work directory is the queue. A shard is claimed by renaming its marker
+from queue/pending to queue/running, which only one worker can do, so other
+hosts that share the directory (e.g. over NFS) can take shards too:
+
+    python prompts/sharded_runner.py work eval_shards my_eval.py:run_shard --workers 8
+
+A running shard's marker is touched every `heartbeat_interval` seconds; one
+left untouched for `stale_after` seconds belongs to a worker that died, and
+is put back in the queue. A shard that raises, or whose process dies, is
+retried on its own, up to `max_attempts` times, and keeps the results its
+failed attempts wrote. Shards that still fail are left in queue/failed,
+with the error, for `retry_failed()`. A worker process that dies before
+claiming a shard, e.g. because the worker can't be imported, stops the run.
+Each process has its own rate limiter, so they back off independently when
+the account's rate limits are reached.
+"""
+import argparse
+import contextlib
+import importlib
+import importlib.util
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import socket
+import sys
+import threading
+import time
+import traceback
+
+from dataset_loader import load_dataset
+from instrumentation import CallMetrics
+from report import write_prompt_evaluation_report
+from result_log import JsonlResultWriter, iter_results, write_json_array
+
+# What a shard's worker writes to its output directory
+SHARD_RESULTS_FILE = "output.jsonl"
+SHARD_CALLS_FILE = "calls.jsonl"
+
+STATES = ("pending", "running", "done", "failed")
+_MARKER = re.compile(r"(shard-\d+)\.(\d+)$")
+
+
+def load_callable(spec):
+    """The function named by "module:function" or "path/to/file.py:function" """
+    module_name, _, function_name = spec.rpartition(":")
+    if not module_name or not function_name:
+        raise ValueError(f"Expected 'module:function', got {spec!r}")
+    if module_name.endswith(".py"):
+        path = os.path.abspath(module_name)
+        # Lets the file import its neighbours, as when run as a script
+        if os.path.dirname(path) not in sys.path:
+            sys.path.insert(0, os.path.dirname(path))
+        name = os.path.splitext(os.path.basename(path))[0]
+        module_spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(module_spec)
+        sys.modules[name] = module
+        module_spec.loader.exec_module(module)
+    else:
+        module = importlib.import_module(module_name)
+    return getattr(module, function_name)
+
+
+def _worker_process(runner, worker_spec, worker_id):
+    """Claim and run shards until none are pending. Each shard's output is
+    logged to log.txt in its output directory"""
+    run_shard = load_callable(worker_spec)
+    while True:
+        claimed = runner.claim(worker_id)
+        if claimed is None:
+            return
+        shard, attempt, name = claimed
+        output_dir = runner.output_dir(shard)
+        error = None
+        with open(os.path.join(output_dir, "log.txt"), "a") as log:
+            with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+                try:
+                    run_shard(os.path.abspath(runner.shard_file(shard)), output_dir)
+                except Exception:
+                    error = traceback.format_exc()
+                    log.write(error)
+        runner.release(shard, attempt, name, error)
+
+
+class ShardedRunner:
+    def __init__(
+        self,
+        work_dir="eval_shards",
+        max_attempts=3,
+        heartbeat_interval=5.0,
+        stale_after=60.0,
+        poll_interval=1.0,
+    ):
+        self.work_dir = work_dir
+        self.max_attempts = max_attempts
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+        self.elapsed = None
+
+    def _path(self, *parts):
+        return os.path.join(self.work_dir, *parts)
+
+    def _marker(self, state, name):
+        return self._path("queue", state, name)
+
+    def shard_file(self, shard):
+        return self._path("shards", f"{shard}.json")
+
+    def output_dir(self, shard):
+        return self._path("results", shard)
+
+    def manifest(self):
+        with open(self._path("manifest.json")) as f:
+            return json.load(f)
+
+    def split(self, dataset_file, num_shards):
+        """Split a dataset into `num_shards` contiguous shards and queue
+        them, replacing any earlier run in the work directory"""
+        dataset = list(load_dataset(dataset_file))
+        num_shards = max(1, min(num_shards, len(dataset)))
+
+        for name in ("queue", "shards", "results"):
+            shutil.rmtree(self._path(name), ignore_errors=True)
+        for state in STATES:
+            os.makedirs(self._path("queue", state))
+        os.makedirs(self._path("shards"))
+        os.makedirs(self._path("results"))
+
+        for index in range(num_shards):
+            start = len(dataset) * index // num_shards
+            end = len(dataset) * (index + 1) // num_shards
+            shard = f"shard-{index:05d}"
+            with open(self.shard_file(shard), "w") as f:
+                json.dump(dataset[start:end], f)
+            os.makedirs(self.output_dir(shard))
+            open(self._marker("pending", f"{shard}.1"), "w").close()
+
+        with open(self._path("manifest.json"), "w") as f:
+            json.dump(
+                {"dataset_file": dataset_file, "cases": len(dataset), "shards": num_shards},
+                f,
+                indent=2,
+            )
+        return num_shards
+
+    def markers(self, state):
+        """(shard, attempt, marker name) of the shards in `state`"""
+        found = []
+        for name in sorted(os.listdir(self._path("queue", state))):
+            match = _MARKER.fullmatch(name)
+            if match:
+                found.append((match.group(1), int(match.group(2)), name))
+        return found
+
+    def claim(self, worker_id=""):
+        """Move the first pending shard to running. Returns its marker's
+        (shard, attempt, name), or None if there is nothing to claim"""
+        for shard, attempt, name in self.markers("pending"):
+            try:
+                os.rename(self._marker("pending", name), self._marker("running", name))
+            except FileNotFoundError:
+                continue  # another worker got it first
+            with open(self._marker("running", name), "w") as f:
+                f.write(worker_id)
+            return shard, attempt, name
+        return None
+
+    def release(self, shard, attempt, name, error=None):
+        """Move a running shard to done, or back to pending or to failed"""
+        source = self._marker("running", name)
+        if error is None:
+            target = self._marker("done", name)
+        else:
+            with open(source, "w") as f:
+                f.write(error)
+            if attempt < self.max_attempts:
+                target = self._marker("pending", f"{shard}.{attempt + 1}")
+            else:
+                target = self._marker("failed", name)
+        try:
+            os.rename(source, target)
+        except FileNotFoundError:
+            pass  # requeued as stale meanwhile; the queue has it already
+
+    def requeue_stale(self):
+        """Put back running shards whose worker stopped sending heartbeats"""
+        now = time.time()
+        for shard, attempt, name in self.markers("running"):
+            try:
+                age = now - os.path.getmtime(self._marker("running", name))
+            except FileNotFoundError:
+                continue
+            if age > self.stale_after:
+                self.release(shard, attempt, name, f"no heartbeat for {age:.0f}s")
+
+    def retry_failed(self):
+        """Queue the failed shards again, each with `max_attempts` more tries"""
+        failed = self.markers("failed")
+        for shard, _, name in failed:
+            os.rename(self._marker("failed", name), self._marker("pending", f"{shard}.1"))
+        return len(failed)
+
+    def owned_by(self, worker_id):
+        """Markers of the running shards `worker_id` claimed"""
+        owned = []
+        for marker in self.markers("running"):
+            with contextlib.suppress(FileNotFoundError):
+                with open(self._marker("running", marker[2])) as f:
+                    if f.read() == worker_id:
+                        owned.append(marker)
+        return owned
+
+    def work(self, worker_spec, worker_id=None):
+        """Run shards in a worker process until none are pending or running.
+
+        The process claims shards itself; this keeps their markers' heartbeat
+        going, and if the process dies, releases the shard it was running
+        and starts another process while shards are still pending.
+        """
+        worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        worker_spec = self._resolve(worker_spec)
+        failed_starts = 0
+        while True:
+            if not self.markers("pending"):
+                self.requeue_stale()
+                if not self.markers("pending"):
+                    if not self.markers("running"):
+                        return
+                    # Another worker's shard may still fail and need a retry
+                    time.sleep(self.poll_interval)
+                    continue
+
+            process = multiprocessing.get_context("spawn").Process(
+                target=_worker_process, args=(self, worker_spec, worker_id), daemon=True
+            )
+            process.start()
+            while True:
+                process.join(self.heartbeat_interval)
+                if process.exitcode is not None:
+                    break
+                for _, _, name in self.owned_by(worker_id):
+                    with contextlib.suppress(FileNotFoundError):
+                        os.utime(self._marker("running", name))
+            owned = self.owned_by(worker_id)
+            for marker in owned:
+                self.release(*marker, f"worker process exited with {process.exitcode}")
+            if process.exitcode and not owned:
+                # Died outside a shard, e.g. the worker spec failed to import
+                failed_starts += 1
+                if failed_starts >= self.max_attempts:
+                    raise RuntimeError(
+                        f"Worker process for {worker_spec} keeps exiting with "
+                        f"{process.exitcode}; see its output above"
+                    )
+            else:
+                failed_starts = 0
+
+    def run(self, worker_spec, workers):
+        """Run every queued shard on this machine, `workers` at a time"""
+        start = time.perf_counter()
+        errors = []
+
+        def work(worker_id):
+            try:
+                self.work(worker_spec, worker_id)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [
+            threading.Thread(target=work, args=(f"{socket.gethostname()}:{os.getpid()}:{index}",))
+            for index in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.perf_counter() - start
+        if errors:
+            raise errors[0]
+        print(f"Sharded run: {self.summary()}")
+
+    @staticmethod
+    def _resolve(worker_spec):
+        # Worker processes start in the same directory, but a file path is
+        # made absolute in case the worker changes it
+        module_name, _, function_name = worker_spec.rpartition(":")
+        if module_name.endswith(".py"):
+            return f"{os.path.abspath(module_name)}:{function_name}"
+        return worker_spec
+
+    def status(self):
+        """Shards per state, and retries so far"""
+        counts = {state: len(self.markers(state)) for state in STATES}
+        counts["retries"] = sum(
+            attempt - 1 for state in STATES for _, attempt, _ in self.markers(state)
+        )
+        return counts
+
+    def summary(self):
+        counts = self.status()
+        manifest = self.manifest()
+        text = (
+            f"{counts['done']}/{manifest['shards']} shards done, {counts['failed']} failed, "
+            f"{counts['retries']} retries"
+        )
+        if self.elapsed:
+            text += (
+                f"; {manifest['cases']} cases in {self.elapsed:.1f}s "
+                f"({manifest['cases'] / self.elapsed:.1f} cases/s)"
+            )
+        return text
+
+    def merge(
+        self,
+        jsonl_output_file="output.jsonl",
+        json_output_file="output.json",
+        html_output_file="output.html",
+        metrics_output_file=None,
+        rows_per_page=None,
+    ):
+        """Combine the shards' results, in dataset order, into the files
+        run_evaluation writes. Results of failed shards' completed cases are
+        included. Returns the closed ReportWriter"""
+        manifest = self.manifest()
+        shards = [f"shard-{index:05d}" for index in range(manifest["shards"])]
+        with JsonlResultWriter(jsonl_output_file, fsync_every=1000) as writer:
+            for shard in shards:
+                for result in iter_results(
+                    os.path.join(self.output_dir(shard), SHARD_RESULTS_FILE)
+                ):
+                    writer.write(result)
+
+        calls_files = [
+            path
+            for path in (os.path.join(self.output_dir(shard), SHARD_CALLS_FILE) for shard in shards)
+            if os.path.exists(path)
+        ]
+        call_metrics = CallMetrics.read_calls(calls_files)
+        if metrics_output_file:
+            call_metrics.export(metrics_output_file)
+        write_json_array(iter_results(jsonl_output_file), json_output_file)
+        report = write_prompt_evaluation_report(
+            jsonl_output_file,
+            html_output_file,
+            call_metrics.site_summaries(),
+            rows_per_page,
+        )
+
+        print(f"Average score: {report.average_score}")
+        print(f"Prompt cache: {call_metrics.prompt_cache.summary()}")
+        print(f"API calls:\n{call_metrics.summary()}")
+        missing = manifest["cases"] - report.total_tests
+        if missing:
+            print(
+                f"Missing {missing}/{manifest['cases']} results; "
+                f"{len(self.markers('failed'))} shards failed, see {self._path('queue', 'failed')}"
+            )
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run an evaluation in shards")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    split = commands.add_parser("split", help="split a dataset into queued shards")
+    split.add_argument("work_dir")
+    split.add_argument("dataset_file")
+    split.add_argument("--shards", type=int, required=True)
+
+    for name, help_text in (
+        ("work", "run queued shards until there are none left"),
+        ("run", "split, run and merge in one go"),
+    ):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("work_dir")
+        command.add_argument("worker", help="module:function or file.py:function")
+        command.add_argument("--workers", type=int, default=os.cpu_count())
+        if name == "run":
+            command.add_argument("dataset_file")
+            command.add_argument("--shards", type=int)
+
+    for name, help_text in (
+        ("status", "count shards per state"),
+        ("retry", "queue the failed shards again"),
+        ("merge", "write output.json, output.html and metrics.json"),
+    ):
+        commands.add_parser(name, help=help_text).add_argument("work_dir")
+
+    args = parser.parse_args()
+    runner = ShardedRunner(args.work_dir)
+    if args.command in ("split", "run"):
+        runner.split(args.dataset_file, args.shards or 4 * args.workers)
+    if args.command in ("work", "run"):
+        runner.run(args.worker, args.workers)
+    if args.command in ("merge", "run"):
+        runner.merge(metrics_output_file="metrics.json")
+    if args.command == "retry":
+        print(f"Queued {runner.retry_failed()} failed shards again")
+    if args.command == "status":
+        print(runner.summary())
+
+
+if __name__ == "__main__":
+    main()
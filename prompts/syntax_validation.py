@@ -0,0 +1,434 @@
+"""
+Syntax validation of model outputs in a process pool.
+
+grade_syntax used to run `ast.parse`, `json.loads` or `re.compile` on the
+calling thread. That holds the GIL, so validating a large batch stalls the
+threads waiting on the API. A pathological regex can also take arbitrarily
+long. `SyntaxValidator` sends the work to worker processes in batches of
+outputs with the same format:
+
+    validator = SyntaxValidator()
+    validator.validate_many([("json", text), ("regex", pattern), ...])
+    validator.validate("python", text)  # from many threads; batched together
+
+Each item gets `timeout` seconds of CPU time in the worker (a SIGPROF
+interval timer where available) and scores 0 if it runs out. The timer can
+only interrupt Python code, not a single long call into C such as
+`ast.parse`, so outputs longer than `max_chars` score 0 without being parsed.
+
+Scores go from 0 to 10 instead of just 0 or 10:
+
+    json    10 valid; 7 valid JSON with other text around it; 4 only after
+            repair_json (cut off, trailing commas, comments); 0 invalid
+    python  10 compiles; 8 parses but doesn't compile (e.g. `return`
+            outside a function); 6 valid only inside its code fence; 0 invalid
+    regex   10 valid; 7 valid once its /.../ or quote delimiters are
+            removed; at most 4 with catastrophic backtracking risk; 0 invalid
+
+Every result is a (score, detail) pair, the detail saying why.
+
+Backtracking risk is found statically, on the parsed pattern, since a
+running match can't be interrupted. An unbounded quantifier is risky when
+its body can be split up more than one way. That happens when the body has a
+variable-width part and no fixed-width part that the variable parts can't
+match to mark where one repetition ends, as in `(a+)+`, `(\\w+\\s?)*` or
+`(-?\\d+)+` (`(\\d+-)+` is fine). It also happens when the body's
+alternatives can start with the same character, as in `(\\w\\d|\\d\\w)+`.
+"""
+import ast
+import collections
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import re
+import signal
+import threading
+from textwrap import dedent
+
+from batched_grading import DynamicBatcher
+from json_stream import repair_json
+
+try:
+    from re import _compiler as sre_compile, _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_compile
+    import sre_constants
+    import sre_parse
+
+MAXREPEAT = sre_constants.MAXREPEAT
+_REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+# Both new in Python 3.11
+_POSSESSIVE_REPEAT = getattr(sre_constants, "POSSESSIVE_REPEAT", None)
+_ATOMIC_GROUP = getattr(sre_constants, "ATOMIC_GROUP", None)
+_SINGLE_CHAR = (sre_constants.LITERAL, sre_constants.NOT_LITERAL, sre_constants.ANY, sre_constants.IN)
+_ZERO_WIDTH = (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT)
+_SAMPLE_CHARS = [chr(code) for code in range(32, 127)] + ["\t", "\n", "é", "一"]
+
+
+class _Timeout(Exception):
+    pass
+
+
+# Backtracking analysis
+
+
+def _min_width(state, items):
+    return sre_parse.SubPattern(state, list(items)).getwidth()[0]
+
+
+def _first_chars(state, items):
+    """Sample characters that a sequence of pattern items can start with"""
+    chars = set()
+    for op, av in items:
+        if op in _SINGLE_CHAR:
+            compiled = sre_compile.compile(sre_parse.SubPattern(state, [(op, av)]))
+            chars |= {char for char in _SAMPLE_CHARS if compiled.match(char)}
+        elif op in _REPEATS or op == _POSSESSIVE_REPEAT:
+            chars |= _first_chars(state, av[2])
+        elif op == sre_constants.SUBPATTERN:
+            chars |= _first_chars(state, av[-1])
+        elif op == _ATOMIC_GROUP:
+            chars |= _first_chars(state, av)
+        elif op == sre_constants.BRANCH:
+            for branch in av[1]:
+                chars |= _first_chars(state, branch)
+        elif op not in _ZERO_WIDTH:
+            return set(_SAMPLE_CHARS)  # e.g. a backreference
+        if _min_width(state, [(op, av)]) > 0:
+            break
+    return chars
+
+
+def _body_items(body):
+    """A repeat's body, with a group around the whole body unwrapped"""
+    items = list(body)
+    while len(items) == 1 and items[0][0] == sre_constants.SUBPATTERN:
+        items = list(items[0][1][-1])
+    return items
+
+
+def _repeat_risk(state, body):
+    items = _body_items(body)
+    widths = [sre_parse.SubPattern(state, [item]).getwidth() for item in items]
+    # Possessive and atomic parts never give back what they matched
+    variable = [
+        item
+        for item, (low, high) in zip(items, widths)
+        if low != high and item[0] not in (_POSSESSIVE_REPEAT, _ATOMIC_GROUP)
+    ]
+    if variable:
+        variable_chars = set().union(*(_first_chars(state, [item]) for item in variable))
+        separated = any(
+            0 < low == high and _first_chars(state, [item]).isdisjoint(variable_chars)
+            for item, (low, high) in zip(items, widths)
+        )
+        if not separated:
+            return "nested quantifiers"
+
+    for op, av in items:
+        if op == sre_constants.BRANCH:
+            firsts = [_first_chars(state, branch) for branch in av[1] if branch]
+            for i, chars in enumerate(firsts):
+                if any(not chars.isdisjoint(other) for other in firsts[i + 1 :]):
+                    return "overlapping alternatives under a quantifier"
+    return None
+
+
+def _walk_risk(state, items):
+    for op, av in items:
+        children = []
+        if op in _REPEATS:
+            if av[1] == MAXREPEAT:
+                risk = _repeat_risk(state, av[2])
+                if risk:
+                    return risk
+            children = [av[2]]
+        elif op == sre_constants.SUBPATTERN:
+            children = [av[-1]]
+        elif op == sre_constants.BRANCH:
+            children = av[1]
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            children = [av[1]]
+        elif op == sre_constants.GROUPREF_EXISTS:
+            children = [child for child in av[1:] if child]
+        # Atomic groups and possessive repeats never backtrack into themselves
+        for child in children:
+            risk = _walk_risk(state, child)
+            if risk:
+                return risk
+    return None
+
+
+def backtracking_risk(pattern):
+    """A description of why `pattern` may backtrack catastrophically, or None"""
+    parsed = sre_parse.parse(pattern)
+    return _walk_risk(parsed.state, parsed)
+
+
+# Validators
+
+
+def _strip_fence(text):
+    """The contents of a ```fenced``` block in `text`, or None"""
+    match = re.search(r"```[\w+-]*\n(.*?)(?:```|\Z)", text, re.S)
+    return match.group(1) if match else None
+
+
+def validate_json(text):
+    text = text.strip()
+    if not text:
+        return 0, "empty"
+    try:
+        json.loads(text)
+        return 10, "valid"
+    except json.JSONDecodeError as e:
+        error = e
+
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if starts:
+        try:
+            json.JSONDecoder().raw_decode(text, min(starts))
+            return 7, "valid JSON with other text around it"
+        except json.JSONDecodeError:
+            pass
+        repaired = repair_json(text)
+        # Only if the repair kept most of it; "{" plus garbage repairs to "{}".
+        # repair_json drops whitespace, so compare without it
+        if len(repaired) >= 0.8 * len("".join(text[min(starts) :].split())):
+            try:
+                json.loads(repaired)
+                return 4, "valid after repair (cut off, trailing commas or comments)"
+            except json.JSONDecodeError:
+                pass
+    return 0, f"invalid: {error.msg} (line {error.lineno})"
+
+
+def _compile_python(source):
+    """None if `source` compiles, else (parsed, error message)"""
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError) as e:
+        return False, getattr(e, "msg", str(e))
+    try:
+        compile(tree, "<output>", "exec")
+    except (SyntaxError, ValueError) as e:
+        return True, getattr(e, "msg", str(e))
+    return None
+
+
+def validate_python(text):
+    source = text.strip()
+    if not source:
+        return 0, "empty"
+    try:
+        failure = _compile_python(source)
+        if failure is None:
+            return 10, "valid"
+        parsed, message = failure
+        if parsed:
+            return 8, f"parses, but doesn't compile: {message}"
+        fenced = _strip_fence(text)
+        if fenced is not None and _compile_python(dedent(fenced).strip()) is None:
+            return 6, "valid inside its code fence"
+    except RecursionError:
+        return 0, "invalid: nested too deeply"
+    return 0, f"invalid: {message}"
+
+
+_DELIMITED = re.compile(r"""^(?:/(?P<slashed>.*)/[a-z]*|r?(?P<quote>["'])(?P<quoted>.*)(?P=quote))$""", re.S)
+
+
+def validate_regex(text):
+    pattern = text.strip()
+    if not pattern:
+        return 0, "empty"
+    score, detail = 10, "valid"
+    delimited = _DELIMITED.match(pattern)
+    if delimited:
+        inner = delimited.group("slashed")
+        inner = delimited.group("quoted") if inner is None else inner
+        try:
+            re.compile(inner)
+            pattern, score, detail = inner, 7, "valid once its delimiters are removed"
+        except re.error:
+            pass
+    try:
+        re.compile(pattern)
+    except (re.error, OverflowError, RecursionError) as e:
+        return 0, f"invalid: {getattr(e, 'msg', e)}"
+    risk = backtracking_risk(pattern)
+    if risk:
+        return min(score, 4), f"catastrophic backtracking risk: {risk}"
+    return score, detail
+
+
+VALIDATORS = {"json": validate_json, "python": validate_python, "regex": validate_regex}
+
+
+def validate(format, text):
+    """(score, detail) for one output; unknown formats are checked as regexes,
+    like grade_syntax always did"""
+    return VALIDATORS.get(format, validate_regex)(text)
+
+
+# Worker side
+
+
+def _raise_timeout(signum, frame):
+    raise _Timeout()
+
+
+def _init_worker():
+    if hasattr(signal, "setitimer"):
+        signal.signal(signal.SIGPROF, _raise_timeout)
+
+
+def _validate_batch(format, texts, timeout, max_chars):
+    results = []
+    timed = hasattr(signal, "setitimer")
+    for text in texts:
+        if len(text) > max_chars:
+            results.append((0, f"too long to validate ({len(text)} characters)"))
+            continue
+        try:
+            if timed:
+                signal.setitimer(signal.ITIMER_PROF, timeout)
+            try:
+                results.append(validate(format, text))
+            finally:
+                if timed:
+                    signal.setitimer(signal.ITIMER_PROF, 0)
+        except _Timeout:
+            results.append((0, f"timed out after {timeout:g}s of CPU"))
+        except Exception as e:
+            results.append((0, f"validator error: {type(e).__name__}"))
+    return results
+
+
+# Pool
+
+
+class ValidationStats:
+    def __init__(self):
+        self.items = 0
+        self.batches = 0
+        self.restarts = 0
+        self.scores = collections.Counter()
+        self.timeouts = 0
+        self.risky_regexes = 0
+        self._lock = threading.Lock()
+
+    def record(self, results):
+        with self._lock:
+            self.items += len(results)
+            self.batches += 1
+            for score, detail in results:
+                self.scores[score] += 1
+                self.timeouts += detail.startswith("timed out")
+                self.risky_regexes += detail.startswith("catastrophic")
+
+    def summary(self):
+        if not self.items:
+            return "no outputs validated"
+        scores = ", ".join(f"{score}: {count}" for score, count in sorted(self.scores.items(), reverse=True))
+        return (
+            f"{self.items} outputs in {self.batches} batches (scores {scores}); "
+            f"{self.timeouts} timed out, {self.risky_regexes} regexes at risk of "
+            f"catastrophic backtracking, {self.restarts} pool restarts"
+        )
+
+
+class SyntaxValidator:
+    def __init__(
+        self, max_workers=None, batch_size=64, timeout=1.0, max_chars=100_000, max_wait=0.005
+    ):
+        # Leave a core for the threads talking to the API
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) - 1)
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_chars = max_chars
+        self.stats = ValidationStats()
+        self._pool = None
+        self._lock = threading.Lock()
+        # validate() calls from concurrent threads share a batch
+        self._batcher = DynamicBatcher(
+            self.validate_many,
+            size_of=lambda item: 1,
+            token_budget=batch_size,
+            max_items=batch_size,
+            max_wait=max_wait,
+        )
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn rather than fork: the caller usually has API threads
+                # running, and forking those is unsafe
+                self._pool = concurrent.futures.ProcessPoolExecutor(
+                    self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                )
+            return self._pool
+
+    def _restart(self, broken):
+        with self._lock:
+            if self._pool is broken:
+                self._pool = None
+                self.stats.restarts += 1
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, format, texts):
+        """Validate one batch in a fresh submission. If its worker dies, the
+        items are retried one by one, so only the one that crashed it scores 0"""
+        pool = self._executor()
+        try:
+            return pool.submit(_validate_batch, format, texts, self.timeout, self.max_chars).result()
+        except concurrent.futures.process.BrokenProcessPool:
+            self._restart(pool)
+            if len(texts) == 1:
+                return [(0, "validator crashed")]
+            return [result for text in texts for result in self._run(format, [text])]
+
+    def validate_many(self, items):
+        """(score, detail) for each (format, text), in order"""
+        by_format = collections.defaultdict(list)
+        for index, (format, text) in enumerate(items):
+            by_format[format].append(index)
+
+        pool = self._executor()
+        batches = []
+        for format, indexes in by_format.items():
+            for start in range(0, len(indexes), self.batch_size):
+                batch = indexes[start : start + self.batch_size]
+                texts = [items[i][1] for i in batch]
+                future = pool.submit(_validate_batch, format, texts, self.timeout, self.max_chars)
+                batches.append((batch, format, texts, future))
+
+        results = [None] * len(items)
+        for batch, format, texts, future in batches:
+            try:
+                batch_results = future.result()
+            except concurrent.futures.process.BrokenProcessPool:
+                # Maybe another batch's crash; try this one again on its own
+                self._restart(pool)
+                batch_results = self._run(format, texts)
+            self.stats.record(batch_results)
+            for index, result in zip(batch, batch_results):
+                results[index] = result
+        return results
+
+    def validate(self, format, text):
+        """(score, detail) for one output. Safe to call from many threads;
+        concurrent calls are sent to the pool together"""
+        return self._batcher((format, text))
+
+    def summary(self):
+        return self.stats.summary()
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
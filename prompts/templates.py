@@ -0,0 +1,60 @@
+"""
+Compiled prompt templates.
+
+Templates use `{name}` slots, with `{{` and `}}` for literal braces. A template
+string is tokenized once into literal segments and slots, and the result is
+cached, so rendering the same template again is a single join over the
+segments.
+
+Slots without a value are left in place as `{name}`. Values are inserted as
+is: braces inside a value are never unescaped or substituted again.
+"""
+import re
+import textwrap
+from functools import lru_cache
+
+_TOKEN = re.compile(r"\{\{|\}\}|\{([^{}]+)\}")
+
+
+class Template:
+    def __init__(self, source):
+        self.source = source
+        # Slots start out as their original "{name}" text, so rendering
+        # without a value for them leaves them untouched
+        self.segments = []
+        self.slots = []
+
+        literal = []
+        position = 0
+        for match in _TOKEN.finditer(source):
+            literal.append(source[position : match.start()])
+            position = match.end()
+            name = match.group(1)
+            if name is None:
+                literal.append(match.group()[0])
+                continue
+            self.segments.append("".join(literal))
+            literal = []
+            self.slots.append((len(self.segments), name))
+            self.segments.append(match.group())
+        literal.append(source[position:])
+        self.segments.append("".join(literal))
+
+    def render(self, variables):
+        parts = self.segments.copy()
+        for index, name in self.slots:
+            if name in variables:
+                parts[index] = str(variables[name])
+        return "".join(parts)
+
+
+@lru_cache(maxsize=256)
+def compile_template(source, dedent=False):
+    """Parse a template string once; repeated calls return the cached Template"""
+    if dedent:
+        source = textwrap.dedent(source)
+    return Template(source)
+
+
+def render(source, variables, dedent=False):
+    return compile_template(source, dedent).render(variables)
@@ -0,0 +1,322 @@
+"""
+Bulk version of the add_duration_to_datetime tool.
+
+    add_durations(["2025-01-31", "2024-02-29"], [1, 1], ["months", "years"],
+                  scalar=add_duration_to_datetime)
+
+takes sequences of datetime strings, durations and units (or a single value
+for all of them) and returns the same strings the scalar tool would, in order.
+
+* Parsing: each distinct (string, format) pair is parsed once. Every format
+  gets a cached parser; for ISO formats (`%Y-%m-%d`, optionally with
+  `T`/space `%H:%M:%S`) strings that match a strict regex are parsed by
+  NumPy in one go instead of by `strptime`.
+* Arithmetic: datetimes are int64 microseconds and every distinct
+  (duration, unit) pair is resolved once, so seconds..weeks are one array
+  addition. Months and years go through `datetime64[M]`, clamping to the end
+  of the target month the way the scalar tool does.
+* Formatting: day, month and AM/PM names come from tables built once per
+  locale with `strftime`, and each distinct result is formatted once.
+
+Anything the fast path doesn't cover (a string that doesn't parse, Feb 29
+plus a number of years that isn't a leap year, a result outside year
+1..9999, a float number of months, an unknown unit) is handed to the scalar
+function, so results and errors are exactly the scalar tool's. Without NumPy
+the same steps run element by element.
+"""
+import locale
+import re
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+OUTPUT_FORMAT = "%A, %B %d, %Y %I:%M:%S %p"
+
+_US = {
+    "seconds": 1_000_000,
+    "minutes": 60_000_000,
+    "hours": 3_600_000_000,
+    "days": 86_400_000_000,
+    "weeks": 604_800_000_000,
+}
+_DAY_US = _US["days"]
+_EPOCH = datetime(1970, 1, 1)
+_MIN_US = (datetime.min - _EPOCH) // timedelta(microseconds=1)
+_MAX_US = (datetime.max - _EPOCH) // timedelta(microseconds=1)
+_MONTH_DAYS = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+# Shift kinds
+_FIXED, _MONTHS, _SCALAR = 0, 1, 2
+
+_ISO_PATTERNS = {
+    "%Y-%m-%d": re.compile(r"\d{4}-\d{2}-\d{2}"),
+    "%Y-%m-%dT%H:%M:%S": re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}"),
+    "%Y-%m-%d %H:%M:%S": re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}"),
+}
+
+
+@lru_cache(maxsize=64)
+def _parser(input_format):
+    """(ISO regex or None, function parsing one string to a datetime)"""
+    pattern = _ISO_PATTERNS.get(input_format)
+    if pattern is None:
+        return None, lambda value: datetime.strptime(value, input_format)
+
+    def parse_iso(value):
+        # The regex has already checked the layout; datetime() checks ranges
+        if pattern.fullmatch(value) is None:
+            return datetime.strptime(value, input_format)
+        return datetime(
+            int(value[0:4]), int(value[5:7]), int(value[8:10]),
+            int(value[11:13] or 0), int(value[14:16] or 0), int(value[17:19] or 0),
+        )
+
+    return pattern, parse_iso
+
+
+@lru_cache(maxsize=8)
+def _name_tables(time_locale):
+    """Day names (Monday first), month names and (AM, PM) for a locale"""
+    days = tuple(datetime(2001, 1, day).strftime("%A") for day in range(1, 8))
+    months = tuple(datetime(2001, month, 1).strftime("%B") for month in range(1, 13))
+    am_pm = (datetime(2001, 1, 1, 0).strftime("%p"), datetime(2001, 1, 1, 12).strftime("%p"))
+    return days, months, am_pm
+
+
+def _names():
+    return _name_tables(locale.setlocale(locale.LC_TIME))
+
+
+def _format_date(year, month, day, weekday, names):
+    """The date half of OUTPUT_FORMAT, with the trailing space"""
+    if year < 1000:
+        # strftime's %Y isn't zero-padded the same way on every platform
+        return datetime(year, month, day).strftime("%A, %B %d, %Y ")
+    days, months, _ = names
+    return f"{days[weekday]}, {months[month - 1]} {day:02d}, {year} "
+
+
+def _format_time(hour, minute, second, names):
+    """The time half of OUTPUT_FORMAT"""
+    am_pm = names[2][hour >= 12]
+    return f"{(hour - 1) % 12 + 1:02d}:{minute:02d}:{second:02d} {am_pm}"
+
+
+def _shift(duration, unit):
+    """How to apply (duration, unit): (_FIXED, microseconds),
+    (_MONTHS, months) or (_SCALAR, None)"""
+    # 1 and 1.0 are equal as cache keys but not to the scalar tool
+    return _cached_shift(duration, type(duration), unit)
+
+
+@lru_cache(maxsize=4096)
+def _cached_shift(duration, duration_type, unit):
+    if unit in _US:
+        if isinstance(duration, int) or float(duration).is_integer():
+            delta = int(duration) * _US[unit]
+        else:
+            try:
+                delta = timedelta(**{unit: duration}) // timedelta(microseconds=1)
+            except (OverflowError, ValueError):
+                return _SCALAR, None
+        # Anything larger leaves the datetime range whatever the start
+        if abs(delta) > _MAX_US - _MIN_US:
+            return _SCALAR, None
+        return _FIXED, delta
+    # The scalar tool does integer month arithmetic; it raises for floats
+    if unit in ("months", "years") and duration_type is int:
+        months = duration * 12 if unit == "years" else duration
+        if abs(months) > 12 * 10_000:
+            return _SCALAR, None
+        return _MONTHS, months
+    return _SCALAR, None
+
+
+def _broadcast(value, size):
+    if isinstance(value, (str, int, float)):
+        return [value] * size
+    value = list(value)
+    if len(value) != size:
+        raise ValueError(f"expected {size} values, got {len(value)}")
+    return value
+
+
+def add_durations(datetime_strs, durations=0, units="days", input_format="%Y-%m-%d", *, scalar):
+    """Add durations to datetimes in bulk; see the module docstring.
+
+    `durations`, `units` and `input_format` are each a sequence as long as
+    `datetime_strs` or one value for all. `scalar` is the scalar tool,
+    add_duration_to_datetime(datetime_str, duration, unit, input_format),
+    which handles (and raises for) the elements the fast path skips.
+    """
+    datetime_strs = list(datetime_strs)
+    size = len(datetime_strs)
+    durations = _broadcast(durations, size)
+    units = _broadcast(units, size)
+    formats = _broadcast(input_format, size)
+    if np is None:
+        return _add_durations_python(datetime_strs, durations, units, formats, scalar)
+    return _add_durations_numpy(datetime_strs, durations, units, formats, scalar)
+
+
+def _add_durations_python(datetime_strs, durations, units, formats, scalar):
+    names = _names()
+    parsed = {}
+    results = []
+    for datetime_str, duration, unit, input_format in zip(datetime_strs, durations, units, formats):
+        kind, amount = _shift(duration, unit)
+        result = None
+        if kind != _SCALAR:
+            key = (datetime_str, input_format)
+            if key not in parsed:
+                try:
+                    parsed[key] = _parser(input_format)[1](datetime_str)
+                except ValueError:
+                    parsed[key] = None
+            date = parsed[key]
+            if date is not None:
+                result = _shift_python(date, kind, amount)
+        if result is None:
+            results.append(scalar(datetime_str, duration, unit, input_format))
+        else:
+            results.append(
+                _format_date(result.year, result.month, result.day, result.weekday(), names)
+                + _format_time(result.hour, result.minute, result.second, names)
+            )
+    return results
+
+
+def _shift_python(date, kind, amount):
+    """Shifted datetime, or None where the scalar tool decides"""
+    if kind == _FIXED:
+        try:
+            return date + timedelta(microseconds=amount)
+        except OverflowError:
+            return None
+    year, month = divmod(date.year * 12 + date.month - 1 + amount, 12)
+    month += 1
+    if not 1 <= year <= 9999:
+        return None
+    month_days = _MONTH_DAYS[month - 1]
+    if month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
+        month_days = 29
+    if date.day > month_days and amount % 12 == 0:
+        return None  # Feb 29 plus whole years: the scalar tool may raise
+    return date.replace(year=year, month=month, day=min(date.day, month_days))
+
+
+def _parse_numpy(keys):
+    """int64 microseconds since the epoch for each (string, format) key, and
+    a mask of the ones that didn't parse"""
+    values = np.zeros(len(keys), dtype=np.int64)
+    failed = np.zeros(len(keys), dtype=bool)
+
+    by_format = {}
+    for i, (datetime_str, input_format) in enumerate(keys):
+        by_format.setdefault(input_format, []).append(i)
+
+    for input_format, indexes in by_format.items():
+        pattern, parse = _parser(input_format)
+        slow = indexes
+        if pattern is not None:
+            iso = [i for i in indexes if pattern.fullmatch(keys[i][0])]
+            slow = [i for i in indexes if not pattern.fullmatch(keys[i][0])]
+            try:
+                stamps = np.array([keys[i][0] for i in iso], dtype="datetime64[us]")
+                values[iso] = stamps.astype(np.int64)
+            except ValueError:
+                # e.g. "2025-02-30"; sort it out string by string
+                slow = indexes
+        for i in slow:
+            try:
+                values[i] = (parse(keys[i][0]) - _EPOCH) // timedelta(microseconds=1)
+            except ValueError:
+                failed[i] = True
+
+    # NumPy parses years the datetime module can't represent
+    failed |= (values < _MIN_US) | (values > _MAX_US)
+    return values, failed
+
+
+def _add_durations_numpy(datetime_strs, durations, units, formats, scalar):
+    size = len(datetime_strs)
+    if size == 0:
+        return []
+
+    # Parse each distinct string once
+    key_index = {}
+    keys = [key_index.setdefault((s, f), len(key_index)) for s, f in zip(datetime_strs, formats)]
+    parsed, parse_failed = _parse_numpy(list(key_index))
+    keys = np.array(keys, dtype=np.intp)
+    base = parsed[keys]
+
+    # Resolve each distinct (duration, unit) once
+    shift_index = {}
+    shift_ids = [
+        shift_index.setdefault((duration, type(duration), unit), len(shift_index))
+        for duration, unit in zip(durations, units)
+    ]
+    shifts = [_cached_shift(*key) for key in shift_index]
+    shift_ids = np.array(shift_ids, dtype=np.intp)
+    kind = np.array([k for k, _ in shifts], dtype=np.int8)[shift_ids]
+    amount = np.array([a or 0 for _, a in shifts], dtype=np.int64)[shift_ids]
+
+    use_scalar = parse_failed[keys] | (kind == _SCALAR)
+    result = base.copy()
+
+    fixed = (kind == _FIXED) & ~use_scalar
+    # Both sides are within the datetime range, so this can't overflow int64
+    result[fixed] = base[fixed] + amount[fixed]
+
+    months = (kind == _MONTHS) & ~use_scalar
+    if months.any():
+        start = base[months]
+        days = start // _DAY_US
+        time_of_day = start - days * _DAY_US
+        month = days.astype("datetime64[D]").astype("datetime64[M]")
+        day = (days - month.astype("datetime64[D]").astype(np.int64)) + 1
+        target = month + amount[months]
+        first = target.astype("datetime64[D]").astype(np.int64)
+        month_days = (target + 1).astype("datetime64[D]").astype(np.int64) - first
+        # Whole years landing on a shorter month is Feb 29 to a non-leap
+        # year, which the scalar tool raises for when the unit is years
+        feb29 = (day > month_days) & (amount[months] % 12 == 0)
+        result[months] = (first + np.minimum(day, month_days) - 1) * _DAY_US + time_of_day
+        use_scalar[np.flatnonzero(months)[feb29]] = True
+
+    use_scalar |= (result < _MIN_US) | (result > _MAX_US)
+
+    # Format each distinct date and each distinct time of day once
+    fast = np.flatnonzero(~use_scalar)
+    days = result[fast] // _DAY_US
+    seconds = (result[fast] - days * _DAY_US) // 1_000_000
+    names = _names()
+
+    unique_days, day_index = np.unique(days, return_inverse=True)
+    date = unique_days.astype("datetime64[D]")
+    year = date.astype("datetime64[Y]").astype(np.int64) + 1970
+    month = date.astype("datetime64[M]").astype(np.int64) % 12 + 1
+    day = (unique_days - date.astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)) + 1
+    weekday = (unique_days + 3) % 7  # 1970-01-01 was a Thursday
+    date_strs = [
+        _format_date(y, m, d, w, names)
+        for y, m, d, w in zip(year.tolist(), month.tolist(), day.tolist(), weekday.tolist())
+    ]
+
+    unique_seconds, second_index = np.unique(seconds, return_inverse=True)
+    time_strs = [
+        _format_time(s // 3600, s // 60 % 60, s % 60, names) for s in unique_seconds.tolist()
+    ]
+
+    results = np.empty(size, dtype=object)
+    results[fast] = (
+        np.array(date_strs, dtype=object)[day_index] + np.array(time_strs, dtype=object)[second_index]
+    )
+    results = results.tolist()
+    for i in np.flatnonzero(use_scalar).tolist():
+        results[i] = scalar(datetime_strs[i], durations[i], units[i], formats[i])
+    return results
@@ -0,0 +1,158 @@
+"""
+Conversation history compaction for long tool-use loops.
+
+run_conversation keeps every assistant message and tool result in
+`messages`, so without compaction every turn resends the whole session.
+`HistoryManager.prepare(messages)` returns what to send instead: when the
+history goes over `token_budget`, the oldest tool rounds (an assistant
+message with tool_use blocks and the user message with their tool_results)
+are collapsed into short text notes, e.g.
+
+    assistant: Called get_current_datetime({"date_format": "%H:%M"})
+    user:      get_current_datetime returned "15:20"
+
+Long results are cut to `max_note_chars`. The last `keep_recent` messages are
+never touched, and `messages` itself is never modified.
+
+Compaction is monotonic: compacted messages are remembered and reused as-is,
+and the boundary only moves forward. The boundary moves in one jump, down to
+`compact_to` of the budget, instead of one round per turn. So the prefix of
+what is sent only changes on the turns where compaction happens, and a prompt
+cache over it stays valid in between.
+
+Token counts are estimates (about 4 characters per token, like the rate
+limiter's). Each call to prepare() appends a TurnStats with the full and sent
+sizes to `turns`.
+"""
+import json
+
+
+def _block_dict(block):
+    return block if isinstance(block, dict) else block.model_dump(exclude_none=True)
+
+
+def estimate_tokens(message):
+    content = message["content"]
+    if not isinstance(content, str):
+        content = json.dumps([_block_dict(block) for block in content])
+    return len(content) // 4 + 1
+
+
+def _shorten(text, limit):
+    return text if len(text) <= limit else text[: limit - 3] + "..."
+
+
+def _is_tool_use_message(message):
+    return message["role"] == "assistant" and not isinstance(message["content"], str) and any(
+        _block_dict(block)["type"] == "tool_use" for block in message["content"]
+    )
+
+
+class TurnStats:
+    def __init__(self, full_tokens, sent_tokens, compacted_messages):
+        self.full_tokens = full_tokens
+        self.sent_tokens = sent_tokens
+        self.compacted_messages = compacted_messages
+
+    @property
+    def saved_tokens(self):
+        return self.full_tokens - self.sent_tokens
+
+
+class HistoryManager:
+    def __init__(self, token_budget=20_000, keep_recent=4, compact_to=0.5, max_note_chars=200):
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+        self.compact_to = compact_to
+        self.max_note_chars = max_note_chars
+        self.turns = []
+        self.reset()
+
+    def reset(self):
+        """Forget the compacted prefix, e.g. to start a new conversation"""
+        self._boundary = 0  # messages[:_boundary] are replaced by _compacted
+        self._compacted = []
+        self._compacted_tokens = 0
+        self._original_tokens = 0  # of messages[:_boundary]
+
+    def _note(self, assistant_message, result_message):
+        """Text notes standing in for one tool round"""
+        names = {}
+        assistant_lines, result_lines = [], []
+        for block in map(_block_dict, assistant_message["content"]):
+            if block["type"] == "text":
+                assistant_lines.append(block["text"])
+            elif block["type"] == "tool_use":
+                names[block["id"]] = block["name"]
+                arguments = _shorten(json.dumps(block["input"]), self.max_note_chars)
+                assistant_lines.append(f"Called {block['name']}({arguments})")
+        for block in map(_block_dict, result_message["content"]):
+            if block["type"] == "tool_result":
+                content = block.get("content", "")
+                if not isinstance(content, str):
+                    content = " ".join(part.get("text", "") for part in content)
+                outcome = "failed" if block.get("is_error") else "returned"
+                name = names.get(block["tool_use_id"], "tool")
+                result_lines.append(f"{name} {outcome} {_shorten(content, self.max_note_chars)}")
+            elif block["type"] == "text":
+                result_lines.append(block["text"])
+        return (
+            {"role": "assistant", "content": "\n".join(assistant_lines)},
+            {"role": "user", "content": "\n".join(result_lines)},
+        )
+
+    def _advance(self, messages, tail_tokens):
+        """Compact tool rounds after the boundary until the estimate is down
+        to `compact_to` of the budget, or only protected messages are left"""
+        target = self.token_budget * self.compact_to
+        protected = len(messages) - self.keep_recent
+        i = self._boundary
+        while i < protected and self._compacted_tokens + tail_tokens > target:
+            message = messages[i]
+            size = estimate_tokens(message)
+            if _is_tool_use_message(message) and i + 1 < protected:
+                notes = self._note(message, messages[i + 1])
+                next_size = estimate_tokens(messages[i + 1])
+                tail_tokens -= size + next_size
+                self._original_tokens += size + next_size
+                self._compacted.extend(notes)
+                self._compacted_tokens += sum(map(estimate_tokens, notes))
+                i += 2
+            elif _is_tool_use_message(message):
+                break  # its results are protected, so it stays a real tool_use
+            else:
+                tail_tokens -= size
+                self._original_tokens += size
+                self._compacted.append(message)
+                self._compacted_tokens += size
+                i += 1
+        self._boundary = i
+        return tail_tokens
+
+    def prepare(self, messages):
+        """The messages to send for this turn"""
+        if len(messages) < self._boundary:
+            self.reset()  # a different conversation
+
+        tail_tokens = sum(estimate_tokens(message) for message in messages[self._boundary :])
+        full_tokens = self._original_tokens + tail_tokens
+        before = self._boundary
+        if self._compacted_tokens + tail_tokens > self.token_budget:
+            tail_tokens = self._advance(messages, tail_tokens)
+
+        self.turns.append(
+            TurnStats(full_tokens, self._compacted_tokens + tail_tokens, self._boundary - before)
+        )
+        return self._compacted + messages[self._boundary :]
+
+    def summary(self):
+        lines = []
+        for number, turn in enumerate(self.turns, 1):
+            line = (
+                f"turn {number}: sent ~{turn.sent_tokens} of ~{turn.full_tokens} tokens, "
+                f"saved ~{turn.saved_tokens}"
+            )
+            if turn.compacted_messages:
+                line += f" (compacted {turn.compacted_messages} more messages)"
+            lines.append(line)
+        return "\n".join(lines)
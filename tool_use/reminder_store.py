@@ -0,0 +1,296 @@
+"""
+Durable reminders for the set_reminder tool.
+
+`ReminderStore` keeps reminders in a SQLite database in WAL mode, with a
+partial index on the due time of reminders that haven't fired yet, so "what
+is due now" is an index range scan however many reminders are pending.
+`add_many` inserts a whole batch (e.g. from one batch_tool call) in a single
+transaction.
+
+`ReminderScheduler` fires reminders when they come due. It keeps the
+`page_size` nearest pending reminders in a heap, so adding a reminder and
+popping the next due one are O(log n). Reminders further out stay on disk and
+are loaded a page at a time once the heap runs dry, so a million pending
+reminders don't have to fit in memory. Reminders added by another process
+sharing the database aren't in the heap; each wakeup also asks the database
+for the next due reminder, and wakeups are at most `poll_interval` apart.
+"""
+import heapq
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+
+def parse_timestamp(value):
+    """Seconds since the epoch for an ISO 8601 timestamp (naive ones are
+    local time) or a Unix timestamp"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    # fromisoformat only accepts a "Z" suffix from Python 3.11 on
+    if value.endswith(("Z", "z")):
+        value = value[:-1] + "+00:00"
+    return datetime.fromisoformat(value).timestamp()
+
+
+class ReminderStore:
+    def __init__(self, path="reminders.sqlite3"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connect(self):
+        # Opened lazily, so importing a module that creates a store is free
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS reminders (
+                    id INTEGER PRIMARY KEY,
+                    due REAL NOT NULL,
+                    content TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    fired REAL
+                )
+                """
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS reminders_pending_due "
+                "ON reminders (due, id) WHERE fired IS NULL"
+            )
+        return self._db
+
+    def add(self, content, timestamp):
+        """Store one reminder. Returns (id, due)"""
+        return self.add_many([(content, timestamp)])[0]
+
+    def add_many(self, reminders):
+        """Store (content, timestamp) pairs in one transaction. Returns a list
+        of (id, due), in input order"""
+        now = time.time()
+        rows = [(parse_timestamp(timestamp), content, now) for content, timestamp in reminders]
+        with self._lock:
+            db = self._connect()
+            with db:
+                # Take the write lock before reading the next id, in case
+                # another process shares the database
+                db.execute("BEGIN IMMEDIATE")
+                cursor = db.execute("SELECT COALESCE(MAX(id), 0) FROM reminders")
+                first_id = cursor.fetchone()[0] + 1
+                db.executemany(
+                    "INSERT INTO reminders (id, due, content, created) VALUES (?, ?, ?, ?)",
+                    [(first_id + i, *row) for i, row in enumerate(rows)],
+                )
+        return [(first_id + i, row[0]) for i, row in enumerate(rows)]
+
+    def due(self, now=None, limit=1000):
+        """Pending reminders due at or before `now`, oldest first, as
+        (due, id, content) tuples"""
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._connect().execute(
+                "SELECT due, id, content FROM reminders "
+                "WHERE fired IS NULL AND due <= ? ORDER BY due, id LIMIT ?",
+                (now, limit),
+            ).fetchall()
+
+    def pending_after(self, after=None, limit=1000):
+        """The next `limit` pending reminders after the (due, id) position
+        `after`, in due order, as (due, id, content) tuples"""
+        with self._lock:
+            db = self._connect()
+            if after is None:
+                return db.execute(
+                    "SELECT due, id, content FROM reminders "
+                    "WHERE fired IS NULL ORDER BY due, id LIMIT ?",
+                    (limit,),
+                ).fetchall()
+            return db.execute(
+                "SELECT due, id, content FROM reminders "
+                "WHERE fired IS NULL AND (due, id) > (?, ?) ORDER BY due, id LIMIT ?",
+                (*after, limit),
+            ).fetchall()
+
+    def next_due(self):
+        """Due time of the earliest pending reminder, or None"""
+        with self._lock:
+            return self._connect().execute(
+                "SELECT MIN(due) FROM reminders WHERE fired IS NULL"
+            ).fetchone()[0]
+
+    def mark_fired(self, ids):
+        now = time.time()
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.executemany(
+                    "UPDATE reminders SET fired = ? WHERE id = ?",
+                    [(now, reminder_id) for reminder_id in ids],
+                )
+
+    def pending_count(self):
+        with self._lock:
+            return self._connect().execute(
+                "SELECT COUNT(*) FROM reminders WHERE fired IS NULL"
+            ).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def print_reminder(due, content):
+    when = datetime.fromtimestamp(due).isoformat(sep=" ", timespec="seconds")
+    print(f"----\nReminder for {when}:\n{content}\n----")
+
+
+class ReminderScheduler:
+    """Fires reminders from a ReminderStore as they come due.
+
+    Call `fire_due()` from your own loop, or `start()` a background thread
+    that sleeps until the next reminder is due (or a sooner one is added).
+    """
+
+    def __init__(self, store, notify=print_reminder, page_size=10_000, poll_interval=1.0):
+        self.store = store
+        self.notify = notify
+        self.page_size = page_size
+        # Longest sleep of the background thread, so that reminders other
+        # processes add to the database are noticed
+        self.poll_interval = poll_interval
+        self._heap = []
+        # Ids being fired but not yet marked fired in the database
+        self._firing = set()
+        # (due, id) of the last reminder loaded into the heap, or None once
+        # every pending reminder is in the heap
+        self._loaded_through = None
+        self._loaded = False
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    def _load_page(self):
+        """Refill the heap from disk. Must be called with self._cond held"""
+        rows = self.store.pending_after(self._loaded_through, self.page_size)
+        for row in rows:
+            heapq.heappush(self._heap, row)
+        self._loaded = True
+        self._loaded_through = (
+            (rows[-1][0], rows[-1][1]) if len(rows) == self.page_size else None
+        )
+
+    def _ensure_loaded(self):
+        if not self._loaded or (not self._heap and self._loaded_through is not None):
+            self._load_page()
+
+    def add(self, content, timestamp):
+        """Store a reminder and schedule it. Returns (id, due)"""
+        return self.add_many([(content, timestamp)])[0]
+
+    def add_many(self, reminders):
+        """Store and schedule (content, timestamp) pairs in one transaction"""
+        with self._cond:
+            # Load first, so the new rows aren't also read back from disk
+            self._ensure_loaded()
+            added = self.store.add_many(reminders)
+            for (content, _), (reminder_id, due) in zip(reminders, added):
+                # Reminders past the loaded page are picked up from disk later
+                if self._loaded_through is None or (due, reminder_id) <= self._loaded_through:
+                    heapq.heappush(self._heap, (due, reminder_id, content))
+            self._cond.notify_all()
+        return added
+
+    def next_due(self):
+        """Due time of the next pending reminder, or None"""
+        with self._cond:
+            self._ensure_loaded()
+            return self._next_due()
+
+    def _next_due(self):
+        """Must be called with self._cond held"""
+        due = [self._heap[0][0]] if self._heap else []
+        # The database also has reminders added by other processes
+        stored = self.store.next_due()
+        if stored is not None:
+            due.append(stored)
+        return min(due, default=None)
+
+    def fire_due(self, now=None):
+        """Notify and mark fired every reminder due at or before `now`.
+        Returns the number fired."""
+        now = time.time() if now is None else now
+        fired = []
+        with self._cond:
+            self._ensure_loaded()
+            while True:
+                while self._heap and self._heap[0][0] <= now:
+                    fired.append(heapq.heappop(self._heap))
+                if self._heap or self._loaded_through is None:
+                    break
+                self._load_page()
+            # Due reminders that aren't in the heap were added by another
+            # process
+            seen = self._firing.union(reminder_id for _, reminder_id, _ in fired)
+            fired.extend(row for row in self.store.due(now, self.page_size) if row[1] not in seen)
+            fired.sort()
+            ids = [reminder_id for _, reminder_id, _ in fired]
+            self._firing.update(ids)
+
+        try:
+            for due, _, content in fired:
+                self.notify(due, content)
+            if fired:
+                self.store.mark_fired(ids)
+        finally:
+            with self._cond:
+                self._firing.difference_update(ids)
+        return len(fired)
+
+    def _run(self):
+        # An error (a failing notify, "database is locked" from another
+        # process) must not end the thread. The reminders weren't marked
+        # fired, so they are tried again after poll_interval
+        while True:
+            failed = False
+            try:
+                self.fire_due()
+            except Exception as e:
+                print(f"Error firing reminders: {e!r}")
+                failed = True
+            with self._cond:
+                if self._stopping:
+                    return
+                timeout = self.poll_interval
+                if not failed:
+                    try:
+                        next_due = self._next_due()
+                    except sqlite3.Error as e:
+                        print(f"Error reading reminders: {e!r}")
+                        next_due = None
+                    if next_due is not None:
+                        timeout = min(timeout, max(0.0, next_due - time.time()))
+                self._cond.wait(timeout)
+                if self._stopping:
+                    return
+
+    def start(self):
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
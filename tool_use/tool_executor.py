@@ -0,0 +1,138 @@
+"""
+Parallel tool execution.
+
+When Claude asks for several tools in one turn (several tool_use blocks, or
+one batch_tool call), the tools are independent, so `ToolExecutor` runs them
+on a thread pool instead of one after another. Outcomes come back in the
+order the calls were made, so tool_result blocks still line up with their
+tool_use_ids.
+
+* `timeouts` maps a tool name to its time budget in seconds, counted from
+  when the call is submitted; `default_timeout` applies to the rest. A call
+  that runs over gets a ToolTimeoutError. Python can't kill a thread, so the
+  tool itself keeps running in the background until it returns.
+* `max_concurrency` maps a tool name to how many calls of it may run at the
+  same time, e.g. for a tool that wraps a rate-limited API.
+* `run_many(tool_name, tool_inputs)` runs several inputs of one tool as a
+  single call (see ToolRegistry.run_many). `ToolSession.submit_many` sends
+  them through it, with the tool's timeout and concurrency limit, as for
+  one call.
+"""
+import concurrent.futures
+import threading
+import time
+
+
+class ToolTimeoutError(TimeoutError):
+    pass
+
+
+class ToolExecutor:
+    def __init__(
+        self,
+        run_tool,
+        max_workers=8,
+        default_timeout=30.0,
+        timeouts=None,
+        max_concurrency=None,
+        run_many=None,
+    ):
+        self.run_tool = run_tool
+        self.run_many = run_many
+        self.max_workers = max_workers
+        self.default_timeout = default_timeout
+        self.timeouts = dict(timeouts or {})
+        self._semaphores = {
+            name: threading.BoundedSemaphore(limit)
+            for name, limit in (max_concurrency or {}).items()
+        }
+
+    def timeout_for(self, tool_name):
+        return self.timeouts.get(tool_name, self.default_timeout)
+
+    def _call(self, tool_name, tool_input, run=None):
+        run = run or self.run_tool
+        semaphore = self._semaphores.get(tool_name)
+        if semaphore is None:
+            return run(tool_name, tool_input)
+        with semaphore:
+            return run(tool_name, tool_input)
+
+    def session(self, max_workers=None):
+        """A ToolSession for submitting calls one at a time, e.g. as their
+        tool_use blocks finish streaming. Use as a context manager."""
+        return ToolSession(self, max_workers or self.max_workers)
+
+    def run_all(self, calls):
+        """Run (tool_name, tool_input) calls concurrently.
+
+        Returns one (output, error) pair per call, in call order; error is
+        None when the tool succeeded.
+        """
+        if not calls:
+            return []
+
+        with self.session(min(self.max_workers, len(calls))) as session:
+            pending = [
+                session.submit(tool_name, tool_input)
+                for tool_name, tool_input in calls
+            ]
+            return [call.outcome() for call in pending]
+
+
+class PendingToolCall:
+    def __init__(self, tool_name, future, timeout):
+        self.tool_name = tool_name
+        self.future = future
+        self.timeout = timeout
+        self.submitted = time.monotonic()
+
+    def outcome(self):
+        """Wait for the call. Returns (output, error); error is None on success"""
+        remaining = (
+            None
+            if self.timeout is None
+            else max(0.0, self.submitted + self.timeout - time.monotonic())
+        )
+        concurrent.futures.wait([self.future], timeout=remaining)
+        if not self.future.done():
+            self.future.cancel()
+            error = ToolTimeoutError(f"{self.tool_name} timed out after {self.timeout}s")
+            return None, error
+        if self.future.exception() is not None:
+            return None, self.future.exception()
+        return self.future.result(), None
+
+
+class ToolSession:
+    """Thread pool for the tool calls of one turn (or one batch_tool call).
+
+    Each session gets its own pool, so a tool that fans out again
+    (batch_tool) never waits on workers that are busy waiting for it.
+    """
+
+    def __init__(self, executor, max_workers):
+        self.executor = executor
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(self, tool_name, tool_input):
+        future = self._pool.submit(self.executor._call, tool_name, tool_input)
+        return PendingToolCall(tool_name, future, self.executor.timeout_for(tool_name))
+
+    def submit_many(self, tool_name, tool_inputs):
+        """Submit several inputs of one tool as one call to the executor's
+        `run_many`. Its outcome's output is the list of outputs"""
+        future = self._pool.submit(
+            self.executor._call, tool_name, tool_inputs, self.executor.run_many
+        )
+        return PendingToolCall(tool_name, future, self.executor.timeout_for(tool_name))
+
+    def close(self):
+        # Don't block on tools that timed out
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
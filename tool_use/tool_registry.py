@@ -0,0 +1,202 @@
+"""
+Tool registry: one place that knows every tool's schema and implementation.
+
+    registry = ToolRegistry()
+
+    @registry.tool(get_current_datetime_schema)
+    def get_current_datetime(date_format="%Y-%m-%d %H:%M:%S"):
+        ...
+
+    registry.run("get_current_datetime", {"date_format": "%H:%M"})
+    chat(messages, tools=registry.schemas())
+
+Dispatch is a dict lookup. Each tool's `input_schema` is compiled into a
+validator once, when the tool is registered, so a call only runs the checks
+that schema needs. The supported subset is what tool schemas use in practice:
+`type`, `properties`, `required`, `items`, `enum` and `additionalProperties`.
+
+Unknown tools raise UnknownToolError, and inputs that don't match the schema
+raise ToolValidationError, instead of silently returning None.
+
+A tool can also have a bulk implementation, registered with `@registry.bulk`,
+that takes a list of inputs and returns a list of outputs. `run_many` uses it
+so that e.g. the set_reminder calls of one batch_tool call are stored in a
+single transaction.
+
+Tools registered with `read_only=True` have no side effects, so they may be
+started before it is known whether the model's turn really asks for them
+(see run_conversation_streaming).
+"""
+
+_JSON_TYPES = {
+    "string": (str,),
+    "number": (int, float),
+    "integer": (int,),
+    "boolean": (bool,),
+    "array": (list, tuple),
+    "object": (dict,),
+    "null": (type(None),),
+}
+
+
+class UnknownToolError(LookupError):
+    pass
+
+
+class ToolValidationError(ValueError):
+    pass
+
+
+def compile_validator(schema, path="input"):
+    """Build a function that raises ToolValidationError for a value that
+    doesn't match `schema`"""
+    checks = []
+
+    schema_type = schema.get("type")
+    if schema_type is not None:
+        allowed = _JSON_TYPES[schema_type]
+        # bool is an int subclass, but JSON true/false are not numbers
+        reject_bool = schema_type in ("number", "integer")
+
+        def check_type(value):
+            if not isinstance(value, allowed) or (
+                reject_bool and isinstance(value, bool)
+            ):
+                raise ToolValidationError(
+                    f"{path} must be of type {schema_type}, got {type(value).__name__}"
+                )
+
+        checks.append(check_type)
+
+    if "enum" in schema:
+        options = list(schema["enum"])
+
+        def check_enum(value):
+            if value not in options:
+                raise ToolValidationError(f"{path} must be one of {options}")
+
+        checks.append(check_enum)
+
+    if schema_type == "object":
+        required = tuple(schema.get("required", ()))
+        properties = {
+            name: compile_validator(subschema, f"{path}.{name}")
+            for name, subschema in schema.get("properties", {}).items()
+        }
+        additional = schema.get("additionalProperties", True)
+
+        def check_object(value):
+            for name in required:
+                if name not in value:
+                    raise ToolValidationError(f"{path}.{name} is required")
+            for name, item in value.items():
+                validate = properties.get(name)
+                if validate is not None:
+                    validate(item)
+                elif additional is False:
+                    raise ToolValidationError(f"{path}.{name} is not allowed")
+
+        checks.append(check_object)
+
+    if schema_type == "array" and "items" in schema:
+        validate_item = compile_validator(schema["items"], f"{path}[]")
+
+        def check_items(value):
+            for item in value:
+                validate_item(item)
+
+        checks.append(check_items)
+
+    def validate(value):
+        for check in checks:
+            check(value)
+
+    return validate
+
+
+class Tool:
+    def __init__(self, schema, function=None, read_only=False):
+        self.name = schema["name"]
+        self.schema = schema
+        self.function = function
+        self.read_only = read_only
+        self.bulk_function = None
+        self.validate = compile_validator(schema["input_schema"])
+
+
+class ToolRegistry:
+    def __init__(self):
+        self._tools = {}
+
+    def register(self, schema, function=None, read_only=False):
+        """Register a tool. Without a function the tool is schema-only: it
+        can be offered to the model (e.g. for structured output) but not run.
+        `read_only` marks a tool without side effects. Registering a name
+        again replaces the earlier tool."""
+        tool = Tool(schema, function, read_only)
+        self._tools[tool.name] = tool
+        return tool
+
+    def tool(self, schema, read_only=False):
+        """Decorator form of register()"""
+
+        def decorator(function):
+            self.register(schema, function, read_only)
+            return function
+
+        return decorator
+
+    def bulk(self, name):
+        """Decorator registering a bulk implementation for the tool `name`:
+        a function taking a list of input dicts and returning a list of
+        outputs in the same order"""
+
+        def decorator(function):
+            self.get(name).bulk_function = function
+            return function
+
+        return decorator
+
+    def get(self, name):
+        try:
+            return self._tools[name]
+        except KeyError:
+            raise UnknownToolError(f"Unknown tool: {name}") from None
+
+    def is_read_only(self, name):
+        return name in self._tools and self._tools[name].read_only
+
+    def __contains__(self, name):
+        return name in self._tools
+
+    def names(self):
+        return list(self._tools)
+
+    def schemas(self, *names):
+        """Schemas for the tools list of a request: the named tools, or all"""
+        if not names:
+            return [tool.schema for tool in self._tools.values()]
+        return [self.get(name).schema for name in names]
+
+    def run(self, name, tool_input):
+        """Validate `tool_input` against the tool's schema and call it"""
+        tool = self.get(name)
+        if tool.function is None:
+            raise UnknownToolError(f"Tool {name} has no implementation")
+        tool.validate(tool_input)
+        return tool.function(**tool_input)
+
+    def has_bulk(self, name):
+        return name in self._tools and self._tools[name].bulk_function is not None
+
+    def run_many(self, name, tool_inputs):
+        """Validate every input, then run them all with the tool's bulk
+        implementation, or one by one if it has none"""
+        tool = self.get(name)
+        if tool.function is None and tool.bulk_function is None:
+            raise UnknownToolError(f"Tool {name} has no implementation")
+        for tool_input in tool_inputs:
+            tool.validate(tool_input)
+        if tool.bulk_function is not None:
+            return tool.bulk_function(tool_inputs)
+        return [tool.function(**tool_input) for tool_input in tool_inputs]
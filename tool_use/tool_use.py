@@ -10,6 +10,11 @@ from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from anthropic.types import ToolParam, Message
 from anthropic import Anthropic
+from datetime_bulk import add_durations
+from history import HistoryManager
+from reminder_store import ReminderScheduler, ReminderStore
+from tool_executor import ToolExecutor
+from tool_registry import ToolRegistry
 import json
 import os
 
@@ -21,6 +26,9 @@ _ = load_dotenv(override=True)
 client = Anthropic()
 model = os.environ['CLAUDE_MODEL']
 
+# Every tool's schema and implementation, see tool_registry.py
+registry = ToolRegistry()
+
 
 ################# Helper functions #################
 
@@ -38,38 +46,25 @@ def add_assistant_message(messages, message):
     messages.append(assistant_message)
 
 
-def run_batch(invocations=[]):
-    batch_output = []
-
-    for invocation in invocations:
-        name = invocation["name"]
-        args = json.loads(invocation["arguments"])
-
-        tool_output = run_tool(name, args)
+def run_tool(tool_name, tool_input):
+    """Runs the selected tool. Raises for unknown tools and invalid input"""
+    return registry.run(tool_name, tool_input)
 
-        batch_output.append({"tool_name": name, "output": tool_output})
 
-    return batch_output
+# Runs the tool calls of one turn (or one batch_tool call) in parallel.
+# Per-tool limits go in `timeouts` and `max_concurrency`, keyed by tool name.
+tool_executor = ToolExecutor(
+    run_tool, max_workers=8, default_timeout=30.0, run_many=registry.run_many
+)
 
+# Reminders are stored on disk and fired by the scheduler once it is started,
+# see reminder_store.py
+reminder_store = ReminderStore("reminders.sqlite3")
+reminder_scheduler = ReminderScheduler(reminder_store)
 
-def run_tool(tool_name, tool_input):
-    """Runs the selected tool"""
-    if tool_name == "get_current_datetime":
-        return get_current_datetime(**tool_input)
-    elif tool_name == "add_duration_to_datetime":
-        return add_duration_to_datetime(**tool_input)
-    elif tool_name == "set_reminder":
-        return set_reminder(**tool_input)
-    elif tool_name == "batch_tool":
-        return run_batch(**tool_input)
-
-
-################## TOOL functions ##################
-def get_current_datetime(date_format="%Y-%m-%d %H:%M:%S"):
-    if not date_format:
-        raise ValueError("date_format must be provided")
-    return datetime.now().strftime(date_format)
 
+################## TOOLS ##################
+# Each tool's schema, followed by its implementation
 
 get_current_datetime_schema = ToolParam(
     {
@@ -90,6 +85,42 @@ get_current_datetime_schema = ToolParam(
 )
 
 
+@registry.tool(get_current_datetime_schema, read_only=True)
+def get_current_datetime(date_format="%Y-%m-%d %H:%M:%S"):
+    if not date_format:
+        raise ValueError("date_format must be provided")
+    return datetime.now().strftime(date_format)
+
+
+add_duration_to_datetime_schema = {
+    "name": "add_duration_to_datetime",
+    "description": "Adds a specified duration to a datetime string and returns the resulting datetime in a detailed format. This tool converts an input datetime string to a Python datetime object, adds the specified duration in the requested unit, and returns a formatted string of the resulting datetime. It handles various time units including seconds, minutes, hours, days, weeks, months, and years, with special handling for month and year calculations to account for varying month lengths and leap years. The output is always returned in a detailed format that includes the day of the week, month name, day, year, and time with AM/PM indicator (e.g., 'Thursday, April 03, 2025 10:30:00 AM').",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "datetime_str": {
+                "type": "string",
+                "description": "The input datetime string to which the duration will be added. This should be formatted according to the input_format parameter.",
+            },
+            "duration": {
+                "type": "number",
+                "description": "The amount of time to add to the datetime. Can be positive (for future dates) or negative (for past dates). Defaults to 0.",
+            },
+            "unit": {
+                "type": "string",
+                "description": "The unit of time for the duration. Must be one of: 'seconds', 'minutes', 'hours', 'days', 'weeks', 'months', or 'years'. Defaults to 'days'.",
+            },
+            "input_format": {
+                "type": "string",
+                "description": "The format string for parsing the input datetime_str, using Python's strptime format codes. For example, '%Y-%m-%d' for ISO format dates like '2025-04-03'. Defaults to '%Y-%m-%d'.",
+            },
+        },
+        "required": ["datetime_str"],
+    },
+}
+
+
+@registry.tool(add_duration_to_datetime_schema, read_only=True)
 def add_duration_to_datetime(
     datetime_str, duration=0, unit="days", input_format="%Y-%m-%d"
 ):
@@ -138,39 +169,17 @@ def add_duration_to_datetime(
     return new_date.strftime("%A, %B %d, %Y %I:%M:%S %p")
 
 
-def set_reminder(content, timestamp):
-    print(f"----\nSetting the following reminder for {timestamp}:\n{content}\n----")
-
-
+@registry.bulk("add_duration_to_datetime")
+def add_durations_to_datetimes(tool_inputs):
+    """Vectorized add_duration_to_datetime for batch_tool, see datetime_bulk.py"""
+    return add_durations(
+        [tool_input["datetime_str"] for tool_input in tool_inputs],
+        [tool_input.get("duration", 0) for tool_input in tool_inputs],
+        [tool_input.get("unit", "days") for tool_input in tool_inputs],
+        [tool_input.get("input_format", "%Y-%m-%d") for tool_input in tool_inputs],
+        scalar=add_duration_to_datetime,
+    )
 
-#################### TOOL schemas ##################
-
-add_duration_to_datetime_schema = {
-    "name": "add_duration_to_datetime",
-    "description": "Adds a specified duration to a datetime string and returns the resulting datetime in a detailed format. This tool converts an input datetime string to a Python datetime object, adds the specified duration in the requested unit, and returns a formatted string of the resulting datetime. It handles various time units including seconds, minutes, hours, days, weeks, months, and years, with special handling for month and year calculations to account for varying month lengths and leap years. The output is always returned in a detailed format that includes the day of the week, month name, day, year, and time with AM/PM indicator (e.g., 'Thursday, April 03, 2025 10:30:00 AM').",
-    "input_schema": {
-        "type": "object",
-        "properties": {
-            "datetime_str": {
-                "type": "string",
-                "description": "The input datetime string to which the duration will be added. This should be formatted according to the input_format parameter.",
-            },
-            "duration": {
-                "type": "number",
-                "description": "The amount of time to add to the datetime. Can be positive (for future dates) or negative (for past dates). Defaults to 0.",
-            },
-            "unit": {
-                "type": "string",
-                "description": "The unit of time for the duration. Must be one of: 'seconds', 'minutes', 'hours', 'days', 'weeks', 'months', or 'years'. Defaults to 'days'.",
-            },
-            "input_format": {
-                "type": "string",
-                "description": "The format string for parsing the input datetime_str, using Python's strptime format codes. For example, '%Y-%m-%d' for ISO format dates like '2025-04-03'. Defaults to '%Y-%m-%d'.",
-            },
-        },
-        "required": ["datetime_str"],
-    },
-}
 
 set_reminder_schema = {
     "name": "set_reminder",
@@ -191,6 +200,26 @@ set_reminder_schema = {
     },
 }
 
+
+@registry.tool(set_reminder_schema)
+def set_reminder(content, timestamp):
+    return set_reminders([{"content": content, "timestamp": timestamp}])[0]
+
+
+@registry.bulk("set_reminder")
+def set_reminders(reminders):
+    """Stores all the reminders in one transaction"""
+    added = reminder_scheduler.add_many(
+        [(reminder["content"], reminder["timestamp"]) for reminder in reminders]
+    )
+    for reminder in reminders:
+        print(f"----\nSetting the following reminder for {reminder['timestamp']}:\n{reminder['content']}\n----")
+    return [
+        {"reminder_id": reminder_id, "due": datetime.fromtimestamp(due).isoformat()}
+        for reminder_id, due in added
+    ]
+
+
 batch_tool_schema = {
     "name": "batch_tool",
     "description": "Invoke multiple other tool calls simultaneously",
@@ -220,7 +249,55 @@ batch_tool_schema = {
     },
 }
 
-pass
+
+@registry.tool(batch_tool_schema)
+def run_batch(invocations=[]):
+    """Runs the invocations concurrently; outputs keep the invocation order.
+    Invocations of a tool with a bulk implementation (set_reminder,
+    add_duration_to_datetime) are run together in one call, under that
+    tool's timeout like any other call."""
+    calls = [
+        (invocation["name"], json.loads(invocation["arguments"]))
+        for invocation in invocations
+    ]
+    if not calls:
+        return []
+    outcomes = [None] * len(calls)
+
+    bulk_calls = {}
+    single_calls = []
+    for i, (name, _) in enumerate(calls):
+        if registry.has_bulk(name):
+            bulk_calls.setdefault(name, []).append(i)
+        else:
+            single_calls.append(i)
+
+    workers = min(tool_executor.max_workers, len(bulk_calls) + len(single_calls))
+    with tool_executor.session(workers) as session:
+        pending_bulk = [
+            (indexes, session.submit_many(name, [calls[i][1] for i in indexes]))
+            for name, indexes in bulk_calls.items()
+        ]
+        pending = [(i, session.submit(*calls[i])) for i in single_calls]
+        for indexes, call in pending_bulk:
+            outputs, error = call.outcome()
+            for position, i in enumerate(indexes):
+                # A bulk call succeeds or fails as a whole
+                outcomes[i] = (None, error) if error is not None else (outputs[position], None)
+        for i, call in pending:
+            outcomes[i] = call.outcome()
+
+    batch_output = []
+    for (name, _), (tool_output, error) in zip(calls, outcomes):
+        if error is not None:
+            raise error
+        batch_output.append({"tool_name": name, "output": tool_output})
+
+    return batch_output
+
+
+#################### Schema-only tools ##################
+# Offered to the model for structured output, never run
 
 article_summary_schema = {
     "name": "article_summary",
@@ -246,10 +323,12 @@ article_summary_schema = {
     },
 }
 
+registry.register(article_summary_schema)
+
 
 ################## Chat and conversation functions ##################
 
-def chat(messages, system=None, temperature=0.0, max_tokens=1000, stop_sequences=[], tools=None, tool_choice=None):
+def chat_params(messages, system=None, temperature=0.0, max_tokens=1000, stop_sequences=[], tools=None):
 
     params = {
         "model": model,
@@ -264,6 +343,11 @@ def chat(messages, system=None, temperature=0.0, max_tokens=1000, stop_sequences
     if system:
         params["system"] = system
 
+    return params
+
+
+def chat(messages, system=None, temperature=0.0, max_tokens=1000, stop_sequences=[], tools=None, tool_choice=None):
+    params = chat_params(messages, system, temperature, max_tokens, stop_sequences, tools)
     message = client.messages.create(**params)
     return message
 
@@ -279,36 +363,46 @@ def run_tools(message):
     ]
     tool_result_blocks = []
 
-    for tool_request in tool_requests:
-
-            try:
-                tool_output = run_tool(tool_request.name, tool_request.input)
-                tool_result_block = {
-                    "type": "tool_result",
-                    "tool_use_id": tool_request.id,
-                    "content": json.dumps(tool_output),
-                    "is_error": False
-                }
-            except Exception as e:
-                tool_result_block = {
-                    "type": "tool_result",
-                    "tool_use_id": tool_request.id,
-                    "content": f"error: {e}",
-                    "is_error": True
-                }
-
-            tool_result_blocks.append(tool_result_block)
+    # All requested tools run at once; results stay in tool_use order
+    outcomes = tool_executor.run_all(
+        [(tool_request.name, tool_request.input) for tool_request in tool_requests]
+    )
+
+    for tool_request, (tool_output, error) in zip(tool_requests, outcomes):
+        tool_result_blocks.append(
+            make_tool_result(tool_request.id, tool_output, error)
+        )
 
     return tool_result_blocks     
 
 
-def run_conversation(messages):
+def make_tool_result(tool_use_id, tool_output, error=None):
+    if error is None:
+        return {
+            "type": "tool_result",
+            "tool_use_id": tool_use_id,
+            "content": json.dumps(tool_output),
+            "is_error": False
+        }
+    return {
+        "type": "tool_result",
+        "tool_use_id": tool_use_id,
+        "content": f"error: {error}",
+        "is_error": True
+    }
+
+
+def run_conversation(messages, history=None):
+    """Runs the tool loop until Claude stops asking for tools. Pass a
+    HistoryManager as `history` to send a compacted history once the
+    conversation outgrows its token budget; `messages` keeps everything."""
     while True:
-        response = chat(messages, tools=[
-            get_current_datetime_schema,
-            add_duration_to_datetime_schema,
-            set_reminder_schema
-            ])
+        sent = history.prepare(messages) if history else messages
+        response = chat(sent, tools=registry.schemas(
+            "get_current_datetime",
+            "add_duration_to_datetime",
+            "set_reminder",
+            ))
 
         add_assistant_message(messages, response)
 
@@ -321,6 +415,81 @@ def run_conversation(messages):
     return messages
 
 
+def stream_and_dispatch(params, session):
+    """Streams one response and submits each tool_use block of a read-only
+    tool to `session` as soon as the block is complete, while later blocks
+    are still streaming. Other tools have side effects, so they are left for
+    the caller to run once the turn has ended with stop_reason "tool_use".
+
+    Returns (final message, {tool_use_id: PendingToolCall}).
+    """
+    pending = {}
+    tool_blocks = {}  # content block index -> (id, name, partial JSON chunks)
+
+    with client.messages.stream(**params) as stream:
+        for event in stream:
+            if event.type == "content_block_start":
+                if event.content_block.type == "tool_use":
+                    block = event.content_block
+                    tool_blocks[event.index] = (block.id, block.name, [])
+            elif event.type == "content_block_delta":
+                if event.delta.type == "input_json_delta" and event.index in tool_blocks:
+                    tool_blocks[event.index][2].append(event.delta.partial_json)
+            elif event.type == "content_block_stop" and event.index in tool_blocks:
+                tool_use_id, name, chunks = tool_blocks.pop(event.index)
+                if not registry.is_read_only(name):
+                    continue
+                try:
+                    tool_input = json.loads("".join(chunks) or "{}")
+                except json.JSONDecodeError:
+                    # Cut off mid-block (e.g. max_tokens); never dispatched
+                    continue
+                pending[tool_use_id] = session.submit(name, tool_input)
+
+        return stream.get_final_message(), pending
+
+
+def run_conversation_streaming(messages, history=None):
+    """Same conversation loop as run_conversation, on a streamed response.
+
+    Each read-only tool starts as soon as its tool_use block has finished
+    streaming, so in a multi-tool turn the first tools run while the model
+    is still writing the later ones. Tools with side effects (set_reminder,
+    batch_tool) only start once the turn has ended with stop_reason
+    "tool_use", as in run_conversation, so a turn cut off by max_tokens
+    never half-runs them. The messages appended are the same as
+    run_conversation's.
+    """
+    while True:
+        sent = history.prepare(messages) if history else messages
+        params = chat_params(sent, tools=registry.schemas(
+            "get_current_datetime",
+            "add_duration_to_datetime",
+            "set_reminder",
+            ))
+
+        with tool_executor.session() as session:
+            response, pending = stream_and_dispatch(params, session)
+            add_assistant_message(messages, response)
+
+            if response.stop_reason != "tool_use":
+                break
+
+            tool_blocks = [block for block in response.content if block.type == "tool_use"]
+            for block in tool_blocks:
+                if block.id not in pending:
+                    pending[block.id] = session.submit(block.name, block.input)
+
+            tool_results = []
+            for block in tool_blocks:
+                tool_output, error = pending[block.id].outcome()
+                tool_results.append(make_tool_result(block.id, tool_output, error))
+
+        add_user_message(messages, tool_results)
+
+    return messages
+
+
 ################## MAIN CODE ##################
 
 if __name__ == "__main__":
@@ -334,5 +503,11 @@ if __name__ == "__main__":
         """
     )
 
-    response = run_conversation(messages)
+    # Fires reminders in the background as they come due; these are already
+    # past, so they fire as soon as they are set
+    reminder_scheduler.start()
+    history = HistoryManager(token_budget=20_000)
+    response = run_conversation(messages, history)
     print(response)
+    print(history.summary())
+    reminder_scheduler.stop()